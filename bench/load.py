@@ -0,0 +1,177 @@
+"""Load test of the multi-worker HTTP serving mode (``server.serve``).
+
+For each worker count, the server is started as a separate process
+(``python -m server.serve``) in snapshot mode, its workers sharing one
+memory-mapped snapshot of the stand-in rows, and loaded by several client
+processes sending stateless MCP ``tools/call`` requests back to back over
+HTTP for a fixed duration. The scenarios are those of ``bench.run``, called
+in turn.
+
+Throughput should grow roughly linearly with the number of workers as long
+as there are free cores for them and for the clients::
+
+    python -m bench.load --workers 1,2,4 --clients 4 --duration 10
+
+The table shows, per worker count, the calls per second, the speedup over
+the first worker count, and the latency percentiles; ``--output`` writes
+it as JSON with the commit and the CPU count.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+from bench.run import SCENARIOS, git_commit, percentile
+from bench.standin import DATASET_PATH, create_app, free_port, sample_rows, serve
+
+HEADERS = {"Accept": "application/json, text/event-stream", "Content-Type": "application/json"}
+
+
+@contextmanager
+def server_process(workers: int, base_url: str, snapshot_path: str) -> Iterator[str]:
+    """Run ``python -m server.serve`` until all its workers are ready, yielding its MCP URL."""
+    port = free_port()
+    env = {
+        **os.environ,
+        "AGRIBALYSE_BASE_URL": base_url,
+        "AGRIBALYSE_HOST": "127.0.0.1",
+        "AGRIBALYSE_PORT": str(port),
+        "AGRIBALYSE_WORKERS": str(workers),
+        "AGRIBALYSE_SNAPSHOT": "1",
+        "AGRIBALYSE_SNAPSHOT_PATH": snapshot_path,
+        "AGRIBALYSE_SNAPSHOT_REFRESH": "0",
+        "AGRIBALYSE_CACHE": "0",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "server.serve"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_ready(f"http://127.0.0.1:{port}", workers, process)
+        yield f"http://127.0.0.1:{port}/mcp"
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+
+def wait_ready(root: str, workers: int, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    """Poll /readyz on new connections until ``workers`` distinct workers answered ready."""
+    ready = set()
+    deadline = time.monotonic() + timeout
+    while len(ready) < workers:
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError(f"The server did not get ready ({len(ready)}/{workers} workers)")
+        try:
+            response = httpx.get(f"{root}/readyz", timeout=5)
+            if response.status_code == 200:
+                ready.add(response.json()["pid"])
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+
+
+async def drive(url: str, concurrency: int, duration: float, scenarios: List[str]) -> dict:
+    """Call the scenarios back to back from ``concurrency`` tasks for ``duration`` seconds."""
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def worker(offset: int) -> None:
+            nonlocal errors
+            i = offset
+            while time.perf_counter() < deadline:
+                tool, arguments = SCENARIOS[scenarios[i % len(scenarios)]]
+                body = {"jsonrpc": "2.0", "id": i, "method": "tools/call", "params": {"name": tool, "arguments": arguments}}
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, json=body, headers=HEADERS)
+                    ok = response.status_code == 200 and '"result"' in response.text and '"isError":true' not in response.text
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += not ok
+                i += 1
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return {"latencies": latencies, "errors": errors}
+
+
+def _client(url: str, concurrency: int, duration: float, scenarios: List[str], results) -> None:
+    results.put(asyncio.run(drive(url, concurrency, duration, scenarios)))
+
+
+def load(url: str, clients: int, concurrency: int, duration: float, scenarios: List[str]) -> dict:
+    """Load the server from ``clients`` processes and merge their results."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(target=_client, args=(url, concurrency, duration, scenarios, results)) for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    merged = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    latencies = sorted(latency for result in merged for latency in result["latencies"])
+    return {
+        "calls": len(latencies),
+        "errors": sum(result["errors"] for result in merged),
+        "throughput": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+
+
+def print_table(results: List[dict]) -> None:
+    print(f"{'workers':>7}  {'calls/s':>9}  {'speedup':>7}  {'p50 ms':>8}  {'p99 ms':>8}  {'errors':>6}")
+    base = results[0]["throughput"] if results else 0
+    for r in results:
+        speedup = r["throughput"] / base if base else 0.0
+        print(f"{r['workers']:>7}  {r['throughput']:>9.1f}  {speedup:>6.2f}x  "
+              f"{r['p50_ms']:>8.2f}  {r['p99_ms']:>8.2f}  {r['errors']:>6}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load test of the multi-worker HTTP serving mode.")
+    parser.add_argument("--workers", type=lambda s: [int(w) for w in s.split(",")], default=[1, 2, 4],
+                        help="comma-separated worker counts (default: 1,2,4)")
+    parser.add_argument("--clients", type=int, default=4, help="client processes (default: 4)")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight per client (default: 16)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per worker count")
+    parser.add_argument("--scale", type=int, default=50, help="repeat the sample rows this many times (default: 50)")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","),
+                        default=["get_products_by_code", "resolve_product", "get_grouped_metrics", "read_lines_q"],
+                        help=f"scenarios called in turn, among {', '.join(SCENARIOS)}")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results: List[Dict] = []
+    with serve(create_app(sample_rows(args.scale))) as root, tempfile.TemporaryDirectory() as snapshot_path:
+        for workers in args.workers:
+            with server_process(workers, root + DATASET_PATH, snapshot_path) as url:
+                result = load(url, args.clients, args.concurrency, args.duration, args.scenarios)
+            results.append({"workers": workers, **result})
+    print_table(results)
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "cpus": os.cpu_count(),
+            "parameters": {k: v for k, v in vars(args).items() if k != "output"},
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
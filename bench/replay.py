@@ -0,0 +1,102 @@
+"""Replay recorded upstream traffic through the server's request path.
+
+Every request of a cassette (see ``server.cassette``) is sent again, in the
+recorded order, through ``server.server.fetch``: the local snapshot when
+one is loaded, then the response cache, coalescing and the HTTP client,
+which replays the cassette instead of reaching the network. Each answer is
+compared with the recorded response, and the time it took with the
+recorded latency, so a change of the caching layer or of the local engine
+can be checked against real traffic::
+
+    AGRIBALYSE_CASSETTE=traffic.jsonl AGRIBALYSE_CASSETTE_MODE=record python -m server.server
+    python -m bench.replay traffic.jsonl --snapshot --cache
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Any, List, Optional
+
+from bench.run import percentile
+from server import snapshot, upstream
+from server.export import split_next
+from server.snapshot import TRANSIENT_FIELDS
+
+
+def normalize(result: Any) -> Any:
+    """Drop what legitimately differs between two answers (scores, next links)."""
+    if isinstance(result, dict):
+        result = {k: v for k, v in result.items() if k not in ("next", "status_code")}
+        if isinstance(result.get("results"), list):
+            result["results"] = [
+                {k: v for k, v in row.items() if k not in TRANSIENT_FIELDS} if isinstance(row, dict) else row
+                for row in result["results"]
+            ]
+        if "error" in result:
+            result = {"error": True}
+    return result
+
+
+def _latencies(values: List[float]) -> dict:
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "total_s": round(sum(values), 3),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+    }
+
+
+async def replay(path: str, use_snapshot: bool = False, cache: bool = False, latency: bool = False) -> dict:
+    from server.server import fetch
+
+    upstream.configure(cassette=path, cassette_mode="replay", cassette_latency=latency)
+    upstream.response_cache.enabled = cache
+    if use_snapshot:
+        await asyncio.to_thread(snapshot.load)
+    upstream.cassette().rewind()
+    recorded = list(upstream.cassette().entries())
+
+    timings, original, mismatches = [], [], []
+    local = 0
+    for entry in recorded:
+        if entry["method"] != "GET" or entry.get("conditional"):
+            continue
+        request_path, params = split_next(entry["url"])
+        answered_locally = snapshot.answer(request_path, params) is not None
+        start = time.perf_counter()
+        result = await fetch(request_path, params)
+        timings.append(time.perf_counter() - start)
+        original.append(entry["elapsed"])
+        local += answered_locally
+        expected = json.loads(entry["body"]) if entry["status"] < 400 else {"error": True}
+        if normalize(result) != normalize(expected):
+            mismatches.append(entry["url"])
+    await upstream.aclose()
+    return {
+        "requests": len(timings),
+        "local_answers": local,
+        "mismatches": len(mismatches),
+        "mismatched_urls": mismatches[:20],
+        "recorded": _latencies(original),
+        "replayed": _latencies(timings),
+        "cache": upstream.response_cache.stats(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay a cassette of upstream traffic through the server.")
+    parser.add_argument("cassette", help="JSON Lines file recorded with AGRIBALYSE_CASSETTE_MODE=record")
+    parser.add_argument("--snapshot", action="store_true", help="load the snapshot (from the cassette) first")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--latency", action="store_true", help="replay upstream responses with their recorded latency")
+    args = parser.parse_args(argv)
+    report = asyncio.run(replay(args.cassette, args.snapshot, args.cache, args.latency))
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+
+if __name__ == "__main__":
+    main()
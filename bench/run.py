@@ -0,0 +1,235 @@
+"""Throughput and latency benchmark of the MCP tools, against the local stand-in.
+
+Each scenario calls one tool with fixed arguments. It runs in two modes:
+
+- direct: the tool coroutine (``<tool>.aio``) is awaited in-process, which
+  measures the server code and the upstream client alone;
+- sse: the tool is called by MCP clients over the SSE transport of a
+  server running in a background thread, which adds the protocol,
+  serialization and transport overhead.
+
+Each mode runs at several concurrency levels (number of workers, each
+with its own MCP session in sse mode, calling back to back). The response
+cache is disabled unless ``--cache`` is given, so every call reaches the
+stand-in; ``--snapshot`` answers from the local snapshot instead.
+
+Results are printed as a table and written as JSON with the commit, the
+Python version and the parameters of the run; ``--compare`` prints the
+change against an earlier result file, so runs of different commits can be
+compared as long as they use the same parameters::
+
+    python -m bench.run --output before.json
+    git checkout other-branch
+    python -m bench.run --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+from contextlib import AsyncExitStack, ExitStack
+from typing import Any, Dict, List, Optional, Tuple
+
+from bench.standin import DATASET_PATH, create_app, sample_rows, serve
+from server import snapshot, upstream
+
+# name: (tool, arguments)
+SCENARIOS: Dict[str, Tuple[str, Dict[str, Any]]] = {
+    "read_lines": ("read_lines", {"size": 20}),
+    "read_lines_q": ("read_lines", {"q": "pomme", "size": 10}),
+    "read_lines_sorted": ("read_lines", {"sort": "-Score_unique_EF", "size": 20, "select": ["Nom_du_Produit_en_Français", "Score_unique_EF"]}),
+    "get_values": ("get_values", {"field": "Groupe_d'aliment"}),
+    "get_metric_agg": ("get_metric_agg", {"field": "Score_unique_EF", "metric": "avg"}),
+    "get_simple_metrics_agg": ("get_simple_metrics_agg", {"metrics": ["avg", "max"], "fields": ["Score_unique_EF", "DQR"]}),
+    "get_grouped_metrics": ("get_grouped_metrics", {"group_by": ["Sous-groupe_d'aliment"], "fields": ["Score_unique_EF"], "metrics": ["avg", "max"], "sort": "-avg(Score_unique_EF)"}),
+    "get_products_by_code": ("get_products_by_code", {"codes": ["13039", "13040", "13102", "2013", "13002", "20047", "20009"], "select": ["Nom_du_Produit_en_Français", "Score_unique_EF"]}),
+    "resolve_product": ("resolve_product", {"name": "steack hache cru"}),
+    "get_words_agg": ("get_words_agg", {"field": "Nom_du_Produit_en_Français"}),
+    "read_schema": ("read_schema", {}),
+    "read_safe_schema": ("read_safe_schema", {}),
+}
+
+MODES = ("direct", "sse")
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(math.ceil(q * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "calls": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def run_workers(call, callers: List[Any], requests: int, warmup: int) -> dict:
+    """
+    Send ``requests`` calls through ``callers`` concurrently (one worker per caller).
+
+    ``call(caller)`` performs one call and returns whether it succeeded.
+    """
+    for _ in range(warmup):
+        await call(callers[0])
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker(caller):
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            ok = await call(caller)
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(caller) for caller in callers))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def bench_direct(tool: str, arguments: dict, concurrency: int, requests: int, warmup: int) -> dict:
+    from server import server
+
+    fn = getattr(server, tool).aio
+
+    async def call(_):
+        result = await fn(**arguments)
+        return not (isinstance(result, dict) and "error" in result)
+
+    return await run_workers(call, [None] * concurrency, requests, warmup)
+
+
+async def bench_sse(url: str, tool: str, arguments: dict, concurrency: int, requests: int, warmup: int) -> dict:
+    from mcp import ClientSession
+    from mcp.client.sse import sse_client
+
+    async with AsyncExitStack() as stack:
+        sessions = []
+        for _ in range(concurrency):
+            streams = await stack.enter_async_context(sse_client(url))
+            session = await stack.enter_async_context(ClientSession(*streams))
+            await session.initialize()
+            sessions.append(session)
+
+        async def call(session):
+            result = await session.call_tool(tool, arguments)
+            return not result.isError and not result.content[0].text.startswith('{"error"')
+
+        return await run_workers(call, sessions, requests, warmup)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results: List[dict], baseline: Optional[Dict[tuple, dict]] = None) -> None:
+    header = f"{'scenario':<24} {'mode':<6} {'conc':>4} {'calls/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'err':>4}"
+    if baseline:
+        header += f" {'Δ calls/s':>10} {'Δ p50':>8}"
+    print(header)
+    for r in results:
+        line = (
+            f"{r['scenario']:<24} {r['mode']:<6} {r['concurrency']:>4} {r['throughput']:>9} "
+            f"{r['p50_ms']:>9} {r['p99_ms']:>9} {r['errors']:>4}"
+        )
+        before = (baseline or {}).get((r["scenario"], r["mode"], r["concurrency"]))
+        if before:
+            line += f" {_change(r['throughput'], before['throughput']):>10} {_change(r['p50_ms'], before['p50_ms']):>8}"
+        print(line)
+
+
+def _change(now: float, before: float) -> str:
+    if not before:
+        return "-"
+    return f"{(now - before) / before:+.0%}"
+
+
+async def run(args) -> dict:
+    rows = sample_rows(args.scale)
+    upstream.response_cache.enabled = args.cache
+    if args.snapshot:
+        snapshot.install(snapshot.Snapshot.from_rows(rows))
+    scenarios = args.scenarios or list(SCENARIOS)
+    results = []
+    with ExitStack() as servers:
+        base_url = servers.enter_context(serve(create_app(rows, args.latency))) + DATASET_PATH
+        upstream.configure(base_url=base_url, max_connections=max(args.concurrency) * 2)
+        mcp_url = None
+        if "sse" in args.modes:
+            from server.server import mcp
+
+            mcp_url = servers.enter_context(serve(mcp.sse_app())) + mcp.settings.sse_path
+        try:
+            for name in scenarios:
+                tool, arguments = SCENARIOS[name]
+                for mode in args.modes:
+                    for concurrency in args.concurrency:
+                        if mode == "direct":
+                            stats = await bench_direct(tool, arguments, concurrency, args.requests, args.warmup)
+                        else:
+                            stats = await bench_sse(mcp_url, tool, arguments, concurrency, args.requests, args.warmup)
+                        results.append({"scenario": name, "mode": mode, "concurrency": concurrency, **stats})
+                        print(f"{name} {mode} x{concurrency}: {stats}", file=sys.stderr)
+        finally:
+            await upstream.aclose()
+            upstream.close()
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "parameters": {
+            "latency": args.latency, "scale": args.scale, "rows": len(rows), "requests": args.requests,
+            "warmup": args.warmup, "cache": args.cache, "snapshot": args.snapshot,
+        },
+        "results": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the Agribalyse MCP tools against a local stand-in API.")
+    parser.add_argument("--latency", type=float, default=0.02, help="stand-in latency in seconds (default: 0.02)")
+    parser.add_argument("--scale", type=int, default=50, help="repeat the sample rows this many times (default: 50)")
+    parser.add_argument("--requests", type=int, default=200, help="calls per scenario, mode and concurrency level")
+    parser.add_argument("--warmup", type=int, default=5, help="calls sent before measuring")
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 8, 32],
+                        help="comma-separated concurrency levels (default: 1,8,32)")
+    parser.add_argument("--modes", type=lambda s: s.split(","), default=list(MODES),
+                        help="comma-separated modes among direct, sse (default: both)")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), help=f"subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--snapshot", action="store_true", help="answer from a local snapshot of the stand-in rows")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous["parameters"] != report["parameters"]:
+            print("warning: the compared run used different parameters", file=sys.stderr)
+        baseline = {(r["scenario"], r["mode"], r["concurrency"]): r for r in previous["results"]}
+    print_table(report["results"], baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
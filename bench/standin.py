@@ -0,0 +1,239 @@
+"""Local stand-in for the data-fair API of the Agribalyse dataset.
+
+Serves the endpoints the tools and resources call (``/lines``,
+``/values/{field}``, ``/values_agg``, ``/metric_agg``, ``/simple_metrics_agg``,
+``/words_agg``, ``/schema``, ``/safe-schema``, ``/api-docs.json`` and
+``/data-files``) from a list of rows, by default the sample used by the
+tests. Queries are evaluated by the snapshot engine (``server.snapshot``);
+what it does not support is answered with a 400, as data-fair does for an
+invalid request. Every response can be delayed to mimic the latency of
+data.ademe.fr, so the benchmarks and most of the API tests can run without
+network access (see the README for the tests that need the live API).
+
+Run it on its own with::
+
+    python -m bench.standin --port 8765 --latency 0.05 --scale 100
+
+and point the server at it with
+``AGRIBALYSE_BASE_URL=http://127.0.0.1:8765/data-fair/api/v1/datasets/agribalyse-31-synthese``.
+"""
+import argparse
+import asyncio
+import json
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, List, Mapping, Optional, Sequence
+from urllib.parse import urlsplit
+
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Mount, Route
+
+from server.aggregations import METRICS
+from server.snapshot import NumericColumn, Snapshot, TextColumn, Unsupported
+from server.text_index import fold, tokenize
+from server.upstream import DEFAULT_BASE_URL
+
+# The endpoints are served under the same path as on data.ademe.fr.
+DATASET_PATH = urlsplit(DEFAULT_BASE_URL).path
+
+SAMPLE_ROWS = Path(__file__).parent.parent / "tests" / "fixtures" / "agribalyse_sample.json"
+
+# Used by /simple_metrics_agg when the request does not list any.
+DEFAULT_METRICS = ("avg", "min", "max")
+DEFAULT_WORDS_SIZE = 20
+
+
+def sample_rows(scale: int = 1) -> List[dict]:
+    """
+    Rows of the test sample, repeated ``scale`` times.
+
+    The copies get their own ``_i``, ``_id`` and ``Code_AGB`` so that sorting and
+    lookups behave as on a dataset of that size.
+    """
+    with open(SAMPLE_ROWS, encoding="utf-8") as f:
+        rows = json.load(f)
+    if scale <= 1:
+        return rows
+    scaled = []
+    for copy in range(scale):
+        for row in rows:
+            row = dict(row)
+            if copy:
+                row["Code_AGB"] = f"{row.get('Code_AGB')}-{copy}"
+                row["_id"] = f"{row.get('_id')}-{copy}"
+            row["_i"] = len(scaled) + 1
+            scaled.append(row)
+    return scaled
+
+
+def _field_type(column) -> str:
+    if isinstance(column, TextColumn):
+        return "string"
+    return column.kind
+
+
+def _words(snapshot: Snapshot, params: Mapping[str, Any]) -> dict:
+    """``/words_agg``: most frequent words of a text field over the matching rows."""
+    field = params.get("field")
+    column = snapshot.columns.get(field)
+    if not isinstance(column, TextColumn):
+        raise Unsupported(f"words_agg on field {field}")
+    mask = snapshot.mask(params)
+    if params.get("analysis", "lang") == "standard":
+        analyze = lambda text: re.findall(r"[0-9a-z]+", fold(text))
+    else:
+        analyze = tokenize
+    # Count the rows per distinct value, then tokenize each distinct value once.
+    codes = column.codes[mask & ~column.missing]
+    counts = np.bincount(codes, minlength=len(column.dictionary))
+    words: Counter = Counter()
+    for code in np.flatnonzero(counts).tolist():
+        for word in set(analyze(column.dictionary[code])):
+            words[word] += int(counts[code])
+    size = int(params.get("size", DEFAULT_WORDS_SIZE))
+    return {
+        "total": int(np.count_nonzero(mask)),
+        "results": [{"word": word, "total": total} for word, total in words.most_common(size)],
+    }
+
+
+def _simple_metrics(snapshot: Snapshot, params: Mapping[str, Any]) -> dict:
+    """``/simple_metrics_agg``, with defaults for the metrics and fields left out."""
+    params = dict(params)
+    if not params.get("metrics"):
+        params["metrics"] = ",".join(DEFAULT_METRICS)
+    if not params.get("fields"):
+        params["fields"] = ",".join(
+            name for name, column in snapshot.columns.items()
+            if isinstance(column, NumericColumn) and column.kind != "boolean" and not name.startswith("_")
+        )
+    return snapshot.simple_metrics_agg(params)
+
+
+def _schema(snapshot: Snapshot, safe: bool) -> List[dict]:
+    return [
+        {"key": name, "type": _field_type(column), "title": name, "label": name, "x-originalName": name}
+        for name, column in snapshot.columns.items()
+        if not (safe and name.startswith("_"))
+    ]
+
+
+def _api_docs(request: Request) -> dict:
+    paths = ["/lines", "/values/{field}", "/values_agg", "/metric_agg", "/simple_metrics_agg", "/words_agg",
+             "/schema", "/safe-schema", "/data-files"]
+    return {
+        "openapi": "3.1.0",
+        "info": {"title": "Agribalyse stand-in", "version": "1"},
+        "servers": [{"url": str(request.base_url).rstrip("/")}],
+        "paths": {path: {"get": {"responses": {"200": {"description": "OK"}}}} for path in paths},
+    }
+
+
+def create_app(rows: Optional[Sequence[Mapping[str, Any]]] = None, latency: float = 0.0) -> Starlette:
+    """
+    Build the stand-in ASGI application.
+
+    Arguments:
+    - rows: Dataset rows (default: the test sample).
+    - latency: Seconds added before every response.
+    """
+    snapshot = Snapshot.from_rows(rows if rows is not None else sample_rows())
+
+    def endpoint(answer):
+        async def handle(request: Request):
+            if latency > 0:
+                await asyncio.sleep(latency)
+            params = dict(request.query_params)
+            try:
+                result = answer(request, params)
+            except (Unsupported, ValueError) as e:
+                return PlainTextResponse(f"Unsupported request: {e}", status_code=400)
+            return JSONResponse(result)
+        return handle
+
+    def lines(request: Request, params: dict) -> dict:
+        result = snapshot.lines(params)
+        if "next" in result:
+            # Point the next page at the stand-in itself, whatever the client's base URL.
+            result["next"] = str(request.url.include_query_params(page=int(params.get("page", 1)) + 1))
+        return result
+
+    def metric_agg(request: Request, params: dict) -> dict:
+        if params.get("metric") not in METRICS:
+            raise Unsupported(f"metric {params.get('metric')}")
+        return snapshot.metric_agg(params)
+
+    routes = [
+        Route("/lines", endpoint(lines)),
+        Route("/values/{field}", endpoint(lambda request, params: snapshot.values(request.path_params["field"], params))),
+        Route("/metric_agg", endpoint(metric_agg)),
+        Route("/simple_metrics_agg", endpoint(lambda request, params: _simple_metrics(snapshot, params))),
+        Route("/values_agg", endpoint(lambda request, params: snapshot.values_agg(params))),
+        Route("/words_agg", endpoint(lambda request, params: _words(snapshot, params))),
+        Route("/schema", endpoint(lambda request, params: _schema(snapshot, safe=False))),
+        Route("/safe-schema", endpoint(lambda request, params: _schema(snapshot, safe=True))),
+        Route("/api-docs.json", endpoint(lambda request, params: _api_docs(request))),
+        Route("/data-files", endpoint(lambda request, params: [])),
+    ]
+    created = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+    metadata = {
+        "id": DATASET_PATH.rsplit("/", 1)[-1], "title": "Agribalyse stand-in", "count": snapshot.n_rows,
+        "updatedAt": created, "dataUpdatedAt": created, "finalizedAt": created,
+    }
+    dataset = Route(DATASET_PATH, endpoint(lambda request, params: metadata))
+    return Starlette(routes=[dataset, Mount(DATASET_PATH, routes=routes)])
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def serve(app, host: str = "127.0.0.1", port: Optional[int] = None, lifespan: str = "off") -> Iterator[str]:
+    """Run an ASGI application with uvicorn in a background thread, yielding its root URL."""
+    port = port or free_port(host)
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan=lifespan))
+    thread = threading.Thread(target=server.run, name="agribalyse-standin", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError(f"Could not start a server on {host}:{port}")
+        time.sleep(0.01)
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve a local stand-in of the Agribalyse data-fair API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--rows", help="JSON file of dataset rows (default: the test sample)")
+    parser.add_argument("--scale", type=int, default=1, help="repeat the sample rows this many times")
+    args = parser.parse_args(argv)
+    if args.rows:
+        with open(args.rows, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        rows = sample_rows(args.scale)
+    print(f"AGRIBALYSE_BASE_URL=http://{args.host}:{args.port}{DATASET_PATH}")
+    uvicorn.run(create_app(rows, args.latency), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,9 @@ from openai.types.chat import ChatCompletionMessageParam
 # Load environment variables from .env
 load_dotenv()
 
+# Maximum number of GPT turns requesting tools for one query
+MAX_TURNS = 8
+
 
 class MCPClient:
     def __init__(self, api_key: str):
@@ -38,20 +41,8 @@ class MCPClient:
          # 📌 Charger les tools
         tools_resp = await self.session.list_tools()
         self.tools = tools_resp.tools
-
-        # 📌 Charger les resources
-        res_resp = await self.session.list_resources()
-        self.resources = res_resp.resources
-
-            
-    async def process_query(self, query: str) -> str:
-        """Send a user query to gpt-4o, handle any tool call, and return GPT's answer."""
-        if not self.session:
-            raise RuntimeError("Not connected to MCP server")
-
-        # List MCP tools and resources and build function definitions for GPT
-        tools = (await self.session.list_tools()).tools
-        tool_defs = [
+        # Function definitions for GPT, built once and reused by every query
+        self.tool_defs = [
             {
                 "type": "function",
                 "function": {
@@ -60,12 +51,36 @@ class MCPClient:
                     "parameters": t.inputSchema,
                 },
             }
-            for t in tools
+            for t in self.tools
         ]
-        
-        resources = await self.session.list_resources()
-        print(resources)
-        
+
+        # 📌 Charger les resources
+        res_resp = await self.session.list_resources()
+        self.resources = res_resp.resources
+
+    async def call_tool(self, tool_call) -> dict:
+        """Execute one tool call requested by GPT and return the matching "tool" message."""
+        name = tool_call.function.name
+        try:
+            args = json.loads(tool_call.function.arguments or "{}")
+            print(f"Calling tool: {name} with args: {args}")
+            result = await self.session.call_tool(name, args)
+            content = "\n".join(c.text for c in result.content if c.type == "text")
+        except Exception as e:
+            # The model gets the error and can correct its call
+            content = json.dumps({"error": f"{name} failed: {e}"})
+        return {"role": "tool", "tool_call_id": tool_call.id, "content": content}
+
+    async def process_query(self, query: str) -> str:
+        """
+        Send a user query to gpt-4o and run the tools it requests until it answers.
+
+        All the tool calls of a turn run concurrently; after MAX_TURNS turns,
+        GPT is asked to answer with the results gathered so far.
+        """
+        if not self.session:
+            raise RuntimeError("Not connected to MCP server")
+
         # Build initial conversation messages
         messages: list[ChatCompletionMessageParam] = [
             {
@@ -79,42 +94,42 @@ class MCPClient:
             {"role": "user", "content": query},
         ]
 
-        # 1) Initial call to GPT-4o with tool definitions
-        resp = await self.openai.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            tools=tool_defs,
-            tool_choice="auto",
-        )
-
-        msg = resp.choices[0].message
-
-        # 2) If GPT decided to call a tool
-        if msg.tool_calls:
-            call = msg.tool_calls[0].function
-            name = call.name
-            args = json.loads(call.arguments or "{}")
-            print(f"Calling tool: {name} with args: {args}")
+        for _ in range(MAX_TURNS):
+            resp = await self.openai.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                tools=self.tool_defs,
+                tool_choice="auto",
+            )
+            msg = resp.choices[0].message
 
-            # Execute the tool via MCP
-            result = await self.session.call_tool(name, args)
+            # No tool call: GPT's answer
+            if not msg.tool_calls:
+                return msg.content or ""
 
-            # Add the tool response back into the conversation
+            # Keep the assistant turn with its tool calls, then run them all at once
             messages.append({
-                "role": "function",
-                "name": name,
-                "content": result.content,
+                "role": "assistant",
+                "content": msg.content,
+                "tool_calls": [
+                    {
+                        "id": c.id,
+                        "type": "function",
+                        "function": {"name": c.function.name, "arguments": c.function.arguments},
+                    }
+                    for c in msg.tool_calls
+                ],
             })
+            messages.extend(await asyncio.gather(*(self.call_tool(c) for c in msg.tool_calls)))
 
-            # 3) Follow-up GPT call to incorporate the tool result
-            followup = await self.openai.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-            )
-            return followup.choices[0].message.content or ""
-
-        # 4) No tool call: return GPT's direct answer
-        return msg.content or ""
+        # Turn limit reached: answer from the tool results gathered so far
+        final = await self.openai.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            tools=self.tool_defs,
+            tool_choice="none",
+        )
+        return final.choices[0].message.content or ""
     
     async def chat_loop(self):
         """Interactive REPL: read queries, process them, print answers."""
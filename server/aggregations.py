@@ -0,0 +1,129 @@
+"""Vectorized metric aggregations over the local snapshot columns.
+
+The results mirror data-fair's ``metric_agg`` / ``simple_metrics_agg``
+responses, which are computed by Elasticsearch metric aggregations.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+METRICS = ("avg", "sum", "min", "max", "stats", "value_count", "percentiles", "cardinality")
+
+# Metrics that only count values, and therefore also apply to text columns.
+COUNT_METRICS = ("value_count", "cardinality")
+
+# Metrics computed per bucket by ``/values_agg``.
+GROUP_METRICS = ("avg", "sum", "min", "max")
+
+# Elasticsearch default for the percentiles aggregation.
+DEFAULT_PERCENTS = (1.0, 5.0, 25.0, 50.0, 75.0, 95.0, 99.0)
+
+
+def parse_percents(value: Any) -> List[float]:
+    """Parse a comma-separated list of percentiles ("25,50,75")."""
+    if value is None or value == "":
+        return list(DEFAULT_PERCENTS)
+    if isinstance(value, (list, tuple)):
+        return [float(p) for p in value]
+    return [float(p) for p in str(value).split(",") if p.strip()]
+
+
+def _number(value: float) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def summarize(
+    values: np.ndarray,
+    metrics: Iterable[str],
+    percents: Sequence[float] = DEFAULT_PERCENTS
+) -> List[Dict[str, Any]]:
+    """
+    Compute several metrics on several columns at once.
+
+    Arguments:
+    - values: 2-D array (rows x fields) of the selected rows, NaN marking missing values.
+      A 1-D array is treated as a single field.
+    - metrics: Metric names among ``METRICS``.
+    - percents: Percentiles returned by the "percentiles" metric.
+
+    Returns:
+    - One dictionary per field, mapping each metric to its value in the shape
+      Elasticsearch returns it (a number, a stats object or a list of
+      ``{"key", "value"}`` percentiles).
+    """
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    metrics = list(metrics)
+    # One sort per column serves min, max, percentiles and cardinality; NaN sort last.
+    ordered = np.sort(values, axis=0)
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+    sums = np.nansum(values, axis=0)
+
+    results = []
+    for j in range(values.shape[1]):
+        count = int(counts[j])
+        present = ordered[:count, j]
+        total = float(sums[j])
+        minimum = float(present[0]) if count else None
+        maximum = float(present[-1]) if count else None
+        average = total / count if count else None
+        field: Dict[str, Any] = {}
+        for metric in metrics:
+            if metric == "avg":
+                field[metric] = average
+            elif metric == "sum":
+                field[metric] = total
+            elif metric == "min":
+                field[metric] = minimum
+            elif metric == "max":
+                field[metric] = maximum
+            elif metric == "value_count":
+                field[metric] = count
+            elif metric == "stats":
+                field[metric] = {"count": count, "min": minimum, "max": maximum, "avg": average, "sum": total}
+            elif metric == "cardinality":
+                field[metric] = int(np.count_nonzero(np.diff(present))) + 1 if count else 0
+            elif metric == "percentiles":
+                field[metric] = _percentiles(present, percents)
+            else:
+                raise ValueError(f"Unknown metric: {metric}")
+        results.append(field)
+    return results
+
+
+def _percentiles(ordered: np.ndarray, percents: Sequence[float]) -> List[Dict[str, Any]]:
+    if not len(ordered):
+        return [{"key": float(p), "value": None} for p in percents]
+    # With few values the t-digest used by Elasticsearch keeps one centroid per
+    # value and interpolates between their midpoints, i.e. the Hazen definition.
+    values = np.percentile(ordered, percents, method="hazen")
+    return [{"key": float(p), "value": _number(v)} for p, v in zip(percents, values)]
+
+
+def group_metric(groups: np.ndarray, n_groups: int, values: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Compute a metric per group in one pass, without sorting.
+
+    Arguments:
+    - groups: Group number (0 to n_groups - 1) of each row.
+    - values: Value of each row, NaN when missing.
+    - metric: One of ``GROUP_METRICS``.
+
+    Returns:
+    - One value per group; NaN for avg, min and max of a group without values
+      (Elasticsearch answers null), 0 for their sum.
+    """
+    present = ~np.isnan(values)
+    counts = np.bincount(groups, weights=present, minlength=n_groups)
+    if metric in ("avg", "sum"):
+        sums = np.bincount(groups, weights=np.where(present, values, 0.0), minlength=n_groups)
+        if metric == "sum":
+            return sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+    if metric in ("min", "max"):
+        result = np.full(n_groups, np.inf if metric == "min" else -np.inf)
+        # fmin / fmax ignore NaN values.
+        (np.fmin if metric == "min" else np.fmax).at(result, groups, values)
+        return np.where(counts > 0, result, np.nan)
+    raise ValueError(f"Unknown metric: {metric}")
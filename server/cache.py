@@ -0,0 +1,289 @@
+"""In-process TTL + LRU cache of data-fair responses.
+
+Entries are keyed on the endpoint path and its normalized query parameters,
+hold the raw response body (so the byte budget is exact and callers never
+share a mutable decoded object) and expire after a per-endpoint TTL.
+
+Expired responses are kept until evicted: those carrying validators (ETag,
+Last-Modified) are revalidated by the next request with a conditional GET,
+a 304 answer then reusing the stored body, and any of them can be served
+stale while data.ademe.fr is unavailable.
+
+An optional persistent store (``server.disk_cache.DiskCache``) acts as a
+second level: responses are written through to it by its writer thread and
+read back from it on a memory miss, in a worker thread for ``aget``.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, Mapping, Optional, Tuple
+
+if TYPE_CHECKING:
+    from server.disk_cache import DiskCache
+
+# Comma-separated parameters whose order does not change the answer.
+# ``sort`` and ``percents`` are deliberately absent: their order matters.
+UNORDERED_LIST_PARAMS = ("select", "q_fields", "fields", "metrics", "type", "format")
+
+# Seconds a response stays fresh, by endpoint (first path segment).
+DEFAULT_TTLS = {
+    "/schema": 24 * 3600.0,
+    "/safe-schema": 24 * 3600.0,
+    "/api-docs.json": 24 * 3600.0,
+    "/data-files": 3600.0,
+    "/values": 900.0,
+    "/metric_agg": 900.0,
+    "/simple_metrics_agg": 900.0,
+    "/words_agg": 900.0,
+    "/lines": 300.0,
+}
+
+CacheKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def endpoint_of(path: str) -> str:
+    """Return the endpoint of a request path ("/values/Code_AGB" -> "/values")."""
+    segment = path.lstrip("/").split("/", 1)[0]
+    return "/" + segment
+
+
+def normalize_params(params: Optional[Mapping[str, Any]]) -> Tuple[Tuple[str, str], ...]:
+    """Return the query parameters as a sorted tuple, with unordered lists sorted too."""
+    if not params:
+        return ()
+    items = []
+    for name, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ",".join(str(v) for v in value)
+        value = str(value)
+        if name in UNORDERED_LIST_PARAMS:
+            value = ",".join(sorted(v.strip() for v in value.split(",")))
+        items.append((name, value))
+    return tuple(sorted(items))
+
+
+def make_key(path: str, params: Optional[Mapping[str, Any]] = None) -> CacheKey:
+    return path, normalize_params(params)
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    expires_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def revalidable(self) -> bool:
+        return self.etag is not None or self.last_modified is not None
+
+
+class ResponseCache:
+    """
+    Size-bounded TTL + LRU cache of response bodies.
+
+    Arguments:
+    - max_entries: Maximum number of responses kept.
+    - max_bytes: Maximum total size of the cached bodies.
+    - ttls: Freshness lifetime in seconds by endpoint (see ``DEFAULT_TTLS``).
+    - default_ttl: Lifetime of endpoints missing from ``ttls``.
+    - enabled: When False, the cache stores nothing and always misses.
+    - store: Optional persistent second level, shared across restarts and processes.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = 300.0,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+        store: Optional["DiskCache"] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.enabled = enabled
+        self._clock = clock
+        self.store = store
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+        self.bytes_saved = 0
+        self.disk_hits = 0
+        self.stale_hits = 0
+
+    def ttl_for(self, path: str) -> float:
+        return self.ttls.get(endpoint_of(path), self.default_ttl)
+
+    def get(self, path: str, params: Optional[Mapping[str, Any]] = None) -> Optional[bytes]:
+        """Return the cached body of a request, or None if absent or expired."""
+        if not self.enabled:
+            return None
+        key = make_key(path, params)
+        if self.store is not None and key not in self._entries:
+            self._promote(path, key)
+        return self._lookup(key)
+
+    async def aget(self, path: str, params: Optional[Mapping[str, Any]] = None) -> Optional[bytes]:
+        """Async version of ``get``: the persistent store is read without blocking the event loop."""
+        if not self.enabled:
+            return None
+        key = make_key(path, params)
+        if self.store is not None and key not in self._entries:
+            await asyncio.to_thread(self._promote, path, key)
+        return self._lookup(key)
+
+    def _lookup(self, key: CacheKey) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= self._clock():
+                # Expired: kept (until evicted) for revalidation, or to be
+                # served stale while upstream is down.
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.body
+
+    def stale(self, path: str, params: Optional[Mapping[str, Any]] = None) -> Optional[bytes]:
+        """Return the cached body of a request even if it has expired, or None."""
+        if not self.enabled:
+            return None
+        key = make_key(path, params)
+        if self.store is not None and key not in self._entries:
+            self._promote(path, key, keep_expired=True)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return entry.body
+
+    def validators(self, path: str, params: Optional[Mapping[str, Any]] = None) -> Dict[str, str]:
+        """Conditional request headers (If-None-Match / If-Modified-Since) for a stored response."""
+        if not self.enabled:
+            return {}
+        with self._lock:
+            entry = self._entries.get(make_key(path, params))
+            headers = {}
+            if entry is not None:
+                if entry.etag is not None:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified is not None:
+                    headers["If-Modified-Since"] = entry.last_modified
+            return headers
+
+    def revalidated(self, path: str, params: Optional[Mapping[str, Any]] = None, received: int = 0) -> Optional[bytes]:
+        """
+        Record a "304 Not Modified" answer for a stored response.
+
+        Arguments:
+        - received: Size of the 304 response body, deducted from the bytes saved.
+
+        Returns:
+        - The stored body, fresh again for a full TTL, or None if it was evicted meanwhile.
+        """
+        key = make_key(path, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.expires_at = self._clock() + self.ttl_for(path)
+            self._entries.move_to_end(key)
+            self.revalidations += 1
+            self.bytes_saved += max(len(entry.body) - received, 0)
+        if self.store is not None:
+            self.store.touch_later(key, self.ttl_for(path))
+        return entry.body
+
+    def put(
+        self,
+        path: str,
+        params: Optional[Mapping[str, Any]],
+        body: bytes,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> None:
+        """Store the body of a successful response, with its validators if any."""
+        ttl = self.ttl_for(path)
+        if not self.enabled or ttl <= 0:
+            return
+        key = make_key(path, params)
+        if self.store is not None:
+            self.store.put_later(key, body, ttl, etag, last_modified)
+        self._insert(key, CacheEntry(body, self._clock() + ttl, etag, last_modified))
+
+    def _insert(self, key: CacheKey, entry: CacheEntry) -> None:
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(entry.body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _promote(self, path: str, key: CacheKey, keep_expired: bool = False) -> None:
+        """Copy a response of the persistent store into memory."""
+        stored = self.store.get(key)
+        revalidable = stored is not None and (stored.etag is not None or stored.last_modified is not None)
+        if stored is None or (stored.ttl <= 0 and not revalidable and not keep_expired):
+            return
+        with self._lock:
+            self.disk_hits += 1
+        self._insert(key, CacheEntry(stored.body, self._clock() + stored.ttl, stored.etag, stored.last_modified))
+
+    def invalidate(self, path_prefix: Optional[str] = None) -> int:
+        """
+        Drop cached responses.
+
+        Arguments:
+        - path_prefix: Only drop requests whose path starts with it (e.g. "/values"). Drops everything if omitted.
+
+        Returns:
+        - Number of entries removed.
+        """
+        if self.store is not None:
+            self.store.flush()
+            self.store.invalidate(path_prefix)
+        with self._lock:
+            keys = [k for k in self._entries if path_prefix is None or k[0].startswith(path_prefix)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "revalidations": self.revalidations,
+                "bytes_saved": self.bytes_saved,
+                "disk_hits": self.disk_hits,
+                "stale_hits": self.stale_hits,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
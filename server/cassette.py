@@ -0,0 +1,193 @@
+"""Record and replay the HTTP exchanges with data-fair.
+
+A cassette is a JSON Lines file holding one upstream exchange per line
+(request method and URL, response status, headers and body, and the time
+the response took). It is used through httpx transports, so everything
+above the HTTP client (retries, cache, coalescing, metrics) runs unchanged:
+
+- record: requests go to the network and every exchange is appended to the cassette;
+- replay: responses are read from the cassette and nothing is sent. Requests
+  are matched on their method, path and query parameters (in any order);
+  a request recorded several times gets its responses back in the recorded
+  order, the last one being repeated. An unknown request is answered with
+  a 404. With ``latency=True``, each response is delayed by the time it
+  originally took.
+
+The server enables it with AGRIBALYSE_CASSETTE (file path),
+AGRIBALYSE_CASSETTE_MODE (``record`` or ``replay``, the default) and
+AGRIBALYSE_CASSETTE_LATENCY=1 (see ``server.upstream``).
+"""
+import asyncio
+import base64
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterator, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ("record", "replay")
+
+# Headers describing the encoding of the original body, which is stored decoded.
+_DROPPED_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+_CONDITIONAL_HEADERS = ("if-none-match", "if-modified-since")
+
+Key = Tuple[str, str, Tuple[Tuple[str, str], ...], bool]
+
+
+def request_key(request: httpx.Request) -> Key:
+    """What replayed requests are matched on; conditional requests are told apart."""
+    query = tuple(sorted(request.url.params.multi_items()))
+    conditional = any(name in request.headers for name in _CONDITIONAL_HEADERS)
+    return request.method, request.url.path, query, conditional
+
+
+def _entry(request: httpx.Request, response: httpx.Response, body: bytes, elapsed: float) -> dict:
+    entry = {
+        "method": request.method,
+        "url": str(request.url),
+        "conditional": any(name in request.headers for name in _CONDITIONAL_HEADERS),
+        "status": response.status_code,
+        "headers": [[k, v] for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS],
+        "elapsed": round(elapsed, 6),
+    }
+    try:
+        entry["body"] = body.decode("utf-8")
+    except UnicodeDecodeError:
+        entry["body"] = base64.b64encode(body).decode("ascii")
+        entry["base64"] = True
+    return entry
+
+
+def _response(entry: dict, request: httpx.Request) -> httpx.Response:
+    body = entry["body"].encode("utf-8")
+    if entry.get("base64"):
+        body = base64.b64decode(body)
+    return httpx.Response(entry["status"], headers=entry["headers"], content=body, request=request)
+
+
+class Cassette:
+    """
+    Exchanges recorded to, or replayed from, a JSON Lines file.
+
+    Arguments:
+    - path: Cassette file. Recording starts a new file; replaying reads it once.
+    - mode: "record" or "replay".
+    - latency: When replaying, wait as long as the recorded response took.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency: bool = False):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"mode must be one of {CASSETTE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._entries: Dict[Key, Deque[dict]] = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if mode == "record":
+            open(path, "w", encoding="utf-8").close()
+        else:
+            self.rewind()
+
+    def rewind(self) -> None:
+        """Read the cassette again, so that replay starts over from the first recorded responses."""
+        entries: Dict[Key, Deque[dict]] = {}
+        for entry in self.entries():
+            request = httpx.Request(entry["method"], entry["url"])
+            key = request_key(request)[:3] + (entry.get("conditional", False),)
+            entries.setdefault(key, deque()).append(entry)
+        with self._lock:
+            self._entries = entries
+
+    def entries(self) -> Iterator[dict]:
+        """Iterate over the recorded exchanges, in order."""
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def record(self, request: httpx.Request, response: httpx.Response, body: bytes, elapsed: float) -> httpx.Response:
+        """Append an exchange, and return a response carrying the already-read body."""
+        entry = _entry(request, response, body, elapsed)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.recorded += 1
+        return _response(entry, request)
+
+    def replay(self, request: httpx.Request) -> Tuple[httpx.Response, float]:
+        """Return the recorded response to a request and the time it took."""
+        with self._lock:
+            key = request_key(request)
+            # A conditional request may be answered with the full response.
+            entries = self._entries.get(key) or self._entries.get(key[:3] + (False,))
+            if not entries:
+                self.misses += 1
+                logger.warning("No recorded response for %s %s", request.method, request.url)
+                return httpx.Response(404, text=f"Not in cassette: {request.method} {request.url}", request=request), 0.0
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+            self.replayed += 1
+        return _response(entry, request), entry["elapsed"] if self.latency else 0.0
+
+    def stats(self) -> dict:
+        return {"recorded": self.recorded, "replayed": self.replayed, "misses": self.misses}
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """Blocking transport recording through ``inner`` or replaying from the cassette."""
+
+    def __init__(self, cassette: Cassette, inner: Optional[httpx.BaseTransport] = None):
+        self.cassette = cassette
+        self.inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self.cassette.mode == "replay":
+            response, delay = self.cassette.replay(request)
+            if delay:
+                time.sleep(delay)
+            return response
+        start = time.perf_counter()
+        response = self.inner.handle_request(request)
+        try:
+            body = response.read()  # decoded, as stored
+        finally:
+            response.close()
+        return self.cassette.record(request, response, body, time.perf_counter() - start)
+
+    def close(self) -> None:
+        if self.inner is not None:
+            self.inner.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """Async version of ``CassetteTransport``."""
+
+    def __init__(self, cassette: Cassette, inner: Optional[httpx.AsyncBaseTransport] = None):
+        self.cassette = cassette
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.cassette.mode == "replay":
+            response, delay = self.cassette.replay(request)
+            if delay:
+                await asyncio.sleep(delay)
+            return response
+        start = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        try:
+            body = await response.aread()
+        finally:
+            await response.aclose()
+        return self.cassette.record(request, response, body, time.perf_counter() - start)
+
+    async def aclose(self) -> None:
+        if self.inner is not None:
+            await self.inner.aclose()
+
@@ -0,0 +1,136 @@
+"""On-disk columnar snapshots, memory-mapped by every server process of a host.
+
+With AGRIBALYSE_SNAPSHOT_PATH set, a downloaded snapshot is also written to
+that directory as one ``.npy`` file per column: float64 values for numeric
+columns, int32 codes for text columns, whose sorted dictionaries are kept
+in ``meta.json`` with the row count and the dataset version. Other
+processes, and restarted ones, open it with ``numpy.load(mmap_mode="r")``
+instead of downloading and parsing the dataset: the columns are not copied
+but shared through the page cache, and opening takes milliseconds.
+
+Layout::
+
+    CURRENT              name of the latest version directory
+    <version>/meta.json  format, rows, written_at, dataset metadata, columns
+    <version>/<n>.npy    column n
+
+A version directory is written under a temporary name and renamed once
+complete, then ``CURRENT`` is replaced atomically, so readers never see a
+partial snapshot. Older versions are removed, processes still mapping them
+keep their files until they close them. ``lock`` serializes the downloads
+of the processes sharing the directory.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+import numpy as np
+
+from server.config import env_str
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock, each process downloads on its own
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+
+# Version directories kept besides the current one.
+KEEP_PREVIOUS = 1
+
+
+def directory() -> Optional[str]:
+    """Directory of the shared snapshots (AGRIBALYSE_SNAPSHOT_PATH), or None."""
+    return env_str("AGRIBALYSE_SNAPSHOT_PATH")
+
+
+@contextmanager
+def lock(path: str) -> Iterator[None]:
+    """Exclusive lock between the processes sharing a snapshot directory."""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, ".lock"), "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write(path: str, columns: Mapping[str, Any], n_rows: int, metadata: Mapping[str, Any]) -> str:
+    """
+    Write snapshot columns (``server.snapshot``) as the current version of a directory.
+
+    Returns:
+    - The name of the version directory.
+    """
+    os.makedirs(path, exist_ok=True)
+    name = metadata.get("version") or f"unversioned-{int(time.time() * 1000)}"
+    target = os.path.join(path, name)
+    if not os.path.isdir(target):
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=path)
+        specs = []
+        for i, (column_name, column) in enumerate(columns.items()):
+            file = f"{i}.npy"
+            if hasattr(column, "codes"):
+                np.save(os.path.join(tmp, file), np.ascontiguousarray(column.codes, dtype=np.int32))
+                specs.append({"name": column_name, "kind": "text", "file": file, "dictionary": column.dictionary})
+            else:
+                np.save(os.path.join(tmp, file), np.ascontiguousarray(column.values, dtype=np.float64))
+                specs.append({"name": column_name, "kind": column.kind, "file": file})
+        meta = {"format": FORMAT, "rows": n_rows, "written_at": time.time(), "metadata": dict(metadata), "columns": specs}
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        try:
+            os.rename(tmp, target)
+        except OSError:  # the same version was written by another process meanwhile
+            shutil.rmtree(tmp, ignore_errors=True)
+    pointer = os.path.join(path, f".CURRENT-{os.getpid()}")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(path, "CURRENT"))
+    _prune(path, name)
+    return name
+
+
+def _prune(path: str, current: str) -> None:
+    versions = [
+        entry for entry in os.scandir(path)
+        if entry.is_dir() and not entry.name.startswith(".") and entry.name != current
+    ]
+    versions.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[KEEP_PREVIOUS:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def read(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Open the current version of a directory.
+
+    Returns:
+    - Its ``meta.json`` content, each column holding its memory-mapped "array",
+      or None if there is no readable snapshot.
+    """
+    if not os.path.exists(os.path.join(path, "CURRENT")):
+        return None
+    try:
+        with open(os.path.join(path, "CURRENT"), encoding="utf-8") as f:
+            version = os.path.join(path, f.read().strip())
+        with open(os.path.join(version, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT:
+            return None
+        for column in meta["columns"]:
+            column["array"] = np.load(os.path.join(version, column["file"]), mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        logger.warning("Could not open the snapshot in %s", path, exc_info=True)
+        return None
+    return meta
@@ -0,0 +1,280 @@
+"""Persistent cache of data-fair responses and dataset snapshots, in one SQLite file.
+
+``ResponseCache`` keeps the hot responses in memory; when given a
+``DiskCache`` it also writes every response through to it and looks there
+on a memory miss, so a restarted server (or another worker sharing the same
+volume) starts warm instead of sending a burst of requests upstream. The
+snapshot mode stores the downloaded dataset in the same file.
+
+The database runs in WAL mode with a busy timeout, so several processes can
+read and write it at once. Waiting for another process's lock must not
+stall the event loop: writes go through a single writer thread
+(``put_later`` / ``touch_later``) and async callers read in a worker thread
+(``ResponseCache.aget``). Expiry times are wall-clock timestamps (they must
+survive restarts); the total size of the stored responses is bounded, the
+least recently used ones being evicted first, and kept up to date by
+triggers in the ``totals`` table rather than summed on every write. Any
+SQLite error is logged and treated as a miss: the disk cache never makes a
+request fail.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, NamedTuple, Optional
+from urllib.parse import urlencode
+
+from server.cache import CacheKey
+from server.config import env_int, env_str
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+CREATE TABLE IF NOT EXISTS totals (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals SELECT 'bytes', COALESCE(SUM(size), 0) FROM responses;
+INSERT OR IGNORE INTO totals SELECT 'entries', COUNT(*) FROM responses;
+CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN
+    UPDATE totals SET value = value + NEW.size WHERE name = 'bytes';
+    UPDATE totals SET value = value + 1 WHERE name = 'entries';
+END;
+CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN
+    UPDATE totals SET value = value - OLD.size WHERE name = 'bytes';
+    UPDATE totals SET value = value - 1 WHERE name = 'entries';
+END;
+CREATE TABLE IF NOT EXISTS snapshots (
+    name TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    stored_at REAL NOT NULL
+);
+"""
+
+
+class StoredResponse(NamedTuple):
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    ttl: float  # seconds of freshness left, negative once expired
+
+
+class DiskCache:
+    """
+    SQLite-backed store of response bodies and snapshots.
+
+    Arguments:
+    - path: Database file, created if needed.
+    - max_bytes: Maximum total size of the stored response bodies.
+    - namespace: Prefix of every key, so that servers of different datasets can share a file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 512 * 1024 * 1024,
+        namespace: str = "",
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self._clock = clock
+        self._local = threading.local()
+        self._writes: "queue.Queue[tuple]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls, namespace: str = "") -> Optional["DiskCache"]:
+        """Open the file named by AGRIBALYSE_CACHE_PATH, or return None if it is not set."""
+        path = env_str("AGRIBALYSE_CACHE_PATH")
+        if path is None:
+            return None
+        try:
+            return cls(path, env_int("AGRIBALYSE_CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024), namespace)
+        except sqlite3.Error:
+            logger.exception("Could not open the cache database %s, using the memory cache only", path)
+            return None
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections must not be shared.
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _key(self, key: CacheKey) -> str:
+        path, params = key
+        return f"{self.namespace}{path}?{urlencode(params)}"
+
+    # ---- responses ----
+
+    def get(self, key: CacheKey) -> Optional[StoredResponse]:
+        """Return a stored response, even expired (it may still be revalidated)."""
+        try:
+            db = self._connect()
+            row = db.execute(
+                "SELECT body, etag, last_modified, expires_at FROM responses WHERE key = ?", (self._key(key),)
+            ).fetchone()
+            if row is None:
+                return None
+            now = self._clock()
+            db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, self._key(key)))
+        except sqlite3.Error:
+            logger.warning("Disk cache read failed", exc_info=True)
+            return None
+        body, etag, last_modified, expires_at = row
+        return StoredResponse(bytes(body), etag, last_modified, expires_at - now)
+
+    def put(
+        self,
+        key: CacheKey,
+        body: bytes,
+        ttl: float,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> None:
+        if len(body) > self.max_bytes:
+            return
+        now = self._clock()
+        try:
+            db = self._connect()
+            with db:
+                db.execute("BEGIN IMMEDIATE")
+                # DELETE + INSERT rather than INSERT OR REPLACE, whose implicit delete does not fire triggers.
+                db.execute("DELETE FROM responses WHERE key = ?", (self._key(key),))
+                db.execute(
+                    "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self._key(key), key[0], body, etag, last_modified, now + ttl, now, len(body)),
+                )
+                self._evict(db)
+        except sqlite3.Error:
+            logger.warning("Disk cache write failed", exc_info=True)
+
+    def touch(self, key: CacheKey, ttl: float) -> None:
+        """Make a stored response fresh again for ``ttl`` seconds (after a 304)."""
+        now = self._clock()
+        try:
+            self._connect().execute(
+                "UPDATE responses SET expires_at = ?, accessed_at = ? WHERE key = ?", (now + ttl, now, self._key(key))
+            )
+        except sqlite3.Error:
+            logger.warning("Disk cache write failed", exc_info=True)
+
+    def invalidate(self, path_prefix: Optional[str] = None) -> int:
+        prefix = f"{self.namespace}{path_prefix or ''}"
+        like = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        try:
+            cursor = self._connect().execute("DELETE FROM responses WHERE key LIKE ? ESCAPE '\\'", (like,))
+            return cursor.rowcount
+        except sqlite3.Error:
+            logger.warning("Disk cache write failed", exc_info=True)
+            return 0
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        (total,) = db.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            victims.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        db.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def stats(self) -> dict:
+        try:
+            totals = dict(self._connect().execute("SELECT name, value FROM totals"))
+        except sqlite3.Error:
+            return {}
+        return {"entries": totals.get("entries", 0), "bytes": totals.get("bytes", 0)}
+
+    # ---- writer thread ----
+
+    def put_later(
+        self,
+        key: CacheKey,
+        body: bytes,
+        ttl: float,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> None:
+        """``put`` from the writer thread: the caller does not wait for the database."""
+        self._submit(self.put, key, body, ttl, etag, last_modified)
+
+    def touch_later(self, key: CacheKey, ttl: float) -> None:
+        """``touch`` from the writer thread."""
+        self._submit(self.touch, key, ttl)
+
+    def flush(self) -> None:
+        """Wait until the queued writes are done."""
+        self._writes.join()
+
+    def _submit(self, method: Callable[..., Any], *args: Any) -> None:
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="agribalyse-disk-cache", daemon=True)
+                self._writer.start()
+        self._writes.put((method, args))
+
+    def _write_loop(self) -> None:
+        while True:
+            method, args = self._writes.get()
+            try:
+                method(*args)
+            except Exception:
+                logger.exception("Disk cache write failed")
+            finally:
+                self._writes.task_done()
+
+    # ---- snapshots ----
+
+    def save_snapshot(self, name: str, data: bytes) -> None:
+        """Store a serialized snapshot (compressed) under ``name``."""
+        try:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)",
+                    (self.namespace + name, zlib.compress(data, 6), self._clock()),
+                )
+        except sqlite3.Error:
+            logger.warning("Could not store the snapshot", exc_info=True)
+
+    def load_snapshot(self, name: str) -> Optional[tuple]:
+        """Return ``(data, age in seconds)`` of a stored snapshot, or None."""
+        try:
+            row = self._connect().execute(
+                "SELECT body, stored_at FROM snapshots WHERE name = ?", (self.namespace + name,)
+            ).fetchone()
+        except sqlite3.Error:
+            logger.warning("Could not read the stored snapshot", exc_info=True)
+            return None
+        if row is None:
+            return None
+        return zlib.decompress(row[0]), self._clock() - row[1]
+
+    def close(self) -> None:
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
@@ -0,0 +1,159 @@
+"""Chunked export of every row matching a ``/lines`` query.
+
+``read_lines`` returns a single page, of at most 10,000 rows. An export
+returns the matching rows a chunk at a time, as CSV or JSON Lines text,
+with an opaque ``cursor`` to pass back for the next chunk. The cursor holds
+the whole state of the export (the next data-fair page and the rows already
+sent), so nothing is kept on the server between chunks: memory use is
+bounded by the chunk size whatever the number of matching rows, and any
+worker can serve the next chunk. Chunks come from the local snapshot when
+it can answer them, from the API otherwise (following data-fair's ``next``
+links, without going through the response cache, which is meant for
+interactive calls).
+"""
+import base64
+import binascii
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from server import formats, snapshot, upstream
+
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_CHUNK_SIZE = 1000
+
+ProgressCallback = Callable[[int, Optional[int]], Awaitable[None]]
+
+
+def split_next(url: str) -> Tuple[str, Dict[str, str]]:
+    """Turn a ``next`` link into a path relative to the dataset URL and its query parameters."""
+    parts = urlsplit(url)
+    base_path = urlsplit(upstream.settings().base_url).path.rstrip("/")
+    path = parts.path[len(base_path):] if parts.path.startswith(base_path) else parts.path
+    return path, dict(parse_qsl(parts.query, keep_blank_values=True))
+
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Raises ``ValueError`` if ``cursor`` was not returned by a previous chunk."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (UnicodeError, binascii.Error, json.JSONDecodeError):
+        raise ValueError("Invalid cursor") from None
+    if not isinstance(state, dict) or not {"path", "params", "exported", "format"} <= state.keys():
+        raise ValueError("Invalid cursor")
+    return state
+
+
+async def _get(path: str, params: Dict[str, Any]) -> dict:
+    local = snapshot.answer(path, params)
+    if local is not None:
+        return local
+    return await upstream.aget_json(path, params, use_cache=False)
+
+
+async def dataset_columns() -> List[str]:
+    """
+    Every column of the dataset, in schema order, without the calculated ``_`` ones.
+
+    Raises ``RuntimeError`` if the API answers with an error.
+    """
+    dataset = snapshot.current()
+    if dataset is not None:
+        names = dataset.names
+    else:
+        schema = await upstream.aget_json("/schema", {"mimeType": "application/json"})
+        if not isinstance(schema, list):
+            raise RuntimeError(f"Export failed: {schema.get('error', 'unexpected schema')}")
+        names = [field["key"] for field in schema]
+    return [name for name in names if not name.startswith("_")]
+
+
+def encode_rows(rows: List[Dict[str, Any]], format: str, columns: Optional[List[str]]) -> str:
+    if format == "csv":
+        return "".join(formats.csv_line([row.get(name) for name in columns]) for row in rows)
+    return "".join(formats.dumps(row) + "\n" for row in rows)
+
+
+async def export_chunk(
+    params: Dict[str, Any],
+    format: str = "csv",
+    max_rows: Optional[int] = None,
+    columns: Optional[List[str]] = None,
+    cursor: Optional[str] = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+    progress: Optional[ProgressCallback] = None,
+) -> dict:
+    """
+    Fetch the next chunk of the rows matching a ``/lines`` query.
+
+    Arguments:
+    - params: ``/lines`` query parameters (select, sort, q, q_fields, qs); ignored with a cursor.
+    - format: "csv" or "jsonl"; ignored with a cursor.
+    - max_rows: Stop after this many rows in all; ignored with a cursor.
+    - columns: CSV columns (default: every column of the dataset schema); ignored with a cursor.
+    - cursor: The "cursor" of the previous chunk, None for the first one.
+    - chunk_size: Rows per chunk; the first chunk sets it for the whole export.
+    - progress: Coroutine called with the rows exported so far and the expected total.
+
+    Returns:
+    - Dictionary with the rows as text in "data" (the first CSV chunk starts with the
+      header line), the number of "rows" in the chunk, the rows "exported" so far, the
+      "total" number of matching rows, the "cursor" of the next chunk (None after the
+      last one) and whether max_rows "truncated" the export.
+
+    Raises ``ValueError`` for invalid arguments and ``RuntimeError`` if the API answers
+    with an error.
+    """
+    if cursor is not None:
+        state = decode_cursor(cursor)
+    else:
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of {EXPORT_FORMATS}")
+        if max_rows is not None and max_rows < 1:
+            raise ValueError("max_rows must be at least 1")
+        if not 1 <= chunk_size <= snapshot.MAX_PAGE_SIZE:
+            raise ValueError(f"chunk_size must be between 1 and {snapshot.MAX_PAGE_SIZE}")
+        if format == "csv" and not columns:
+            # Rows leave out empty fields: the header comes from the schema, not from the first row.
+            columns = await dataset_columns()
+        state = {
+            "path": "/lines",
+            "params": {**params, "page": 1, "size": chunk_size},
+            "exported": 0,
+            "format": format,
+            "max_rows": max_rows,
+            "columns": columns if format == "csv" else None,
+        }
+
+    page = await _get(state["path"], state["params"])
+    if "error" in page:
+        raise RuntimeError(f"Export failed: {page['error']}")
+    total, rows = page.get("total"), page["results"]
+    max_rows = state["max_rows"]
+    if max_rows is not None:
+        rows = rows[:max_rows - state["exported"]]
+    exported = state["exported"] + len(rows)
+    if progress is not None:
+        expected = total if max_rows is None or total is None else min(total, max_rows)
+        await progress(exported, expected)
+
+    data = encode_rows(rows, state["format"], state["columns"])
+    if state["format"] == "csv" and cursor is None:
+        data = formats.csv_line(state["columns"]) + data
+    next_cursor = None
+    if page.get("next") and rows and (max_rows is None or exported < max_rows):
+        path, next_params = split_next(page["next"])
+        next_cursor = encode_cursor({**state, "path": path, "params": next_params, "exported": exported})
+    return {
+        "format": state["format"],
+        "data": data,
+        "rows": len(rows),
+        "exported": exported,
+        "total": total,
+        "cursor": next_cursor,
+        "truncated": next_cursor is None and total is not None and exported < total,
+    }
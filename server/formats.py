@@ -0,0 +1,126 @@
+"""Compact encodings of tool results.
+
+data-fair rows repeat every (long, French) column name and carry internal
+fields such as ``_i`` or ``_rand``: sent as is to an LLM, most of a page is
+overhead. ``format_lines`` re-encodes a ``/lines`` result as columnar JSON
+(column names listed once) or CSV/TSV, drops the internal fields, and can
+cut it to a byte budget on a row boundary.
+
+``dumps`` is the JSON encoder used for the payloads sent to MCP clients:
+orjson when it is installed (``pip install .[fast]``), the standard library
+otherwise, always without indentation.
+"""
+import csv
+import io
+import json
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+OUTPUT_FORMATS = ("json", "columnar", "csv", "tsv")
+
+# Projection used by ``read_lines(compact=True)`` when no columns are selected.
+COMPACT_COLUMNS = [
+    "Code_AGB", "Nom_du_Produit_en_Français", "Groupe_d'aliment", "Sous-groupe_d'aliment",
+    "DQR", "Score_unique_EF", "Changement_climatique"
+]
+
+
+def dumps(obj: Any) -> str:
+    """Encode to compact JSON, keeping non-ASCII characters as is."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _fields(rows: List[Dict[str, Any]]) -> List[str]:
+    names: Dict[str, None] = {}
+    for row in rows:
+        for name in row:
+            names.setdefault(name)
+    return list(names)
+
+
+def csv_value(value: Any) -> Any:
+    """Cell value as written in CSV: booleans as ``true``/``false``, like the API's own CSV."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def csv_line(values: List[Any], delimiter: str = ",") -> str:
+    out = io.StringIO()
+    csv.writer(out, delimiter=delimiter, lineterminator="\n").writerow([csv_value(value) for value in values])
+    return out.getvalue()
+
+
+def _fit(encoded: List[str], budget: int) -> int:
+    """Return how many leading items fit in ``budget`` bytes."""
+    used = 0
+    for count, item in enumerate(encoded):
+        used += len(item.encode("utf-8")) + 1
+        if used > budget:
+            return count
+    return len(encoded)
+
+
+def format_lines(
+    result: dict,
+    format: str = "json",
+    max_bytes: Optional[int] = None,
+    drop_internal: bool = False
+) -> dict:
+    """
+    Re-encode a ``/lines`` result.
+
+    Arguments:
+    - result: data-fair ``/lines`` answer ("total", "results" and possibly "next").
+    - format: "json" (rows as objects), "columnar" ("fields" listed once, then one value
+      array per row in "rows"), "csv" or "tsv" (the table as text in "data").
+    - max_bytes: Budget for the encoded rows; the rows past it are dropped and
+      "truncated" reports how many rows and bytes were cut.
+    - drop_internal: Remove fields starting with "_" (always done for the non-JSON formats).
+
+    Returns:
+    - The re-encoded result, or ``result`` itself if there is nothing to change.
+    """
+    if "error" in result or (format == "json" and max_bytes is None and not drop_internal):
+        return result
+    rows = result.get("results", [])
+    if format != "json" or drop_internal:
+        rows = [{k: v for k, v in row.items() if not k.startswith("_")} for row in rows]
+    output = {k: v for k, v in result.items() if k != "results"}
+
+    header = ""
+    if format == "json":
+        encoded = [dumps(row) for row in rows]
+    elif format == "columnar":
+        fields = _fields(rows)
+        rows = [[row.get(name) for name in fields] for row in rows]
+        encoded = [dumps(row) for row in rows]
+        header = dumps(fields)
+        output["fields"] = fields
+    else:
+        delimiter = "," if format == "csv" else "\t"
+        fields = _fields(rows)
+        encoded = [csv_line([row.get(name) for name in fields], delimiter) for row in rows]
+        header = csv_line(fields, delimiter)
+        output["format"] = format
+
+    kept = len(encoded)
+    if max_bytes is not None:
+        kept = _fit(encoded, max_bytes - len(header.encode("utf-8")))
+        if kept < len(encoded):
+            output["truncated"] = {
+                "rows": len(encoded) - kept,
+                "bytes": sum(len(item.encode("utf-8")) + 1 for item in encoded[kept:]),
+            }
+
+    if format in ("csv", "tsv"):
+        output["data"] = header + "".join(encoded[:kept])
+    else:
+        output["rows" if format == "columnar" else "results"] = rows[:kept]
+    return output
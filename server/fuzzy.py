@@ -0,0 +1,137 @@
+"""Fuzzy resolution of free-text product names to dataset rows.
+
+Names given by users ("yaourt nature", "steack haché") rarely match
+``Nom_du_Produit_en_Français`` exactly, and a ``q`` search fails on a
+typo or a missing word. ``ProductIndex`` is built once per dataset copy
+over the distinct product names and LCI names:
+
+- trigram postings (words padded as in PostgreSQL's pg_trgm) give, with a
+  single ``bincount``, the trigram similarity (Jaccard) of the query with
+  every name, from which the best candidates are taken;
+- the candidates are re-ranked by the share of query words found in the
+  name, exactly, as a prefix or with one typo (precomputed deletion
+  neighbourhoods of the name words, as in SymSpell).
+
+A lookup costs a few dictionary and NumPy operations, well under a
+millisecond on the full dataset.
+"""
+import re
+from bisect import bisect_left
+from typing import Any, Dict, List, Mapping, Sequence, Set, Tuple
+
+import numpy as np
+
+from server.text_index import STOPWORDS, fold
+
+RESOLVE_FIELDS = ("Nom_du_Produit_en_Français", "LCI_Name")
+
+# Names scored by trigram similarity before re-ranking.
+CANDIDATES = 30
+
+_WORD = re.compile(r"[0-9a-z]+")
+
+
+def words(text: str) -> List[str]:
+    """Lowercased, accent-free words of a text."""
+    return _WORD.findall(fold(text))
+
+
+def trigrams(text: str) -> Set[str]:
+    grams = set()
+    for word in words(text):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _deletes(word: str) -> Set[str]:
+    """The word and its variants with one letter removed."""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+class NameIndex:
+    """Trigram and word indexes over a list of distinct names."""
+
+    def __init__(self, names: Sequence[str]):
+        self.names = list(names)
+        postings: Dict[str, List[int]] = {}
+        self.sizes = np.zeros(len(self.names), dtype=np.float64)
+        vocabulary: Dict[str, int] = {}
+        self.name_words: List[Set[int]] = []
+        for i, name in enumerate(self.names):
+            grams = trigrams(name)
+            self.sizes[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+            self.name_words.append({vocabulary.setdefault(w, len(vocabulary)) for w in words(name)})
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.vocabulary = sorted(vocabulary)
+        self._vocabulary_ids = [vocabulary[w] for w in self.vocabulary]
+        self._typos: Dict[str, Set[int]] = {}
+        for word, word_id in vocabulary.items():
+            if len(word) >= 4:
+                for variant in _deletes(word):
+                    self._typos.setdefault(variant, set()).add(word_id)
+
+    def word_matches(self, word: str) -> Set[int]:
+        """Vocabulary words equal to ``word``, starting with it, or one typo away."""
+        found = set()
+        start = bisect_left(self.vocabulary, word)
+        for i in range(start, len(self.vocabulary)):
+            if not self.vocabulary[i].startswith(word):
+                break
+            found.add(self._vocabulary_ids[i])
+        if len(word) >= 4:
+            for variant in _deletes(word):
+                found |= self._typos.get(variant, set())
+        return found
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """Return up to ``limit`` ``(name position, score in [0, 1])`` pairs, best first."""
+        grams = trigrams(query)
+        hits = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not hits:
+            return []
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.names))
+        similarity = shared / (len(grams) + self.sizes - shared)
+        matched = np.count_nonzero(shared)
+        k = min(CANDIDATES, matched)
+        candidates = np.argpartition(-similarity, k - 1)[:k]
+
+        query_words = [w for w in words(query) if w not in STOPWORDS] or words(query)
+        matches = [self.word_matches(w) for w in query_words]
+        scored = []
+        for i in candidates.tolist():
+            coverage = sum(bool(m & self.name_words[i]) for m in matches) / len(matches)
+            scored.append((i, 0.5 * float(similarity[i]) + 0.5 * coverage))
+        scored.sort(key=lambda item: (-item[1], len(self.names[item[0]])))
+        return scored[:limit]
+
+
+class ProductIndex:
+    """Fuzzy product lookup over the dictionary-encoded name columns of a snapshot."""
+
+    def __init__(self, columns: Mapping[str, Any]):
+        self.fields: Dict[str, Tuple[NameIndex, np.ndarray, np.ndarray]] = {}
+        for field in RESOLVE_FIELDS:
+            column = columns.get(field)
+            if not hasattr(column, "codes"):
+                continue
+            # Rows grouped by name code: rows of code c are order[starts[c]:starts[c + 1]].
+            order = np.argsort(column.codes, kind="stable")
+            starts = np.searchsorted(column.codes[order], np.arange(len(column.dictionary) + 1))
+            self.fields[field] = (NameIndex(column.dictionary), order, starts)
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[int, float, str]]:
+        """
+        Return up to ``limit`` ``(row, score, matched field)`` triples, best first;
+        a row matched through both names keeps its best score.
+        """
+        best: Dict[int, Tuple[float, str]] = {}
+        for field, (index, order, starts) in self.fields.items():
+            for code, score in index.search(query, limit):
+                for row in order[starts[code]:starts[code + 1]].tolist():
+                    if row not in best or score > best[row][0]:
+                        best[row] = (score, field)
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(row, round(score, 4), field) for row, (score, field) in ranked[:limit]]
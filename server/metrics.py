@@ -0,0 +1,214 @@
+"""In-process metrics of the server, exported as JSON or in Prometheus text format.
+
+``registry`` holds counters, gauges and latency histograms keyed on a name
+and labels. The hot paths record into it directly (tool calls in
+``server.server``, upstream attempts and JSON decoding in
+``server.upstream``); values owned by other components (cache and
+coalescing counters, concurrency gauges) are read from them when the
+metrics are collected.
+
+Per-call timing breakdowns can be attached for profiling: inside
+``profile()``, every ``timed(phase)`` block adds its duration to the
+breakdown of the current call (tracked with a context variable, so it
+follows the call across awaits).
+"""
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Latency buckets in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as exposed by Prometheus."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the ``q`` quantile (None if empty)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Registry:
+    """Thread-safe store of counters, gauges and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Dict[str, Dict[Labels, float]]]] = []
+
+    def describe(self, name: str, text: str) -> None:
+        self.help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def add(self, name: str, value: float, **labels: str) -> None:
+        """Move a gauge up (or down with a negative value)."""
+        key = _labels(labels)
+        with self._lock:
+            series = self.gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def register(self, collector: Callable[[], Dict[str, Dict[Labels, float]]]) -> None:
+        """
+        Add a function returning gauge values ``{name: {labels: value}}`` read at
+        collection time (e.g. the counters of the response cache).
+        """
+        self._collectors.append(collector)
+
+    def collected(self) -> Dict[str, Dict[Labels, float]]:
+        values: Dict[str, Dict[Labels, float]] = {}
+        for collector in self._collectors:
+            for name, series in collector().items():
+                values.setdefault(name, {}).update(series)
+        return values
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def as_dict(self) -> dict:
+        """All the metrics as nested dictionaries: ``{name: {"label=value,...": value}}``."""
+        def series(values):
+            return {",".join(f"{k}={v}" for k, v in labels) or "": value for labels, value in values.items()}
+
+        with self._lock:
+            result = {name: series(values) for name, values in {**self.counters, **self.gauges}.items()}
+            for name, values in self.histograms.items():
+                result[name] = series({labels: h.as_dict() for labels, h in values.items()})
+        for name, values in self.collected().items():
+            result[name] = series(values)
+        return result
+
+    def prometheus(self) -> str:
+        """All the metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+
+        def header(name: str, kind: str) -> None:
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for name, values in sorted(self.counters.items()):
+                header(name, "counter")
+                lines.extend(f"{name}{_format(labels)} {_number(v)}" for labels, v in values.items())
+            for name, values in sorted(self.gauges.items()):
+                header(name, "gauge")
+                lines.extend(f"{name}{_format(labels)} {_number(v)}" for labels, v in values.items())
+            for name, values in sorted(self.histograms.items()):
+                header(name, "histogram")
+                for labels, histogram in values.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else _number(bound)
+                        lines.append(f"{name}_bucket{_format(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format(labels)} {_number(histogram.sum)}")
+                    lines.append(f"{name}_count{_format(labels)} {histogram.count}")
+        for name, values in sorted(self.collected().items()):
+            header(name, "gauge")
+            lines.extend(f"{name}{_format(labels)} {_number(v)}" for labels, v in values.items())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+registry = Registry()
+
+# ---- per-call timing breakdowns ----
+
+_breakdown: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("breakdown", default=None)
+
+
+@contextmanager
+def profile() -> Iterator[Dict[str, float]]:
+    """Collect the durations of the ``timed`` phases run inside the block, in seconds."""
+    breakdown: Dict[str, float] = {}
+    token = _breakdown.set(breakdown)
+    start = time.perf_counter()
+    try:
+        yield breakdown
+    finally:
+        breakdown["total"] = time.perf_counter() - start
+        _breakdown.reset(token)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Add the duration of the block to the breakdown of the current call, if profiled."""
+    breakdown = _breakdown.get()
+    if breakdown is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        breakdown[phase] = breakdown.get(phase, 0.0) + time.perf_counter() - start
@@ -0,0 +1,364 @@
+"""Compiler for the ``qs`` query-string syntax into row masks over the snapshot.
+
+``qs`` is passed by data-fair to an Elasticsearch ``query_string`` query.
+This module parses the subset agents actually use and evaluates it with
+NumPy on the snapshot columns:
+
+- ``field:value``, ``field:"quoted phrase"``, ``field:(a OR b)``;
+- ``AND`` / ``&&``, ``OR`` / ``||``, ``NOT`` / ``!``, ``+`` / ``-`` and parentheses,
+  combined like Lucene's classic query parser with OR as default operator;
+- ranges ``field:[0 TO 0.5]``, ``field:{* TO 10]``, ``field:>=0.5``;
+- wildcards ``field:Pomme*`` / ``field:?ait`` and ``_exists_:field``.
+
+String fields are keywords in data-fair: values match whole and case
+sensitively, while ``field.text`` searches the analyzed text. Anything
+else (fuzzy ``~``, boosts ``^``, regular expressions, fields without
+name...) raises ``QuerySyntaxError`` so the request can go upstream.
+Compiled queries are cached by string.
+"""
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field as dataclass_field
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from server.text_index import Term as TextTerm, tokenize
+
+MUST, SHOULD, MUST_NOT = "must", "should", "must_not"
+
+_SPECIAL = set('()[]{}:"\\~^/')
+_NUMBER = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+
+
+class QuerySyntaxError(ValueError):
+    """Raised for query strings outside the supported subset."""
+
+
+# ---------------------------
+# ---------- AST ------------
+# ---------------------------
+
+@dataclass(frozen=True)
+class Match:
+    field: str
+    value: str
+    kind: str = "term"  # "term", "phrase" or "wildcard"
+
+
+@dataclass(frozen=True)
+class Range:
+    field: str
+    low: Optional[str]
+    high: Optional[str]
+    include_low: bool = True
+    include_high: bool = True
+
+
+@dataclass(frozen=True)
+class Exists:
+    field: str
+
+
+@dataclass(frozen=True)
+class Bool:
+    clauses: Tuple[Tuple[str, Any], ...] = dataclass_field(default_factory=tuple)
+
+
+# ---------------------------
+# --------- parser ----------
+# ---------------------------
+
+class _Parser:
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def parse(self) -> Any:
+        node = self.query(None)
+        self.skip()
+        if self.pos < len(self.text):
+            raise QuerySyntaxError(f"Unexpected '{self.text[self.pos]}' at {self.pos}")
+        return node
+
+    # -- helpers --
+
+    def skip(self) -> None:
+        while self.pos < len(self.text) and self.text[self.pos].isspace():
+            self.pos += 1
+
+    def peek(self) -> str:
+        self.skip()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def accept(self, *symbols: str) -> Optional[str]:
+        self.skip()
+        for symbol in symbols:
+            if self.text.startswith(symbol, self.pos):
+                end = self.pos + len(symbol)
+                if symbol.isalpha() and end < len(self.text) and not (self.text[end].isspace() or self.text[end] in "()"):
+                    continue
+                self.pos = end
+                return symbol
+        return None
+
+    def word(self) -> str:
+        """Read an unquoted term, stopping at whitespace, parentheses or an unescaped colon."""
+        self.skip()
+        chars = []
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if c == "\\" and self.pos + 1 < len(self.text):
+                chars.append(self.text[self.pos + 1])
+                self.pos += 2
+                continue
+            if c.isspace() or c in "():":
+                break
+            if c in _SPECIAL:
+                raise QuerySyntaxError(f"Unsupported character '{c}'")
+            chars.append(c)
+            self.pos += 1
+        return "".join(chars)
+
+    def quoted(self) -> str:
+        self.pos += 1  # opening quote
+        chars = []
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if c == "\\" and self.pos + 1 < len(self.text):
+                chars.append(self.text[self.pos + 1])
+                self.pos += 2
+                continue
+            self.pos += 1
+            if c == '"':
+                if self.pos < len(self.text) and self.text[self.pos] in "~^":
+                    raise QuerySyntaxError("Proximity and boosts are not supported")
+                return "".join(chars)
+            chars.append(c)
+        raise QuerySyntaxError("Unterminated phrase")
+
+    # -- grammar --
+
+    def query(self, default_field: Optional[str]) -> Any:
+        """Sequence of clauses, combined like Lucene's classic query parser (default operator OR)."""
+        clauses: List[List[Any]] = []
+        conjunction = None
+        while True:
+            c = self.peek()
+            if not c or c == ")":
+                break
+            if clauses:
+                if self.accept("AND", "&&"):
+                    conjunction = "and"
+                elif self.accept("OR", "||"):
+                    conjunction = "or"
+                else:
+                    conjunction = None
+            modifier = None
+            if self.accept("NOT", "!", "-"):
+                modifier = "not"
+            elif self.accept("+"):
+                modifier = "required"
+            node = self.clause(default_field)
+
+            if clauses and conjunction == "and" and clauses[-1][0] != MUST_NOT:
+                clauses[-1][0] = MUST
+            if modifier == "not":
+                occur = MUST_NOT
+            elif modifier == "required" or conjunction == "and":
+                occur = MUST
+            else:
+                occur = SHOULD
+            clauses.append([occur, node])
+        if not clauses:
+            raise QuerySyntaxError("Empty query")
+        if len(clauses) == 1 and clauses[0][0] != MUST_NOT:
+            return clauses[0][1]
+        return Bool(tuple((occur, node) for occur, node in clauses))
+
+    def clause(self, default_field: Optional[str]) -> Any:
+        if self.accept("("):
+            node = self.query(default_field)
+            if not self.accept(")"):
+                raise QuerySyntaxError("Missing closing parenthesis")
+            return node
+        if self.peek() == '"':
+            return self.value(default_field)
+        start = self.pos
+        name = self.word()
+        if self.pos < len(self.text) and self.text[self.pos] == ":":
+            self.pos += 1
+            if name == "_exists_":
+                return Exists(self.word())
+            if self.accept("("):
+                node = self.query(name)
+                if not self.accept(")"):
+                    raise QuerySyntaxError("Missing closing parenthesis")
+                return node
+            return self.value(name)
+        self.pos = start
+        return self.value(default_field)
+
+    def value(self, field: Optional[str]) -> Any:
+        if field is None:
+            raise QuerySyntaxError("Terms without field are not supported")
+        c = self.peek()
+        if c == '"':
+            return Match(field, self.quoted(), "phrase")
+        if c in "[{":
+            return self.range(field)
+        for operator in (">=", "<=", ">", "<"):
+            if self.text.startswith(operator, self.pos):
+                self.pos += len(operator)
+                bound = self.word()
+                if operator[0] == ">":
+                    return Range(field, bound, None, operator == ">=", True)
+                return Range(field, None, bound, True, operator == "<=")
+        value = self.word()
+        if not value:
+            raise QuerySyntaxError(f"Missing value for field {field}")
+        if value == "*":
+            return Exists(field)
+        kind = "wildcard" if ("*" in value or "?" in value) else "term"
+        return Match(field, value, kind)
+
+    def range(self, field: str) -> Range:
+        include_low = self.text[self.pos] == "["
+        self.pos += 1
+        self.skip()
+        low = self.quoted() if self.peek() == '"' else self.word()
+        if not self.accept("TO"):
+            raise QuerySyntaxError("Expected TO in range")
+        self.skip()
+        high = self.quoted() if self.peek() == '"' else self.range_bound()
+        closing = self.peek()
+        if closing not in ("]", "}"):
+            raise QuerySyntaxError("Unterminated range")
+        self.pos += 1
+        return Range(field, None if low == "*" else low, None if high == "*" else high, include_low, closing == "]")
+
+    def range_bound(self) -> str:
+        start = self.pos
+        while self.pos < len(self.text) and not self.text[self.pos].isspace() and self.text[self.pos] not in "]}":
+            self.pos += 1
+        return self.text[start:self.pos]
+
+
+@lru_cache(maxsize=256)
+def compile_query(qs: str) -> Any:
+    """Parse a query string into a (cached, immutable) query tree."""
+    return _Parser(qs).parse()
+
+
+# ---------------------------
+# ------- evaluation --------
+# ---------------------------
+
+def evaluate(node: Any, snapshot: Any) -> np.ndarray:
+    """Evaluate a compiled query on a snapshot, returning a boolean row mask."""
+    if isinstance(node, Bool):
+        return _evaluate_bool(node, snapshot)
+    if isinstance(node, Exists):
+        return ~_column(snapshot, node.field).missing
+    name = node.field
+    if name.endswith(".text"):
+        return _evaluate_text(node, snapshot, name[:-len(".text")])
+    column = _column(snapshot, name)
+    if getattr(column, "dictionary", None) is not None:
+        return _evaluate_keyword(node, column)
+    return _evaluate_number(node, column)
+
+
+def _evaluate_bool(node: Bool, snapshot: Any) -> np.ndarray:
+    must = [evaluate(n, snapshot) for occur, n in node.clauses if occur == MUST]
+    should = [evaluate(n, snapshot) for occur, n in node.clauses if occur == SHOULD]
+    must_not = [evaluate(n, snapshot) for occur, n in node.clauses if occur == MUST_NOT]
+    if must:
+        mask = np.logical_and.reduce(must)
+    elif should:
+        mask = np.logical_or.reduce(should)
+    else:
+        mask = np.ones(snapshot.n_rows, dtype=bool)
+    for excluded in must_not:
+        mask = mask & ~excluded
+    return mask
+
+
+def _column(snapshot: Any, name: str) -> Any:
+    column = snapshot.columns.get(name)
+    if column is None:
+        raise QuerySyntaxError(f"Unknown field {name}")
+    return column
+
+
+def _codes_mask(column: Any, selected: np.ndarray) -> np.ndarray:
+    """Row mask from a boolean table over the column dictionary (missing rows never match)."""
+    table = np.append(selected, False)
+    return table[column.codes]
+
+
+def _evaluate_keyword(node: Any, column: Any) -> np.ndarray:
+    dictionary = column.dictionary
+    if isinstance(node, Match):
+        if node.kind == "wildcard":
+            pattern = re.compile("".join(
+                ".*" if c == "*" else "." if c == "?" else re.escape(c) for c in node.value
+            ), re.DOTALL)
+            selected = np.array([pattern.fullmatch(v) is not None for v in dictionary], dtype=bool)
+            return _codes_mask(column, selected)
+        i = bisect_left(dictionary, node.value)
+        if i < len(dictionary) and dictionary[i] == node.value:
+            return column.codes == i
+        return np.zeros(len(column.codes), dtype=bool)
+    # Range: the dictionary is sorted, so bounds translate to a range of codes.
+    low = 0 if node.low is None else (
+        bisect_left(dictionary, node.low) if node.include_low else bisect_right(dictionary, node.low)
+    )
+    high = len(dictionary) if node.high is None else (
+        bisect_right(dictionary, node.high) if node.include_high else bisect_left(dictionary, node.high)
+    )
+    return (column.codes >= low) & (column.codes < high)
+
+
+def _parse_number(value: str, column: Any) -> float:
+    if column.kind == "boolean" and value.lower() in ("true", "false"):
+        return 1.0 if value.lower() == "true" else 0.0
+    if not _NUMBER.match(value):
+        raise QuerySyntaxError(f"Not a number: {value}")
+    return float(value)
+
+
+def _evaluate_number(node: Any, column: Any) -> np.ndarray:
+    values = column.values
+    if isinstance(node, Match):
+        if node.kind == "wildcard":
+            raise QuerySyntaxError("Wildcards on numeric fields are not supported")
+        return values == _parse_number(node.value, column)
+    mask = ~column.missing
+    if node.low is not None:
+        low = _parse_number(node.low, column)
+        mask &= (values >= low) if node.include_low else (values > low)
+    if node.high is not None:
+        high = _parse_number(node.high, column)
+        mask &= (values <= high) if node.include_high else (values < high)
+    return mask
+
+
+def _evaluate_text(node: Any, snapshot: Any, name: str) -> np.ndarray:
+    index = snapshot.text_index.fields.get(name)
+    if index is None or not isinstance(node, Match):
+        raise QuerySyntaxError(f"Unsupported text query on {name}")
+    value = node.value
+    prefix = False
+    if node.kind == "wildcard":
+        if "?" in value or "*" in value[:-1]:
+            raise QuerySyntaxError("Only trailing wildcards are supported on text fields")
+        value, prefix = value[:-1], True
+    tokens = tokenize(value)
+    if not tokens:
+        return np.zeros(snapshot.n_rows, dtype=bool)
+    if node.kind == "phrase" or len(tokens) == 1:
+        return index.rows(index.match(TextTerm(tokens, prefix)))
+    # Several unquoted tokens: any of them (default operator OR).
+    return np.logical_or.reduce([index.rows(index.match(TextTerm([t], prefix))) for t in tokens])
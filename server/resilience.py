@@ -0,0 +1,217 @@
+"""Protections of the calls to data.ademe.fr: retries, circuit breaker, concurrency cap.
+
+- ``RetryPolicy``: idempotent GETs failing with a transport error, a 429 or
+  a 5xx are retried with jittered exponential backoff ("full jitter"); a
+  Retry-After header, when present, sets the delay instead.
+- ``CircuitBreaker``: after a run of consecutive failures, calls fail fast
+  (``server.upstream`` serves stale cached responses instead) until a cool-down has
+  passed; one trial call then decides whether to close it again.
+- ``AdaptiveLimiter``: caps the number of concurrent outbound requests,
+  shared by threads and event loops. The cap grows by one slot per window
+  of successful calls and is halved on overload (AIMD), so a struggling
+  upstream gets fewer parallel requests.
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import httpx
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def is_overload(response: Optional[httpx.Response]) -> bool:
+    """Whether an attempt failed because upstream is unavailable or overloaded (None: transport error)."""
+    return response is None or response.status_code in RETRYABLE_STATUSES
+
+
+def retry_after(response: Optional[httpx.Response]) -> Optional[float]:
+    """Delay in seconds requested by a Retry-After header (seconds or HTTP date)."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0.0)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    When and how long to wait before sending a request again.
+
+    Arguments:
+    - attempts: Total number of attempts, the first one included.
+    - base_delay: Backoff of the first retry, doubled at each retry.
+    - max_delay: Upper bound of a backoff or of a Retry-After delay.
+    """
+
+    attempts: int = 3
+    base_delay: float = 0.2
+    max_delay: float = 5.0
+
+    def backoff(self, attempt: int, response: Optional[httpx.Response]) -> Optional[float]:
+        """
+        Return the delay before the next attempt, or None if the outcome is final.
+
+        Arguments:
+        - attempt: Number of the attempt that just completed, starting at 0.
+        - response: Its response, or None if it failed with a transport error.
+        """
+        if not is_overload(response) or attempt + 1 >= self.attempts:
+            return None
+        requested = retry_after(response)
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. Open: calls are refused until ``reset_timeout``
+    seconds have passed. Half-open: a single trial call is let through.
+
+    Arguments:
+    - threshold: Consecutive failures opening the circuit.
+    - reset_timeout: Seconds the circuit stays open.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_at: Optional[float] = None
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self._clock() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            now = self._clock()
+            # A trial call that never reported back (e.g. cancelled) does not block the next one forever.
+            if state == "half-open" and (self._trial_at is None or now - self._trial_at >= self.reset_timeout):
+                self._trial_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool) -> None:
+        """Record the outcome of a call let through by ``allow``."""
+        with self._lock:
+            self._trial_at = None
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = self._clock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency cap between ``minimum`` and ``maximum`` slots, adjusted from
+    the outcome of the calls (see ``record``). ``acquire`` blocks a thread,
+    ``aacquire`` suspends a task; ``release`` hands the slot to the oldest
+    waiter of either kind.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        # Callbacks granting a slot to a waiter; False if the waiter is gone.
+        self._waiters: "deque[Callable[[], bool]]" = deque()
+
+    def _take(self) -> bool:
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def _wake(self) -> None:
+        # Called with the lock held: hand free slots over to waiters.
+        while self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            if not self._waiters.popleft()():
+                self.in_flight -= 1
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self._take():
+                return
+            granted = threading.Event()
+            self._waiters.append(lambda: granted.set() or True)
+        granted.wait()
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._take():
+                return
+            granted = loop.create_future()
+
+            def grant():
+                try:
+                    loop.call_soon_threadsafe(self._grant, granted)
+                except RuntimeError:  # event loop closed
+                    return False
+                return True
+
+            self._waiters.append(grant)
+        await granted
+
+    def _grant(self, granted: asyncio.Future) -> None:
+        if granted.done():
+            # The waiting task was cancelled: give the slot back.
+            self.release()
+        else:
+            granted.set_result(None)
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def record(self, overloaded: bool) -> None:
+        """Additive increase after success, multiplicative decrease on overload."""
+        with self._lock:
+            if overloaded:
+                self.limit = max(float(self.minimum), self.limit / 2)
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._wake()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"limit": int(self.limit), "in_flight": self.in_flight, "waiting": len(self._waiters)}
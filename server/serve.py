@@ -0,0 +1,172 @@
+"""Production HTTP serving: the MCP server over streamable HTTP, in several worker processes.
+
+Run it with::
+
+    python -m server.serve
+
+The MCP endpoint is ``/mcp``. Workers are uvicorn processes sharing the listening
+socket; the parent process restarts any worker that dies or stops answering.
+The server runs in stateless mode: every request carries everything needed to
+answer it, so any worker can serve any request of a client, without session
+affinity in front of the workers. Each worker keeps its own snapshot; set
+AGRIBALYSE_SNAPSHOT_PATH so that they share a single memory-mapped copy (see
+``server.columnar``).
+
+Besides the MCP endpoint and ``/metrics``:
+
+- ``GET /healthz``: the worker is alive (always 200);
+- ``GET /readyz``: 200 once the worker can serve (snapshot loaded in snapshot
+  mode), 503 before and while draining.
+
+On SIGTERM, a worker reports itself as draining on ``/readyz`` for
+AGRIBALYSE_DRAIN_DELAY seconds so that load balancers stop sending it new
+requests, then stops accepting connections and gives the requests in flight
+AGRIBALYSE_DRAIN_TIMEOUT seconds to complete before closing the upstream
+clients and stopping the snapshot refresh. A second signal stops it at once.
+
+Settings (environment variables):
+
+- AGRIBALYSE_HOST: interface to listen on (default: 0.0.0.0).
+- AGRIBALYSE_PORT: port to listen on (default: 8000).
+- AGRIBALYSE_WORKERS: number of worker processes (default: number of CPUs).
+- AGRIBALYSE_DRAIN_DELAY: seconds between SIGTERM and closing the socket (default: 0).
+- AGRIBALYSE_DRAIN_TIMEOUT: seconds given to the requests in flight at shutdown (default: 30).
+"""
+import logging
+import os
+import threading
+from contextlib import asynccontextmanager
+from types import FrameType
+from typing import Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from uvicorn.supervisors import Multiprocess
+
+from server.config import env_float, env_int, env_str
+
+logger = logging.getLogger(__name__)
+
+_draining = threading.Event()
+
+
+def draining() -> bool:
+    """Whether this worker received a shutdown signal."""
+    return _draining.is_set()
+
+
+async def healthz(request: Request) -> JSONResponse:
+    return JSONResponse({"status": "ok", "pid": os.getpid()})
+
+
+async def readyz(request: Request) -> JSONResponse:
+    from server import snapshot
+
+    if draining():
+        status = "draining"
+    elif snapshot.enabled() and snapshot.current() is None:
+        status = "loading"
+    else:
+        status = "ready"
+    return JSONResponse(
+        {"status": status, "pid": os.getpid(), "snapshot": snapshot.status()},
+        status_code=200 if status == "ready" else 503,
+    )
+
+
+class _Endpoint:
+    """ASGI app as a route endpoint, e.g. the MCP handler on ``/mcp`` itself (its mount redirects to ``/mcp/``)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.app(scope, receive, send)
+
+
+def create_app() -> Starlette:
+    """
+    Build the ASGI application of a worker: the streamable HTTP transport in
+    stateless mode, the health routes and the shutdown hooks.
+
+    Called once per worker process: FastMCP's session manager, shared by the
+    applications of a process, can only run once.
+    """
+    # Importé ici : le processus parent ne charge ni le serveur ni le snapshot
+    from server import snapshot, upstream
+    from server.server import mcp
+
+    # Lu à la création du gestionnaire de sessions, au premier appel de streamable_http_app
+    mcp.settings.stateless_http = True
+    app = mcp.streamable_http_app()
+    path = mcp.settings.streamable_http_path
+    handler = next(route.app for route in app.router.routes if getattr(route, "path", None) == path)
+    app.router.routes[:0] = [
+        Route(path, _Endpoint(handler), methods=["GET", "POST", "DELETE"]),
+        Route("/healthz", healthz),
+        Route("/readyz", readyz),
+    ]
+    run_sessions = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        async with run_sessions(app):
+            yield
+        snapshot.stop_refreshing(timeout=1.0)
+        await upstream.aclose()
+        upstream.close()
+
+    app.router.lifespan_context = lifespan
+    return app
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server reporting itself as draining for a while before stopping."""
+
+    def __init__(self, config: uvicorn.Config, drain_delay: float = 0.0):
+        super().__init__(config)
+        self.drain_delay = drain_delay
+
+    def handle_exit(self, sig: int, frame: Optional[FrameType]) -> None:
+        if draining() or self.drain_delay <= 0:
+            _draining.set()
+            super().handle_exit(sig, frame)
+            return
+        _draining.set()
+        logger.info("Draining for %.1fs before shutdown", self.drain_delay)
+        timer = threading.Timer(self.drain_delay, super().handle_exit, (sig, frame))
+        timer.daemon = True
+        timer.start()
+
+
+def config_from_env() -> uvicorn.Config:
+    return uvicorn.Config(
+        "server.serve:create_app",
+        factory=True,
+        host=env_str("AGRIBALYSE_HOST", "0.0.0.0"),
+        port=env_int("AGRIBALYSE_PORT", 8000),
+        workers=env_int("AGRIBALYSE_WORKERS", os.cpu_count() or 1),
+        timeout_graceful_shutdown=env_int("AGRIBALYSE_DRAIN_TIMEOUT", 30),
+        lifespan="on",
+    )
+
+
+def main() -> None:
+    config = config_from_env()
+    server = DrainingServer(config, drain_delay=env_float("AGRIBALYSE_DRAIN_DELAY", 0.0))
+    if config.workers > 1:
+        sock = config.bind_socket()
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+
+
+if __name__ == "__main__":
+    # Workers unpickle DrainingServer: it must come from server.serve, whose
+    # draining flag /readyz reads, not from __main__.
+    from server import serve
+
+    serve.main()
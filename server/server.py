@@ -1,39 +1,194 @@
+import os
+import sys
+
+if __package__ in (None, ""):
+    # Loaded as a script (``python server/server.py`` or ``mcp dev``): make the
+    # ``server`` package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from mcp.server.fastmcp import FastMCP, Context
 from mcp.server.fastmcp.prompts import base
 from mcp.server.fastmcp.tools import Tool
 from mcp.server.fastmcp.resources import Resource
 
-import requests
-from typing import Optional, List
+import asyncio
+import functools
+import inspect
+import time
+from contextlib import nullcontext
+from typing import Optional, List, Tuple
+
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+from server import export, formats, snapshot, summaries
+from server.aggregations import GROUP_METRICS
+from server.config import env_bool
+from server.metrics import profile, registry, timed
+from server.upstream import aget_json, get_json
+
+# Nombre maximal de groupes demandés à /values_agg par niveau
+MAX_GROUPS = 1000
+
+# Longueur maximale d'un filtre qs de recherche par codes (les URL trop longues sont refusées)
+MAX_CODES_QUERY_LENGTH = 2000
 
 # Initialisation du serveur MCP
 mcp = FastMCP("Agribalyse")
 
-BASE_URL = "https://data.ademe.fr/data-fair/api/v1/datasets/agribalyse-31-synthese"
+registry.describe("agribalyse_tool_seconds", "Duration of the MCP tool calls.")
+registry.describe("agribalyse_tool_calls_total", "MCP tool calls by outcome (ok, error, exception).")
+registry.describe("agribalyse_tool_response_bytes_total", "Bytes of tool results sent to MCP clients.")
+registry.describe("agribalyse_tool_calls_in_progress", "MCP tool calls being processed.")
+registry.describe("agribalyse_local_answers_total", "Requests answered from the local snapshot.")
+
+# Mode snapshot : le jeu de données est chargé en mémoire en arrière-plan
+if snapshot.enabled():
+    snapshot.start_loading()
+
+
+def upstream_tool(fn):
+    """
+    Register a tool answered by a single data-fair API call.
+
+    ``fn`` validates its arguments and returns either an error dictionary or
+    the ``(path, params)`` of the upstream request, optionally followed by a
+    function post-processing the answer. The request is answered from the
+    local snapshot when one is loaded and supports it, and sent to data-fair
+    otherwise. The MCP server runs an async version of the tool, so
+    concurrent sessions overlap their upstream I/O; the module-level name
+    stays a blocking function for direct callers, with the coroutine version
+    available as ``<tool>.aio``.
+    """
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        request = fn(*args, **kwargs)
+        if isinstance(request, dict):
+            return request
+        path, params, *transform = request
+        result = snapshot.answer(path, params)
+        if result is None:
+            result = get_json(path, params)
+        return transform[0](result) if transform else result
+
+    @functools.wraps(fn)
+    async def call_async(*args, **kwargs):
+        request = fn(*args, **kwargs)
+        if isinstance(request, dict):
+            return request
+        path, params, *transform = request
+        result = await fetch(path, params)
+        return transform[0](result) if transform else result
+
+    mcp.tool()(encoded(call_async))
+    call.aio = call_async
+    return call
+
+
+def async_tool(fn):
+    """
+    Register a tool written as a coroutine (e.g. one sending several upstream
+    requests concurrently). As with ``upstream_tool``, the module-level name
+    is a blocking function and the coroutine is available as ``<tool>.aio``.
+    """
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        return asyncio.run(fn(*args, **kwargs))
+
+    mcp.tool()(encoded(fn))
+    call.aio = fn
+    return call
+
+
+def encoded(fn):
+    """
+    Send the result of a tool to MCP clients as compact JSON text (FastMCP
+    would indent it), recording the call in the metrics registry. With
+    AGRIBALYSE_PROFILE=1, dictionary results carry a "_timings" breakdown
+    of the call in milliseconds.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def call(*args, **kwargs):
+        registry.add("agribalyse_tool_calls_in_progress", 1, tool=name)
+        start = time.perf_counter()
+        status = "exception"
+        try:
+            with profile() if env_bool("AGRIBALYSE_PROFILE", False) else nullcontext() as breakdown:
+                result = await fn(*args, **kwargs)
+            status = "error" if isinstance(result, dict) and "error" in result else "ok"
+            if breakdown is not None and isinstance(result, dict):
+                result = {**result, "_timings": {k: round(v * 1000, 3) for k, v in breakdown.items()}}
+            payload = formats.dumps(result)
+            registry.inc("agribalyse_tool_response_bytes_total", len(payload.encode("utf-8")), tool=name)
+            return payload
+        finally:
+            registry.add("agribalyse_tool_calls_in_progress", -1, tool=name)
+            registry.observe("agribalyse_tool_seconds", time.perf_counter() - start, tool=name)
+            registry.inc("agribalyse_tool_calls_total", tool=name, status=status)
+
+    # Le résultat est du texte JSON : FastMCP ne doit pas le valider selon l'annotation de `fn`
+    call.__annotations__ = {**fn.__annotations__, "return": str}
+    call.__signature__ = inspect.signature(fn).replace(return_annotation=str)
+    return call
+
+
+async def fetch(path: str, params: dict, dataset: Optional[snapshot.Snapshot] = None) -> dict:
+    """
+    Answer a data-fair request from the local snapshot if possible, from the API otherwise.
+    Tools sending several requests pass the snapshot taken at the start of the call as `dataset`.
+    """
+    with timed("local"):
+        local = snapshot.answer(path, params, dataset)
+    if local is not None:
+        registry.inc("agribalyse_local_answers_total", endpoint=path.split("/")[1])
+        return local
+    return await aget_json(path, params)
 
 # ---------------------------
 # -------- RESOURCES --------
 # ---------------------------
 @mcp.resource("agribalyse://api-docs")
-def agribalyse_api_docs() -> dict:
+async def agribalyse_api_docs() -> dict:
     """Retrieve the full OpenAPI specification of the Agribalyse API."""
-    response = requests.get(f"{BASE_URL}/api-docs.json")
-    try:
-        response.raise_for_status()
-        return response.json()
-    except requests.HTTPError as e:
-        return {"error": str(e), "status_code": response.status_code}
+    return await aget_json("/api-docs.json")
 
 @mcp.resource("agribalyse://files")
-def agribalyse_data_files() -> dict:
+async def agribalyse_data_files() -> dict:
     """List data files available through the ADEME API."""
-    response = requests.get(f"{BASE_URL}/data-files")
-    return response.json()
+    return await aget_json("/data-files")
+
+@mcp.resource("agribalyse://group-summaries")
+async def agribalyse_group_summaries() -> dict:
+    """Precomputed indicator statistics for every food group and sub-group."""
+    table = await asyncio.to_thread(snapshot.group_summaries)
+    return table.as_dict()
+
+@mcp.resource("agribalyse://snapshot")
+def agribalyse_snapshot() -> dict:
+    """Version, size and age of the local copy of the dataset (snapshot mode), and when it was last checked."""
+    return snapshot.status()
+
+@mcp.resource("agribalyse://stats")
+def agribalyse_stats() -> dict:
+    """Server metrics: tool and upstream latencies, status codes, bytes, cache and concurrency counters."""
+    return registry.as_dict()
+
+@mcp.resource("agribalyse://metrics", mime_type="text/plain")
+def agribalyse_metrics() -> str:
+    """Server metrics in the Prometheus text exposition format."""
+    return registry.prometheus()
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    # Point de collecte Prometheus (transports SSE / HTTP)
+    return PlainTextResponse(registry.prometheus(), media_type="text/plain; version=0.0.4")
     
 # -------------------------
 # --------- TOOLS ---------
 # -------------------------
-@mcp.tool()
+@upstream_tool
 def read_lines(
     page: int = 1,
     size: int = 10,
@@ -41,7 +196,10 @@ def read_lines(
     select: Optional[List[str]] = None,
     q: Optional[str] = None,
     q_fields: Optional[List[str]] = None,
-    qs: Optional[str] = None
+    qs: Optional[str] = None,
+    format: str = "json",
+    compact: bool = False,
+    max_bytes: Optional[int] = None
 ) -> dict:
     """
     Retrieve data lines from the Agribalyse dataset via the ADEME public API.
@@ -76,10 +234,24 @@ def read_lines(
         - Nom_du_Produit_en_Français, LCI_Name, code_saison,
         - Livraison, Approche_emballage_, Préparation
     - qs: Advanced query string using Elasticsearch-style query DSL for complex filtering.
+    - format: Output format. Allowed values:
+        - json: rows as objects (default)
+        - columnar: column names listed once in "fields", then one value array per row in "rows"
+        - csv, tsv: the rows as a table in "data"
+    - compact: Drop internal fields (_i, _rand, _score...) and, unless `select` is given, return only
+        Code_AGB, Nom_du_Produit_en_Français, Groupe_d'aliment, Sous-groupe_d'aliment, DQR,
+        Score_unique_EF and Changement_climatique.
+    - max_bytes: Maximum size of the returned rows; rows past it are cut and "truncated" reports
+        how many rows and bytes were left out.
 
     Returns:
     - Dictionary containing the paginated dataset rows matching the query parameters.
     """
+    if format not in formats.OUTPUT_FORMATS:
+        return {"error": f"Invalid format: '{format}'"}
+    if compact and not select:
+        select = formats.COMPACT_COLUMNS
+
     params = {
         "page": page,
         "size": size
@@ -95,16 +267,12 @@ def read_lines(
     if qs:
         params["qs"] = qs
 
-    url = f"{BASE_URL}/lines"
-    response = requests.get(url, params=params)
-
-    try:
-        response.raise_for_status()
-        return response.json()
-    except requests.HTTPError as e:
-        return {"error": str(e), "status_code": response.status_code}
+    url = "/lines"
+    if format == "json" and not compact and max_bytes is None:
+        return url, params
+    return url, params, lambda result: formats.format_lines(result, format, max_bytes, drop_internal=compact)
 
-@mcp.tool()
+@upstream_tool
 def get_values(
     field: str,
     size: int = 10,
@@ -145,7 +313,7 @@ def get_values(
     if field not in allowed_fields:
         return {"error": f"The field '{field}' is not valid."}
 
-    url = f"{BASE_URL}/values/{field}"
+    url = f"/values/{field}"
     params = {
         "size": size,
         "sort": sort,
@@ -158,15 +326,9 @@ def get_values(
     if qs:
         params["qs"] = qs
 
-    response = requests.get(url, params=params)
+    return url, params
 
-    try:
-        response.raise_for_status()
-        return response.json()
-    except requests.HTTPError as e:
-        return {"error": str(e), "status_code": response.status_code}
-
-@mcp.tool()
+@upstream_tool
 def get_metric_agg(
     metric: str,
     field: str,
@@ -216,7 +378,7 @@ def get_metric_agg(
     if metric not in valid_metrics:
         return {"error": f"Metric '{metric}' is not supported."}
 
-    url = f"{BASE_URL}/metric_agg"
+    url = "/metric_agg"
     params = {
         "metric": metric,
         "field": field,
@@ -231,15 +393,9 @@ def get_metric_agg(
     if qs:
         params["qs"] = qs
 
-    response = requests.get(url, params=params)
-
-    try:
-        response.raise_for_status()
-        return response.json()
-    except requests.HTTPError as e:
-        return {"error": str(e), "status_code": response.status_code}
+    return url, params
 
-@mcp.tool()
+@upstream_tool
 def get_simple_metrics_agg(
     metrics: Optional[List[str]] = None,
     fields: Optional[List[str]] = None,
@@ -281,7 +437,7 @@ def get_simple_metrics_agg(
     Returns:
     - Dictionary with aggregated results.
     """
-    url = f"{BASE_URL}/simple_metrics_agg"
+    url = "/simple_metrics_agg"
     params = {"q_mode": q_mode}
 
     if metrics:
@@ -295,15 +451,9 @@ def get_simple_metrics_agg(
     if qs:
         params["qs"] = qs
 
-    response = requests.get(url, params=params)
-
-    try:
-        response.raise_for_status()
-        return response.json()
-    except requests.HTTPError as e:
-        return {"error": str(e), "status_code": response.status_code}
+    return url, params
 
-@mcp.tool()
+@upstream_tool
 def get_words_agg(
     field: str,
     analysis: str = "lang",
@@ -342,7 +492,7 @@ def get_words_agg(
     if field not in valid_fields:
         return {"error": f"Invalid field: '{field}'"}
 
-    url = f"{BASE_URL}/words_agg"
+    url = "/words_agg"
     params = {
         "field": field,
         "analysis": analysis,
@@ -356,15 +506,9 @@ def get_words_agg(
     if qs:
         params["qs"] = qs
 
-    response = requests.get(url, params=params)
+    return url, params
 
-    try:
-        response.raise_for_status()
-        return response.json()
-    except requests.HTTPError as e:
-        return {"error": str(e), "status_code": response.status_code}
-
-@mcp.tool()
+@upstream_tool
 def read_schema(
     mimeType: str = "application/json",
     type: Optional[List[str]] = None,
@@ -387,7 +531,7 @@ def read_schema(
     Returns:
     - Full schema description of dataset fields.
     """
-    url = f"{BASE_URL}/schema"
+    url = "/schema"
     params = {"mimeType": mimeType}
     if type:
         params["type"] = ",".join(type)
@@ -400,15 +544,9 @@ def read_schema(
     if calculated:
         params["calculated"] = calculated
 
-    response = requests.get(url, params=params)
+    return url, params
 
-    try:
-        response.raise_for_status()
-        return response.json()
-    except requests.HTTPError as e:
-        return {"error": str(e), "status_code": response.status_code}
-
-@mcp.tool()
+@upstream_tool
 def read_safe_schema(
     mimeType: str = "application/json",
     type: Optional[List[str]] = None,
@@ -431,7 +569,7 @@ def read_safe_schema(
     Returns:
     - Safe schema description of dataset fields.
     """
-    url = f"{BASE_URL}/safe-schema"
+    url = "/safe-schema"
     params = {"mimeType": mimeType}
     if type:
         params["type"] = ",".join(type)
@@ -444,13 +582,423 @@ def read_safe_schema(
     if calculated:
         params["calculated"] = calculated
 
-    response = requests.get(url, params=params)
+    return url, params
+
+@async_tool
+async def get_products_table(
+    products: List[str],
+    indicators: List[str]
+) -> dict:
+    """
+    Retrieve several indicators for several products in a single call, e.g. to compare products.
+
+    Arguments:
+    - products: Product names (matched on Nom_du_Produit_en_Français, best match kept)
+        or Code_AGB values (max: 50).
+    - indicators: Indicator columns to return. Allowed fields:
+        - DQR, Score_unique_EF, Changement_climatique,
+        - Appauvrissement_de_la_couche_d'ozone, Rayonnements_ionisants,
+        - Formation_photochimique_d'ozone, Particules_fines,
+        - Effets_toxicologiques_sur_la_santé_humaine___substances_non-cancérogènes,
+        - Effets_toxicologiques_sur_la_santé_humaine___substances_cancérogènes,
+        - Acidification_terrestre_et_eaux_douces, Eutrophisation_eaux_douces,
+        - Eutrophisation_marine, Eutrophisation_terrestre,
+        - Écotoxicité_pour_écosystèmes_aquatiques_d'eau_douce,
+        - Utilisation_du_sol, Épuisement_des_ressources_eau,
+        - Épuisement_des_ressources_énergétiques, Épuisement_des_ressources_minéraux,
+        - Changement_climatique_-_émissions_biogéniques,
+        - Changement_climatique_-_émissions_fossiles,
+        - Changement_climatique_-_émissions_liées_au_changement_d'affectation_des_sols
+
+    Returns:
+    - Table with the column names in "fields" and one row per product found in "rows"
+      (the requested product, Code_AGB, product name, then the indicators in the requested order).
+      Products without a match are listed in "not_found", failed lookups in "errors".
+    """
+    valid_indicators = [
+        "DQR", "Score_unique_EF", "Changement_climatique",
+        "Appauvrissement_de_la_couche_d'ozone", "Rayonnements_ionisants",
+        "Formation_photochimique_d'ozone", "Particules_fines",
+        "Effets_toxicologiques_sur_la_santé_humaine___substances_non-cancérogènes",
+        "Effets_toxicologiques_sur_la_santé_humaine___substances_cancérogènes",
+        "Acidification_terrestre_et_eaux_douces", "Eutrophisation_eaux_douces",
+        "Eutrophisation_marine", "Eutrophisation_terrestre",
+        "Écotoxicité_pour_écosystèmes_aquatiques_d'eau_douce",
+        "Utilisation_du_sol", "Épuisement_des_ressources_eau",
+        "Épuisement_des_ressources_énergétiques", "Épuisement_des_ressources_minéraux",
+        "Changement_climatique_-_émissions_biogéniques",
+        "Changement_climatique_-_émissions_fossiles",
+        "Changement_climatique_-_émissions_liées_au_changement_d'affectation_des_sols"
+    ]
+    invalid = [field for field in indicators if field not in valid_indicators]
+    if invalid:
+        return {"error": f"Invalid indicators: {invalid}"}
+    if not products or len(products) > 50:
+        return {"error": "Between 1 and 50 products are required."}
+
+    columns = ["Code_AGB", "Nom_du_Produit_en_Français"] + list(indicators)
+    dataset = snapshot.current()
+    requests = []
+    for product in products:
+        params = {"page": 1, "size": 1, "select": ",".join(columns)}
+        if product.strip().isdigit():
+            params["qs"] = f'Code_AGB:"{product.strip()}"'
+        else:
+            params["q"] = product
+            params["q_fields"] = "Nom_du_Produit_en_Français"
+        requests.append(fetch("/lines", params, dataset))
+    responses = await asyncio.gather(*requests)
+
+    table = {"fields": ["product"] + columns, "rows": [], "not_found": [], "errors": {}}
+    for product, response in zip(products, responses):
+        if "error" in response:
+            table["errors"][product] = response["error"]
+        elif not response.get("results"):
+            table["not_found"].append(product)
+        else:
+            row = response["results"][0]
+            table["rows"].append([product] + [row.get(column) for column in columns])
+    return table
+
+def code_queries(field: str, codes: List[str]) -> List[Tuple[str, List[str]]]:
+    """
+    Group codes into as few `field:("a" OR "b" ...)` filters as fit in MAX_CODES_QUERY_LENGTH,
+    returned with the codes of each filter.
+    """
+    def term(code: str) -> str:
+        return '"' + code.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    chunks: List[List[str]] = []
+    length = 0
+    for code in codes:
+        size = len(" OR ") + len(term(code))
+        if not chunks or length + size > MAX_CODES_QUERY_LENGTH:
+            chunks.append([])
+            length = len(field) + len(":()") - len(" OR ")
+        chunks[-1].append(code)
+        length += size
+    return [(f"{field}:({' OR '.join(term(code) for code in chunk)})", chunk) for chunk in chunks]
+
+@async_tool
+async def get_products_by_code(
+    codes: List[str],
+    code_field: str = "Code_AGB",
+    select: Optional[List[str]] = None
+) -> dict:
+    """
+    Retrieve the products with the given codes in a single call, e.g. the ingredients of a recipe.
+
+    Arguments:
+    - codes: Code_AGB or Code_CIQUAL values (max: 1000).
+    - code_field: Field the codes belong to: "Code_AGB" or "Code_CIQUAL".
+    - select: Columns to return (same fields as read_lines; default: all columns).
+        The code field is always included.
+
+    Returns:
+    - The matching rows in "results", in the order of the codes (a Code_CIQUAL may match
+      several products). Codes without a match are listed in "not_found", codes whose
+      lookup failed in "errors".
+    """
+    if code_field not in ("Code_AGB", "Code_CIQUAL"):
+        return {"error": "code_field must be Code_AGB or Code_CIQUAL"}
+    codes = list(dict.fromkeys(str(code).strip() for code in codes if str(code).strip()))
+    if not codes or len(codes) > 1000:
+        return {"error": "Between 1 and 1000 codes are required."}
+    if select and code_field not in select:
+        select = [code_field] + list(select)
+
+    dataset = snapshot.current()
+    if dataset is not None:
+        unknown_columns = [column for column in select or [] if column not in dataset.columns]
+        if unknown_columns:
+            return {"error": f"Invalid select columns: {unknown_columns}"}
+        rows, not_found = dataset.lookup(code_field, codes)
+        return {"results": dataset.rows(rows, select), "not_found": not_found, "errors": {}}
+
+    # Mode API : une requête /lines par paquet de codes, en parallèle
+    queries = code_queries(code_field, codes)
+    requests = []
+    for qs, _ in queries:
+        params = {"qs": qs, "size": snapshot.MAX_PAGE_SIZE}
+        if select:
+            params["select"] = ",".join(select)
+        requests.append(fetch("/lines", params))
+    responses = await asyncio.gather(*requests)
+
+    found = {}
+    errors = {}
+    for (_, chunk), response in zip(queries, responses):
+        if "error" in response:
+            for code in chunk:
+                errors[code] = response["error"]
+            continue
+        for row in response.get("results", []):
+            found.setdefault(str(row.get(code_field)), []).append(row)
+    return {
+        "results": [row for code in codes for row in found.get(code, [])],
+        "not_found": [code for code in codes if code not in found and code not in errors],
+        "errors": errors,
+    }
+
+@async_tool
+async def get_group_summary(
+    group: Optional[str] = None,
+    field: str = "Groupe_d'aliment",
+    indicators: Optional[List[str]] = None
+) -> dict:
+    """
+    Retrieve precomputed statistics (count, mean, min, q1, median, q3, max) of the impact
+    indicators for a food group or sub-group, without any query. Prefer it to get_metric_agg
+    for questions such as "average climate impact of dairy products".
+
+    Arguments:
+    - group: Group or sub-group name (case and accents are ignored). Leave empty to get every
+        group of the field, e.g. to rank them.
+    - field: Grouping column. Allowed values:
+        - Groupe_d'aliment, Sous-groupe_d'aliment
+    - indicators: Indicators to include (default: all). Allowed fields:
+        - DQR, Score_unique_EF, Changement_climatique,
+        - Appauvrissement_de_la_couche_d'ozone, Rayonnements_ionisants,
+        - Formation_photochimique_d'ozone, Particules_fines,
+        - Effets_toxicologiques_sur_la_santé_humaine___substances_non-cancérogènes,
+        - Effets_toxicologiques_sur_la_santé_humaine___substances_cancérogènes,
+        - Acidification_terrestre_et_eaux_douces, Eutrophisation_eaux_douces,
+        - Eutrophisation_marine, Eutrophisation_terrestre,
+        - Écotoxicité_pour_écosystèmes_aquatiques_d'eau_douce,
+        - Utilisation_du_sol, Épuisement_des_ressources_eau,
+        - Épuisement_des_ressources_énergétiques, Épuisement_des_ressources_minéraux,
+        - Changement_climatique_-_émissions_biogéniques,
+        - Changement_climatique_-_émissions_fossiles,
+        - Changement_climatique_-_émissions_liées_au_changement_d'affectation_des_sols
+
+    Returns:
+    - For one group: its "name", number of "products", parent "group" (sub-groups only)
+      and the statistics of each indicator in "indicators".
+    - Without group: the same for every group of the field, in "groups".
+    """
+    if field not in summaries.GROUP_FIELDS:
+        return {"error": f"Invalid field: '{field}'"}
+    invalid = [name for name in indicators or [] if name not in summaries.INDICATORS]
+    if invalid:
+        return {"error": f"Invalid indicators: {invalid}"}
+    try:
+        table = await asyncio.to_thread(snapshot.group_summaries)
+    except RuntimeError as e:
+        return {"error": str(e)}
+
+    def select(summary: dict) -> dict:
+        if not indicators:
+            return summary
+        return {**summary, "indicators": {k: v for k, v in summary["indicators"].items() if k in indicators}}
+
+    if group is None:
+        return {"field": field, "groups": {name: select(table.get(field, name)) for name in table.names(field)}}
+    name = table.resolve(field, group)
+    if name is None:
+        return {"error": f"Unknown {field}: '{group}'", "available": table.names(field)}
+    return {"field": field, "name": name, **select(table.get(field, name))}
+
+@async_tool
+async def get_grouped_metrics(
+    group_by: List[str],
+    fields: Optional[List[str]] = None,
+    metrics: Optional[List[str]] = None,
+    sort: str = "-count",
+    size: int = 10,
+    q: Optional[str] = None,
+    q_mode: str = "simple",
+    q_fields: Optional[List[str]] = None,
+    qs: Optional[str] = None
+) -> dict:
+    """
+    Group the matching rows by one or two text fields and compute metrics per group, in one
+    call (e.g. rank sub-groups by average Score_unique_EF). Prefer it to calling get_metric_agg
+    once per value returned by get_values.
+
+    Arguments:
+    - group_by: One or two grouping columns (two: one row per pair of values). Allowed fields:
+        - Code_AGB, Groupe_d'aliment, Sous-groupe_d'aliment,
+        - Nom_du_Produit_en_Français, LCI_Name, code_saison,
+        - Livraison, Approche_emballage_, Préparation
+    - fields: Numeric columns the metrics are computed on (same fields as get_simple_metrics_agg).
+    - metrics: Metrics computed on each field (default: avg). Allowed values:
+        - avg, sum, min, max
+    - sort: Column of the result to sort by, prefixed with '-' for descending order: "count",
+        a group_by field, or a metric column such as "avg(Score_unique_EF)" (default: "-count").
+    - size: Number of groups returned (max: 1000).
+    - q: Simple text search query.
+    - q_mode: Search mode. Allowed values:
+        - simple, complete
+    - q_fields: Fields for simple search (same fields as group_by).
+    - qs: Advanced query string using Elasticsearch-style query DSL.
+
+    Returns:
+    - Table with the column names in "fields" (group_by fields, "count", then one column per
+      metric and field, named like "avg(Score_unique_EF)") and the top groups in "rows";
+      "groups" is the number of groups before the size limit, "total" the number of matching rows.
+    """
+    valid_groups = [
+        "Code_AGB", "Groupe_d'aliment", "Sous-groupe_d'aliment",
+        "Nom_du_Produit_en_Français", "LCI_Name", "code_saison",
+        "Livraison", "Approche_emballage_", "Préparation"
+    ]
+    if not group_by or len(group_by) > 2 or any(field not in valid_groups for field in group_by):
+        return {"error": f"group_by must be one or two of {valid_groups}"}
+    invalid = [field for field in fields or [] if field not in summaries.INDICATORS]
+    if invalid:
+        return {"error": f"Invalid fields: {invalid}"}
+    metrics = metrics or ["avg"]
+    invalid = [metric for metric in metrics if metric not in GROUP_METRICS]
+    if invalid:
+        return {"error": f"Invalid metrics: {invalid}"}
+    if not 1 <= size <= 1000:
+        return {"error": "size must be between 1 and 1000"}
+    columns = [(metric, field) for field in fields or [] for metric in metrics]
+    labels = [f"{metric}({field})" for metric, field in columns]
+    if sort.lstrip("-") not in ["count"] + list(group_by) + labels:
+        return {"error": f"Invalid sort: '{sort}'"}
 
+    params = {
+        "field": ";".join(group_by),
+        # Every bucket is fetched, so that groups can be merged across metrics and sorted here.
+        "agg_size": ";".join([str(MAX_GROUPS)] * len(group_by)),
+        "size": 0,
+        "q_mode": q_mode,
+    }
+    if q:
+        params["q"] = q
+    if q_fields:
+        params["q_fields"] = ",".join(q_fields)
+    if qs:
+        params["qs"] = qs
+    requests = [{**params, "metric": metric, "metric_field": field} for metric, field in columns] or [params]
+    dataset = snapshot.current()
+    responses = await asyncio.gather(*(fetch("/values_agg", request, dataset) for request in requests))
+    for response in responses:
+        if "error" in response:
+            return response
+
+    def flatten(aggs: list, prefix: tuple = ()):
+        for bucket in aggs:
+            key = prefix + (bucket["value"],)
+            if bucket.get("aggs") is not None and len(key) < len(group_by):
+                yield from flatten(bucket["aggs"], key)
+            else:
+                yield key, bucket
+
+    rows = {key: list(key) + [bucket["total"]] for key, bucket in flatten(responses[0]["aggs"])}
+    if columns:
+        for response in responses:
+            found = {key: bucket.get("metric") for key, bucket in flatten(response["aggs"])}
+            for key, row in rows.items():
+                row.append(found.get(key))
+
+    names = list(group_by) + ["count"] + labels
+    index = names.index(sort.lstrip("-"))
+    present = [row for row in rows.values() if row[index] is not None]
+    present.sort(key=lambda row: row[index], reverse=sort.startswith("-"))
+    ordered = present + [row for row in rows.values() if row[index] is None]
+    return {"fields": names, "rows": ordered[:size], "groups": len(rows), "total": responses[0].get("total")}
+
+@async_tool
+async def resolve_product(name: str, limit: int = 5) -> dict:
+    """
+    Find the products whose name is closest to a free-text name, tolerating typos, missing
+    words and word order (French product names and English LCI names are both searched).
+    Use it before read_lines or get_products_table when the exact product name is not known.
+
+    Arguments:
+    - name: Product name as written by the user (e.g. "steack haché", "yaourt nature").
+    - limit: Number of candidates returned (max: 20).
+
+    Returns:
+    - The "candidates", best first, with their Code_AGB, Code_CIQUAL, names and groups,
+      a "score" between 0 and 1 and the name field that "matched".
+    """
+    if not name.strip():
+        return {"error": "A product name is required."}
+    if not 1 <= limit <= 20:
+        return {"error": "limit must be between 1 and 20"}
     try:
-        response.raise_for_status()
-        return response.json()
-    except requests.HTTPError as e:
-        return {"error": str(e), "status_code": response.status_code}
+        dataset = snapshot.current() or await asyncio.to_thread(snapshot.reference)
+    except RuntimeError as e:
+        return {"error": str(e)}
+    matches = dataset.products.search(name, limit)
+    columns = [
+        column for column in (
+            "Code_AGB", "Code_CIQUAL", "Nom_du_Produit_en_Français", "LCI_Name",
+            "Groupe_d'aliment", "Sous-groupe_d'aliment"
+        )
+        if column in dataset.columns
+    ]
+    rows = dataset.rows([row for row, _, _ in matches], columns)
+    return {
+        "query": name,
+        "candidates": [
+            {**row, "score": score, "matched": field} for row, (_, score, field) in zip(rows, matches)
+        ],
+    }
+
+@async_tool
+async def export_lines(
+    format: str = "csv",
+    select: Optional[List[str]] = None,
+    sort: Optional[str] = None,
+    q: Optional[str] = None,
+    q_fields: Optional[List[str]] = None,
+    qs: Optional[str] = None,
+    max_rows: Optional[int] = None,
+    chunk_size: int = export.EXPORT_CHUNK_SIZE,
+    cursor: Optional[str] = None,
+    ctx: Context = None
+) -> dict:
+    """
+    Export every row matching a query, beyond the 10,000 rows limit of read_lines, one chunk at a time.
+
+    Each call returns a chunk of rows as CSV or JSON Lines text and a "cursor": call again with
+    only that cursor to get the next chunk, until the cursor is null. Concatenating the "data"
+    of the chunks gives the whole export (the header line comes with the first CSV chunk).
+    Progress is reported after each chunk. Use it instead of paging through read_lines when
+    all matching rows are needed.
+
+    Arguments:
+    - format: Text format. Allowed values:
+        - csv, jsonl
+    - select: List of columns to export (same fields as read_lines; default: all columns).
+    - sort: Sorting criteria as a comma-separated string (prefix field with '-' for descending order).
+    - q: Simple text search query.
+    - q_fields: Fields for simple search (same fields as read_lines).
+    - qs: Advanced query string using Elasticsearch-style query DSL.
+    - max_rows: Maximum number of rows to export in all (default: all matching rows).
+    - chunk_size: Rows per chunk, between 1 and 10000 (default: 1000).
+    - cursor: Cursor returned by the previous call; the other arguments are then ignored.
+
+    Returns:
+    - Dictionary with the chunk as text in "data", its "format", the number of "rows" in the
+      chunk, the rows "exported" so far, the "total" number of matching rows, the "cursor" of
+      the next chunk (null after the last one) and whether max_rows "truncated" the export.
+    """
+    params = {}
+    if select:
+        params["select"] = ",".join(select)
+    if sort:
+        params["sort"] = sort
+    if q:
+        params["q"] = q
+    if q_fields:
+        params["q_fields"] = ",".join(q_fields)
+    if qs:
+        params["qs"] = qs
+
+    progress = None
+    if ctx is not None:
+        async def progress(done: int, total: Optional[int]) -> None:
+            await ctx.report_progress(done, total, f"{done} rows exported")
+
+    try:
+        return await export.export_chunk(params, format, max_rows, select, cursor, chunk_size, progress)
+    except (ValueError, RuntimeError) as e:
+        return {"error": str(e)}
 
 # -------------------------
 # -------- PROMPTS --------
@@ -458,7 +1006,10 @@ def read_safe_schema(
    
 @mcp.prompt()
 def search_product(nom: str) -> str:
-    return f"Can you give me the environmental impact information for the product named: {nom}?"
+    return (
+        f"Can you give me the environmental impact information for the product named: {nom}? "
+        f"Use resolve_product to find the matching product first."
+    )
 
 @mcp.prompt()
 def ask_stat(field: str, metric: str) -> str:
@@ -468,7 +1019,9 @@ def ask_stat(field: str, metric: str) -> str:
 def compare_products(prod1: str, prod2: str, indicator: str) -> str:
     return (
         f"Compare the environmental impacts of **{prod1}** and **{prod2}** "
-        f"based on the following indicator: {indicator}."
+        f"based on the following indicator: {indicator}. "
+        f"Use resolve_product to find the Code_AGB of each product, then get_products_table "
+        f"to retrieve both products in a single call."
     )
 
 @mcp.prompt()
@@ -0,0 +1,800 @@
+"""Local, in-memory copy of the Agribalyse dataset.
+
+When snapshot mode is enabled (AGRIBALYSE_SNAPSHOT=1), the whole dataset is
+downloaded once through paged ``/lines`` requests and kept in a columnar
+store: numeric columns are NumPy arrays, text columns are dictionary-encoded
+(integer codes into a sorted list of distinct strings). Requests the local
+engine can answer are then served from memory; anything it does not support
+raises ``Unsupported`` and goes to data-fair as before.
+
+When AGRIBALYSE_SNAPSHOT_PATH names a directory, the downloaded snapshot is
+written there in a columnar format that the other server processes of the
+host, and restarted ones, memory-map instead of downloading the dataset (see
+``server.columnar``). Otherwise, when the persistent cache is enabled
+(AGRIBALYSE_CACHE_PATH), the downloaded rows are stored in it. Either way, a
+restarted server installs the stored snapshot right away and only checks for
+a new version of the dataset once it is older than
+AGRIBALYSE_SNAPSHOT_MAX_AGE seconds (default: one day).
+
+The published version of the dataset (update dates and row count from its
+metadata, plus the data files) is then polled every
+AGRIBALYSE_SNAPSHOT_REFRESH seconds (default: one hour, 0 disables it). The
+dataset is downloaded and its indexes rebuilt in the background only when
+that version changed, and the new snapshot replaces the current one in a
+single assignment: requests keep using the snapshot they started with and
+never wait for a rebuild.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from functools import cached_property
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+from urllib.parse import urlencode
+
+import numpy as np
+
+from server import columnar, upstream
+from server.aggregations import COUNT_METRICS, GROUP_METRICS, METRICS, group_metric, parse_percents, summarize
+from server.config import env_bool, env_float
+from server.fuzzy import ProductIndex
+from server.query_string import QuerySyntaxError, compile_query, evaluate
+from server.summaries import GroupSummaries, build as build_summaries
+from server.text_index import SEARCH_FIELDS, FieldIndex, TextIndex
+
+logger = logging.getLogger(__name__)
+
+# data-fair defaults and limits
+DEFAULT_PAGE_SIZE = 12
+MAX_PAGE_SIZE = 10000
+DEFAULT_VALUES_SIZE = 10
+DEFAULT_AGG_SIZE = 20
+BUCKET_SORTS = ("count", "-count", "key", "-key", "metric", "-metric")
+
+# Product codes indexed for lookups by code (get_products_by_code).
+CODE_FIELDS = ("Code_AGB", "Code_CIQUAL")
+
+# Dataset metadata fields changed by data-fair when new data is published.
+VERSION_FIELDS = ("updatedAt", "dataUpdatedAt", "finalizedAt", "count")
+
+# Name of the snapshot in the persistent cache.
+STORED_SNAPSHOT = "rows"
+
+# Query-specific fields added by data-fair to each result, not stored locally.
+TRANSIENT_FIELDS = ("_score", "_highlight")
+
+
+class Unsupported(Exception):
+    """Raised when a request cannot be answered locally and must go upstream."""
+
+
+class NumericColumn:
+    """Numbers (or booleans) stored as float64, NaN marking missing values."""
+
+    def __init__(self, name: str, values: np.ndarray, kind: str = "number"):
+        self.name = name
+        self.values = values
+        self.kind = kind  # "number", "integer" or "boolean"
+        self.missing = np.isnan(values)
+        self.has_missing = bool(self.missing.any())
+
+    def take(self, idx: np.ndarray) -> List[Any]:
+        return self.convert(self.values[idx])
+
+    def convert(self, array: np.ndarray) -> List[Any]:
+        """Python values of an array of this column, None for missing ones."""
+        values = array.tolist()
+        if self.kind == "integer":
+            cast = int
+        elif self.kind == "boolean":
+            cast = bool
+        else:
+            cast = None
+        if not self.has_missing:
+            return [cast(v) for v in values] if cast else values
+        return [None if v != v else (cast(v) if cast else v) for v in values]
+
+    def sort_key(self, descending: bool) -> np.ndarray:
+        # NaN sorts last in both directions, like missing values in Elasticsearch.
+        return -self.values if descending else self.values
+
+    def as_float(self) -> np.ndarray:
+        return self.values
+
+
+class TextColumn:
+    """Dictionary-encoded strings: ``codes`` index into the sorted ``dictionary``, -1 is missing."""
+
+    def __init__(self, name: str, codes: np.ndarray, dictionary: List[str]):
+        self.name = name
+        self.codes = codes
+        self.dictionary = dictionary
+        self.missing = codes < 0
+        self.has_missing = bool(self.missing.any())
+
+    def take(self, idx: np.ndarray) -> List[Optional[str]]:
+        dictionary = self.dictionary
+        return [dictionary[c] if c >= 0 else None for c in self.codes[idx].tolist()]
+
+    def sort_key(self, descending: bool) -> np.ndarray:
+        codes = self.codes.astype(np.int64)
+        if descending:
+            return np.where(self.missing, 1, -codes)
+        return np.where(self.missing, len(self.dictionary), codes)
+
+    def as_float(self) -> np.ndarray:
+        """Codes as floats (NaN when missing), enough to count values and distinct values."""
+        return np.where(self.missing, np.nan, self.codes.astype(np.float64))
+
+
+Column = Union[NumericColumn, TextColumn]
+
+
+def _build_column(name: str, values: List[Any]) -> Column:
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, bool) for v in present):
+        kind = "boolean"
+    elif present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        kind = "integer" if all(isinstance(v, int) for v in present) else "number"
+    else:
+        kind = "text"
+
+    if kind != "text":
+        array = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+        return NumericColumn(name, array, kind)
+
+    strings = [None if v is None else str(v) for v in values]
+    dictionary = sorted({s for s in strings if s is not None})
+    index = {s: i for i, s in enumerate(dictionary)}
+    codes = np.array([-1 if s is None else index[s] for s in strings], dtype=np.int32)
+    return TextColumn(name, codes, dictionary)
+
+
+def _split(value: Any) -> List[str]:
+    if value is None or value == "":
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return [v.strip() for v in str(value).split(",") if v.strip()]
+
+
+def _code_index(column: Column, n_rows: int) -> Dict[str, List[int]]:
+    """Rows of each distinct value of a code column, keyed by the value as a string."""
+    index: Dict[str, List[int]] = {}
+    for row, value in enumerate(column.take(np.arange(n_rows))):
+        if value is not None:
+            index.setdefault(str(value), []).append(row)
+    return index
+
+
+def _levels(value: Any, count: int, default: str) -> List[str]:
+    """Per-level values of a ``;``-separated parameter, padded with ``default``."""
+    levels = [v.strip() for v in str(value).split(";")] if value not in (None, "") else []
+    return (levels + [default] * count)[:count]
+
+
+class Snapshot:
+    """Columnar copy of the dataset answering data-fair requests locally."""
+
+    def __init__(self, columns: Dict[str, Column], n_rows: int, metadata: Optional[Dict[str, Any]] = None):
+        self.columns = columns
+        self.names = list(columns)
+        self.n_rows = n_rows
+        self.metadata = dict(metadata or {})
+        self.loaded_at = time.time()
+        # Rank of each row in the default order (by _i), used to break ties when sorting.
+        if "_i" in columns:
+            default_order = np.lexsort([np.arange(n_rows), columns["_i"].sort_key(False)])
+        else:
+            default_order = np.arange(n_rows)
+        self._position = np.empty(n_rows, dtype=np.int64)
+        self._position[default_order] = np.arange(n_rows)
+
+    # ---- indexes ----
+    # Built on first use, so that a memory-mapped snapshot opens in milliseconds;
+    # ``build_indexes`` builds them all before a snapshot is installed by a refresh.
+
+    @cached_property
+    def text_index(self) -> TextIndex:
+        return TextIndex(
+            {
+                name: FieldIndex(self.columns[name].codes, self.columns[name].dictionary)
+                for name in SEARCH_FIELDS
+                if isinstance(self.columns.get(name), TextColumn)
+            },
+            self.n_rows,
+        )
+
+    @cached_property
+    def summaries(self) -> GroupSummaries:
+        """Per-group indicator statistics, served by get_group_summary."""
+        return build_summaries(self.columns, self.n_rows)
+
+    @cached_property
+    def products(self) -> ProductIndex:
+        """Fuzzy product name lookup, served by resolve_product."""
+        return ProductIndex(self.columns)
+
+    @cached_property
+    def code_index(self) -> Dict[str, Dict[str, List[int]]]:
+        """Rows by product code, served by get_products_by_code."""
+        return {name: _code_index(self.columns[name], self.n_rows) for name in CODE_FIELDS if name in self.columns}
+
+    def build_indexes(self) -> "Snapshot":
+        for name in ("text_index", "summaries", "products", "code_index"):
+            getattr(self, name)
+        return self
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Mapping[str, Any]], metadata: Optional[Dict[str, Any]] = None) -> "Snapshot":
+        """Build a snapshot from data-fair result rows."""
+        names: Dict[str, None] = {}
+        for row in rows:
+            for name in row:
+                if name not in TRANSIENT_FIELDS:
+                    names.setdefault(name)
+        columns = {name: _build_column(name, [row.get(name) for row in rows]) for name in names}
+        return cls(columns, len(rows), metadata)
+
+    @classmethod
+    def from_directory(cls, path: str) -> Optional["Snapshot"]:
+        """
+        Open the shared snapshot of a directory (``server.columnar``), its columns
+        memory-mapped; None if there is none.
+        """
+        meta = columnar.read(path)
+        if meta is None:
+            return None
+        columns: Dict[str, Column] = {}
+        for spec in meta["columns"]:
+            if spec["kind"] == "text":
+                columns[spec["name"]] = TextColumn(spec["name"], spec["array"], spec["dictionary"])
+            else:
+                columns[spec["name"]] = NumericColumn(spec["name"], spec["array"], spec["kind"])
+        snapshot = cls(columns, meta["rows"], meta["metadata"])
+        snapshot.loaded_at = meta["written_at"]
+        return snapshot
+
+    # ---- request dispatch ----
+
+    def answer(self, path: str, params: Optional[Mapping[str, Any]] = None) -> Union[dict, list]:
+        """
+        Answer a data-fair request from memory.
+
+        Raises ``Unsupported`` for endpoints or parameters the local engine does not handle.
+        """
+        params = params or {}
+        if path == "/lines":
+            return self.lines(params)
+        if path == "/metric_agg":
+            return self.metric_agg(params)
+        if path == "/simple_metrics_agg":
+            return self.simple_metrics_agg(params)
+        if path.startswith("/values/"):
+            return self.values(path[len("/values/"):], params)
+        if path == "/values_agg":
+            return self.values_agg(params)
+        raise Unsupported(path)
+
+    def lines(self, params: Mapping[str, Any]) -> dict:
+        """Local equivalent of ``GET /lines``."""
+        if "after" in params:
+            # data-fair cursor from an upstream ``next`` link.
+            raise Unsupported("after")
+        page = int(params.get("page", 1))
+        size = int(params.get("size", DEFAULT_PAGE_SIZE))
+        if page < 1 or size < 0 or size > MAX_PAGE_SIZE:
+            raise Unsupported("page/size out of range")
+        select = _split(params.get("select"))
+        self._check_fields(select)
+
+        mask, score = self.match(params)
+        rows = np.flatnonzero(mask)
+        sort = _split(params.get("sort"))
+        if score is not None and not sort:
+            # Without an explicit sort, text search results come by relevance.
+            order = rows[np.lexsort([self._position[rows], -score[rows]])]
+        else:
+            order = self.sort(rows, sort)
+        start = (page - 1) * size
+        idx = order[start:start + size]
+
+        results = self.rows(idx, select)
+        if score is not None:
+            for row, row_score in zip(results, score[idx].tolist()):
+                row["_score"] = row_score
+        result = {"total": int(len(rows)), "results": results}
+        if start + size < len(rows):
+            next_params = {k: v for k, v in params.items() if v is not None}
+            next_params["page"] = page + 1
+            result["next"] = f"{upstream.settings().base_url}/lines?{urlencode(next_params)}"
+        return result
+
+    def metric_agg(self, params: Mapping[str, Any]) -> dict:
+        """Local equivalent of ``GET /metric_agg``."""
+        metric = params.get("metric")
+        if metric not in METRICS:
+            raise Unsupported(f"metric {metric}")
+        column = self._metric_column(params.get("field"), [metric])
+        mask = self.mask(params)
+        values = column.as_float()[mask]
+        result = summarize(values, [metric], parse_percents(params.get("percents")))[0]
+        return {"total": int(np.count_nonzero(mask)), "metric": result[metric]}
+
+    def simple_metrics_agg(self, params: Mapping[str, Any]) -> dict:
+        """Local equivalent of ``GET /simple_metrics_agg``: every metric on every field in one pass."""
+        metrics = _split(params.get("metrics"))
+        fields = _split(params.get("fields"))
+        # data-fair picks defaults depending on the field types; leave those to it.
+        if not metrics or not fields or any(m not in METRICS for m in metrics):
+            raise Unsupported("default or unknown metrics")
+        columns = [self._metric_column(field, metrics) for field in fields]
+        mask = self.mask(params)
+        values = np.column_stack([column.as_float() for column in columns])[mask]
+        results = summarize(values, metrics)
+        return {"total": int(np.count_nonzero(mask)), "metrics": dict(zip(fields, results))}
+
+    def values(self, field: str, params: Mapping[str, Any]) -> list:
+        """Local equivalent of ``GET /values/{field}``: distinct values of the matching rows."""
+        self._check_fields([field])
+        size = int(params.get("size", DEFAULT_VALUES_SIZE))
+        descending = params.get("sort", "asc") == "desc"
+        column = self.columns[field]
+        mask = self.mask(params)
+        if isinstance(column, TextColumn):
+            # Dictionaries are sorted, so sorted codes give sorted values.
+            codes = np.unique(column.codes[mask & ~column.missing])
+            values = [column.dictionary[c] for c in (codes[::-1] if descending else codes)[:size].tolist()]
+        else:
+            distinct = np.unique(column.values[mask & ~column.missing])
+            values = column.convert((distinct[::-1] if descending else distinct)[:size])
+        return values
+
+    def values_agg(self, params: Mapping[str, Any]) -> dict:
+        """
+        Local equivalent of ``GET /values_agg``: terms buckets on one or two text fields
+        (``field=a;b``), with an optional metric computed per bucket.
+
+        Rows are grouped by their dictionary codes, which index the buckets
+        directly, and the metric is reduced per bucket in one vectorized pass.
+        """
+        fields = [f for f in str(params.get("field") or "").split(";") if f]
+        if not 1 <= len(fields) <= 2:
+            raise Unsupported("values_agg on more than two fields")
+        self._check_fields(fields)
+        columns = [self.columns[name] for name in fields]
+        if not all(isinstance(column, TextColumn) for column in columns):
+            raise Unsupported("values_agg on a numeric field")
+        if int(params.get("size", 0)) != 0:
+            raise Unsupported("lines in values_agg buckets")
+        sizes = [int(v) for v in _levels(params.get("agg_size"), len(fields), str(DEFAULT_AGG_SIZE))]
+        sorts = _levels(params.get("sort"), len(fields), "-count")
+        if any(sort not in BUCKET_SORTS for sort in sorts):
+            raise Unsupported(f"values_agg sort {params.get('sort')}")
+        metric, values = params.get("metric"), None
+        if metric:
+            if metric not in GROUP_METRICS:
+                raise Unsupported(f"values_agg metric {metric}")
+            values = self._metric_column(params.get("metric_field"), [metric]).as_float()
+
+        mask = self.mask(params)
+        total = int(np.count_nonzero(mask))
+        for column in columns:
+            mask &= ~column.missing
+        return {"total": total, "aggs": self._buckets(np.flatnonzero(mask), columns, sizes, sorts, metric, values)}
+
+    def _buckets(self, rows, columns, sizes, sorts, metric, values) -> List[dict]:
+        column = columns[0]
+        codes = column.codes[rows]
+        n_codes = len(column.dictionary)
+        counts = np.bincount(codes, minlength=n_codes)
+        metrics = group_metric(codes, n_codes, values[rows], metric) if metric else None
+        present = np.flatnonzero(counts)
+        by = sorts[0].lstrip("-")
+        if by == "count":
+            primary = counts[present].astype(np.float64)
+        elif by == "key":
+            primary = present.astype(np.float64)  # dictionaries are sorted
+        else:
+            primary = metrics[present]
+        keys = -primary if sorts[0].startswith("-") else primary
+        # Buckets without a metric value come last in both directions; ties by key.
+        keys = np.where(np.isnan(primary), np.inf, keys)
+        order = present[np.lexsort([present, keys])][:sizes[0]]
+
+        buckets = []
+        for code in order.tolist():
+            bucket = {"value": column.dictionary[code], "total": int(counts[code]), "results": []}
+            if metric:
+                value = float(metrics[code])
+                bucket["metric"] = None if value != value else value
+            if len(columns) > 1:
+                bucket["aggs"] = self._buckets(rows[codes == code], columns[1:], sizes[1:], sorts[1:], metric, values)
+            buckets.append(bucket)
+        return buckets
+
+    # ---- building blocks ----
+
+    def match(self, params: Mapping[str, Any]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Evaluate the filters of a request.
+
+        Returns:
+        - A boolean mask of the matching rows, and their relevance scores when
+          a text search (``q``) is involved (None otherwise).
+        """
+        mask = np.ones(self.n_rows, dtype=bool)
+        score = None
+        q = params.get("q")
+        if q:
+            try:
+                mask, score = self.text_index.search(
+                    str(q), _split(params.get("q_fields")), params.get("q_mode", "simple")
+                )
+            except ValueError as e:
+                raise Unsupported(str(e))
+        qs = params.get("qs")
+        if qs:
+            try:
+                mask = mask & evaluate(compile_query(str(qs)), self)
+            except QuerySyntaxError as e:
+                raise Unsupported(str(e))
+        return mask, score
+
+    def mask(self, params: Mapping[str, Any]) -> np.ndarray:
+        """Return a boolean mask of the rows matching the query parameters."""
+        return self.match(params)[0]
+
+    def sort(self, rows: np.ndarray, sort: List[str]) -> np.ndarray:
+        """Return ``rows`` ordered by a list of fields (prefixed with '-' for descending)."""
+        if not sort:
+            return rows[np.argsort(self._position[rows], kind="stable")]
+        keys = [self._position]
+        for field in reversed(sort):
+            descending = field.startswith("-")
+            name = field.lstrip("-+")
+            self._check_fields([name])
+            keys.append(self.columns[name].sort_key(descending))
+        return rows[np.lexsort([key[rows] for key in keys])]
+
+    def lookup(self, field: str, codes: Sequence[str]) -> Tuple[np.ndarray, List[str]]:
+        """
+        Rows of the given codes of a ``CODE_FIELDS`` column, in the order of the codes,
+        and the codes matching no row.
+        """
+        index = self.code_index.get(field)
+        if index is None:
+            raise Unsupported(f"lookup by {field}")
+        found: List[int] = []
+        unknown = []
+        for code in codes:
+            rows = index.get(code)
+            if rows is None:
+                unknown.append(code)
+            else:
+                found.extend(rows)
+        return np.array(found, dtype=np.int64), unknown
+
+    def rows(self, idx: np.ndarray, select: Optional[List[str]] = None) -> List[dict]:
+        """Materialize rows as dictionaries, omitting missing values."""
+        names = select or self.names
+        columns = [(name, self.columns[name].take(idx)) for name in names]
+        results = []
+        for i in range(len(idx)):
+            row = {}
+            for name, values in columns:
+                value = values[i]
+                if value is not None:
+                    row[name] = value
+            results.append(row)
+        return results
+
+    def _metric_column(self, name: Optional[str], metrics: List[str]) -> Column:
+        self._check_fields([name])
+        column = self.columns[name]
+        if isinstance(column, TextColumn) and any(m not in COUNT_METRICS for m in metrics):
+            raise Unsupported(f"numeric metric on text field {name}")
+        return column
+
+    def _check_fields(self, names: List[str]) -> None:
+        for name in names:
+            if name not in self.columns:
+                raise Unsupported(f"unknown field {name}")
+
+
+# ---------------------------
+# ---- snapshot lifecycle ----
+# ---------------------------
+
+_current: Optional[Snapshot] = None
+_loading: Optional[threading.Thread] = None
+_refreshing: Optional[threading.Thread] = None
+_stopping = threading.Event()
+_checked_at: Optional[float] = None
+_reference: Optional[Snapshot] = None
+_reference_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    """Whether snapshot mode is requested (AGRIBALYSE_SNAPSHOT=1)."""
+    return env_bool("AGRIBALYSE_SNAPSHOT", False)
+
+
+def refresh_interval() -> float:
+    """Seconds between two checks of the dataset version (0: never)."""
+    return env_float("AGRIBALYSE_SNAPSHOT_REFRESH", 3600.0)
+
+
+def current() -> Optional[Snapshot]:
+    """Return the snapshot in use, or None when requests go upstream."""
+    return _current
+
+
+def install(snapshot: Optional[Snapshot]) -> None:
+    """Make ``snapshot`` the one used to answer requests (None disables local answers)."""
+    global _current
+    _current = snapshot
+
+
+def dataset_version() -> Dict[str, Any]:
+    """
+    Fetch the published version of the dataset: the ``VERSION_FIELDS`` of its
+    metadata and a "version" fingerprint of them and of the data files.
+
+    Raises ``RuntimeError`` if the metadata cannot be read.
+    """
+    metadata = upstream.get_json(upstream.settings().base_url, use_cache=False)
+    if not isinstance(metadata, dict) or "error" in metadata:
+        raise RuntimeError(f"Could not read the dataset metadata: {metadata}")
+    files = upstream.get_json("/data-files", use_cache=False)
+    if not isinstance(files, list):
+        files = []  # the version then only depends on the metadata
+    version = {field: metadata.get(field) for field in VERSION_FIELDS}
+    fingerprint = json.dumps(
+        {**version, "files": [{k: f.get(k) for k in ("key", "name", "size", "updatedAt", "md5")} for f in files]},
+        sort_keys=True,
+    )
+    version["version"] = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+    return version
+
+
+def download_rows(page_size: int = MAX_PAGE_SIZE) -> List[dict]:
+    """Download every row of the dataset, following data-fair's ``next`` links."""
+    rows: List[dict] = []
+    result = upstream.get_json("/lines", {"size": page_size, "sort": "_i"}, use_cache=False)
+    while True:
+        if "error" in result:
+            raise RuntimeError(f"Snapshot download failed: {result['error']}")
+        rows.extend(result["results"])
+        next_url = result.get("next")
+        if not next_url or not result["results"]:
+            return rows
+        result = upstream.get_json(next_url, use_cache=False)
+
+
+def load(version: Optional[Dict[str, Any]] = None) -> Snapshot:
+    """
+    Download the dataset and install it as the current snapshot (persisting it if possible).
+
+    Arguments:
+    - version: Dataset version from ``dataset_version``, fetched first if not given
+      (a snapshot without version is downloaded again at the next check).
+    """
+    global _checked_at
+    start = time.perf_counter()
+    if version is None:
+        try:
+            version = dataset_version()
+            _checked_at = time.time()
+        except RuntimeError:
+            logger.warning("Could not read the dataset version", exc_info=True)
+            version = {}
+    rows = download_rows()
+    snapshot = Snapshot.from_rows(rows, metadata=version).build_indexes()
+    install(snapshot)
+    logger.info(
+        "Loaded Agribalyse snapshot %s: %d rows in %.2fs",
+        version.get("version"), snapshot.n_rows, time.perf_counter() - start,
+    )
+    path = columnar.directory()
+    store = upstream.response_cache.store
+    if path is not None:
+        columnar.write(path, snapshot.columns, snapshot.n_rows, snapshot.metadata)
+    elif store is not None:
+        stored = {"metadata": version, "rows": rows}
+        store.save_snapshot(STORED_SNAPSHOT, json.dumps(stored, ensure_ascii=False).encode("utf-8"))
+    return snapshot
+
+
+def restore() -> Optional[Snapshot]:
+    """
+    Open the shared on-disk snapshot (AGRIBALYSE_SNAPSHOT_PATH) or, without
+    one, the snapshot kept in the persistent cache, if any. It is not installed:
+    its indexes are built first, so that no request builds them.
+
+    Returns:
+    - The snapshot, its ``loaded_at`` being the time it was stored, or None if there is none.
+    """
+    path = columnar.directory()
+    if path is not None:
+        snapshot = Snapshot.from_directory(path)
+        if snapshot is not None:
+            logger.info(
+                "Opened Agribalyse snapshot %s: %d rows, %.0fs old",
+                snapshot.metadata.get("version"), snapshot.n_rows, time.time() - snapshot.loaded_at,
+            )
+        return snapshot
+    store = upstream.response_cache.store
+    stored = store.load_snapshot(STORED_SNAPSHOT) if store is not None else None
+    if stored is None:
+        return None
+    data, age = stored
+    data = json.loads(data)
+    if isinstance(data, list):  # rows stored without their version
+        data = {"metadata": {}, "rows": data}
+    snapshot = Snapshot.from_rows(data["rows"], metadata=data["metadata"])
+    snapshot.loaded_at = time.time() - age
+    logger.info("Restored Agribalyse snapshot: %d rows, %.0fs old", snapshot.n_rows, age)
+    return snapshot
+
+
+def refresh() -> bool:
+    """
+    Check the published version of the dataset and, if it differs from the current
+    snapshot's, install the new version: opened from the shared directory when
+    another process already wrote it, downloaded otherwise.
+
+    Returns:
+    - Whether a new snapshot was installed.
+    """
+    global _checked_at
+    version = dataset_version()
+    _checked_at = time.time()
+    snapshot = _current
+    if snapshot is not None and snapshot.metadata.get("version") == version["version"]:
+        return False
+    path = columnar.directory()
+    if path is None:
+        load(version)
+        return True
+    with columnar.lock(path):
+        shared = Snapshot.from_directory(path)
+        if shared is not None and shared.metadata.get("version") == version["version"]:
+            install(shared.build_indexes())
+        else:
+            load(version)
+    return True
+
+
+def start_loading() -> threading.Thread:
+    """
+    Load the snapshot in a background thread; requests go upstream until it is ready.
+    Once loaded, ``start_refreshing`` keeps it up to date.
+
+    A stored snapshot is installed as soon as its indexes are built; the dataset
+    version is only checked when there is none or it is too old. Processes
+    sharing AGRIBALYSE_SNAPSHOT_PATH download the dataset once.
+    """
+    global _loading
+    if _loading is None or not _loading.is_alive():
+        def run():
+            try:
+                stored = restore()
+                path = columnar.directory()
+                if stored is None and path is not None:
+                    with columnar.lock(path):
+                        # Written by another process while this one waited?
+                        stored = restore()
+                        if stored is None:
+                            load()
+                elif stored is None:
+                    load()
+                if stored is not None:
+                    install(stored.build_indexes())
+                    if time.time() - stored.loaded_at >= env_float("AGRIBALYSE_SNAPSHOT_MAX_AGE", 86400.0):
+                        refresh()
+            except Exception:
+                logger.exception("Could not load the Agribalyse snapshot, serving from the API")
+            start_refreshing()
+
+        _loading = threading.Thread(target=run, name="agribalyse-snapshot", daemon=True)
+        _loading.start()
+    return _loading
+
+
+def start_refreshing() -> Optional[threading.Thread]:
+    """
+    Check the dataset version every ``refresh_interval`` seconds in a background
+    thread, installing a new snapshot when it changed (see ``refresh``).
+
+    Returns:
+    - The thread, or None when the refresh is disabled.
+    """
+    global _refreshing
+    interval = refresh_interval()
+    if interval <= 0:
+        return None
+    if _refreshing is None or not _refreshing.is_alive():
+        _stopping.clear()
+
+        def run():
+            while not _stopping.wait(interval):
+                try:
+                    refresh()
+                except Exception:
+                    logger.exception("Could not refresh the Agribalyse snapshot, keeping the current one")
+
+        _refreshing = threading.Thread(target=run, name="agribalyse-snapshot-refresh", daemon=True)
+        _refreshing.start()
+    return _refreshing
+
+
+def stop_refreshing(timeout: Optional[float] = None) -> None:
+    """Stop the background refresh started by ``start_refreshing``."""
+    _stopping.set()
+    if _refreshing is not None:
+        _refreshing.join(timeout)
+
+
+def status() -> dict:
+    """Version, size and age of the current snapshot, and when the dataset version was last checked."""
+    snapshot = _current
+    info: Dict[str, Any] = {
+        "enabled": enabled(),
+        "installed": snapshot is not None,
+        "refresh_interval": refresh_interval(),
+        "checked_at": _checked_at,
+    }
+    if snapshot is not None:
+        info.update(
+            version=snapshot.metadata.get("version"),
+            dataset={field: snapshot.metadata.get(field) for field in VERSION_FIELDS},
+            rows=snapshot.n_rows,
+            loaded_at=snapshot.loaded_at,
+            age_seconds=round(time.time() - snapshot.loaded_at, 1),
+        )
+    return info
+
+
+def reference() -> Snapshot:
+    """
+    Return the current snapshot, for the precomputed tables (group summaries,
+    product index).
+
+    Without snapshot mode, the dataset is downloaded once (blocking) to build
+    them, without answering requests from it; the copy is kept until older
+    than AGRIBALYSE_SNAPSHOT_MAX_AGE seconds.
+    """
+    global _reference
+    snapshot = _current
+    if snapshot is not None:
+        return snapshot
+    with _reference_lock:
+        max_age = env_float("AGRIBALYSE_SNAPSHOT_MAX_AGE", 86400.0)
+        if _reference is None or time.time() - _reference.loaded_at > max_age:
+            _reference = Snapshot.from_rows(download_rows())
+        return _reference
+
+
+def group_summaries() -> GroupSummaries:
+    """Per-group statistics of the dataset (see ``reference``)."""
+    return reference().summaries
+
+
+def answer(
+    path: str, params: Optional[Mapping[str, Any]] = None, snapshot: Optional[Snapshot] = None
+) -> Optional[Union[dict, list]]:
+    """
+    Answer a request from the current snapshot, or return None if it has to go upstream.
+
+    Callers sending several requests for one result pass the ``snapshot`` they
+    started with, so that a refresh in between does not mix two versions.
+    """
+    snapshot = snapshot or _current
+    if snapshot is None:
+        return None
+    try:
+        return snapshot.answer(path, params)
+    except Unsupported:
+        return None
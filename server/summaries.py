@@ -0,0 +1,138 @@
+"""Impact statistics per food group and sub-group, computed once per dataset copy.
+
+"Average climate impact of dairy products" is the most common kind of
+question; answered through the API it takes a ``get_values`` call to find
+the groups and a ``get_metric_agg`` call per group. ``build`` instead
+computes, for every ``Groupe_d'aliment`` and ``Sous-groupe_d'aliment``,
+the count, mean, min, quartiles and max of every impact indicator in one
+pass over the columns of a snapshot (rows sorted by group once, then one
+vectorized reduction per group). Lookups are then dictionary accesses, by
+exact name or ignoring case and accents.
+"""
+import time
+import warnings
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from server.text_index import fold
+
+GROUP_FIELDS = ("Groupe_d'aliment", "Sous-groupe_d'aliment")
+
+INDICATORS = (
+    "DQR", "Score_unique_EF", "Changement_climatique",
+    "Appauvrissement_de_la_couche_d'ozone", "Rayonnements_ionisants",
+    "Formation_photochimique_d'ozone", "Particules_fines",
+    "Effets_toxicologiques_sur_la_santé_humaine___substances_non-cancérogènes",
+    "Effets_toxicologiques_sur_la_santé_humaine___substances_cancérogènes",
+    "Acidification_terrestre_et_eaux_douces", "Eutrophisation_eaux_douces",
+    "Eutrophisation_marine", "Eutrophisation_terrestre",
+    "Écotoxicité_pour_écosystèmes_aquatiques_d'eau_douce",
+    "Utilisation_du_sol", "Épuisement_des_ressources_eau",
+    "Épuisement_des_ressources_énergétiques", "Épuisement_des_ressources_minéraux",
+    "Changement_climatique_-_émissions_biogéniques",
+    "Changement_climatique_-_émissions_fossiles",
+    "Changement_climatique_-_émissions_liées_au_changement_d'affectation_des_sols",
+)
+
+
+def _number(value: float) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def _statistics(block: np.ndarray) -> List[Dict[str, Any]]:
+    """Statistics of each column of a 2-D block, NaN being missing values."""
+    counts = np.count_nonzero(~np.isnan(block), axis=0)
+    with warnings.catch_warnings():
+        # All-missing columns give NaN (reported as None) with a warning.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(block, axis=0)
+        low = np.nanmin(block, axis=0)
+        high = np.nanmax(block, axis=0)
+        quartiles = np.nanpercentile(block, [25, 50, 75], axis=0)
+    return [
+        {
+            "count": int(counts[i]),
+            "mean": _number(mean[i]),
+            "min": _number(low[i]),
+            "q1": _number(quartiles[0, i]),
+            "median": _number(quartiles[1, i]),
+            "q3": _number(quartiles[2, i]),
+            "max": _number(high[i]),
+        }
+        for i in range(block.shape[1])
+    ]
+
+
+class GroupSummaries:
+    """
+    Per-group statistics: ``groups[field][name]`` holds the number of "products",
+    the parent "group" of a sub-group, and the statistics of each indicator in "indicators".
+    """
+
+    def __init__(self, groups: Dict[str, Dict[str, dict]], indicators: Sequence[str], n_rows: int):
+        self.groups = groups
+        self.indicators = list(indicators)
+        self.n_rows = n_rows
+        self.built_at = time.time()
+        self._folded = {
+            field: {fold(name): name for name in names} for field, names in groups.items()
+        }
+
+    def names(self, field: str) -> List[str]:
+        return list(self.groups.get(field, {}))
+
+    def resolve(self, field: str, name: str) -> Optional[str]:
+        """Name of a group, matched exactly or ignoring case and accents."""
+        if name in self.groups.get(field, {}):
+            return name
+        return self._folded.get(field, {}).get(fold(name.strip()))
+
+    def get(self, field: str, name: str) -> Optional[dict]:
+        resolved = self.resolve(field, name)
+        return self.groups[field][resolved] if resolved is not None else None
+
+    def as_dict(self) -> dict:
+        return {"rows": self.n_rows, "built_at": self.built_at, "indicators": self.indicators, "groups": self.groups}
+
+
+def build(columns: Mapping[str, Any], n_rows: int) -> GroupSummaries:
+    """
+    Compute the summaries from snapshot columns (``server.snapshot``).
+
+    Group fields must be dictionary-encoded text columns (``codes``, ``dictionary``),
+    indicators numeric columns (``values``); the missing ones are skipped.
+    """
+    indicators = [name for name in INDICATORS if hasattr(columns.get(name), "values")]
+    if indicators:
+        matrix = np.column_stack([columns[name].values for name in indicators])
+    else:
+        matrix = np.empty((n_rows, 0))
+    parent = columns.get(GROUP_FIELDS[0])
+
+    groups: Dict[str, Dict[str, dict]] = {}
+    for field in GROUP_FIELDS:
+        column = columns.get(field)
+        if not hasattr(column, "codes"):
+            continue
+        # Sort the rows by group once; each group is then a contiguous slice.
+        order = np.argsort(column.codes, kind="stable")
+        codes = column.codes[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=int)
+        ends = np.r_[starts[1:], len(codes)]
+        summaries = {}
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            code = int(codes[start])
+            if code < 0:  # rows without a group
+                continue
+            rows = order[start:end]
+            summary = {"products": end - start}
+            if field != GROUP_FIELDS[0] and hasattr(parent, "codes"):
+                parents = parent.codes[rows]
+                parents = parents[parents >= 0]
+                if len(parents):
+                    summary["group"] = parent.dictionary[int(np.bincount(parents).argmax())]
+            summary["indicators"] = dict(zip(indicators, _statistics(matrix[rows])))
+            summaries[column.dictionary[code]] = summary
+        groups[field] = summaries
+    return GroupSummaries(groups, indicators, n_rows)
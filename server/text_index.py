@@ -0,0 +1,195 @@
+"""Inverted index answering ``q`` / ``q_fields`` text searches on the snapshot.
+
+Text is normalized the way data-fair's French analyzer roughly does:
+lowercasing, accent and ligature folding ("Bœuf" -> "boeuf"), elision and
+stopword removal and plural folding ("pommes" -> "pomme"). Indexes are built
+once per snapshot, over the distinct values of each dictionary-encoded text
+column, so a query resolves to a row mask with a few NumPy lookups.
+
+Supported ``q`` syntax (Elasticsearch simple_query_string, default operator
+AND): words, "quoted phrases", ``-`` negation and ``*`` prefix suffix. In
+``q_mode=complete`` the last word is also matched as a prefix. Anything else
+raises ``ValueError`` so the caller can send the query upstream.
+"""
+import math
+import re
+import unicodedata
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Text fields data-fair searches with ``q`` (and accepts in ``q_fields``).
+SEARCH_FIELDS = (
+    "Code_AGB", "Groupe_d'aliment", "Sous-groupe_d'aliment",
+    "Nom_du_Produit_en_Français", "LCI_Name", "code_saison",
+    "Livraison", "Approche_emballage_", "Préparation",
+)
+
+STOPWORDS = frozenset({
+    "a", "au", "aux", "c", "d", "de", "des", "du", "en", "et", "j", "l", "la", "le",
+    "les", "m", "n", "ou", "par", "pour", "qu", "s", "sur", "t", "un", "une",
+})
+
+LIGATURES = str.maketrans({"œ": "oe", "Œ": "oe", "æ": "ae", "Æ": "ae", "ß": "ss"})
+
+_WORD = re.compile(r"[0-9a-z]+")
+_QUERY_TERM = re.compile(r'(-?)"([^"]*)"|(\S+)')
+_UNSUPPORTED = re.compile(r"[|()~]")
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents and ligatures."""
+    decomposed = unicodedata.normalize("NFKD", text.translate(LIGATURES))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def _stem(token: str) -> str:
+    if len(token) > 3 and token[-1] in "sx" and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a text into normalized search tokens."""
+    return [_stem(t) for t in _WORD.findall(fold(text)) if t not in STOPWORDS]
+
+
+@dataclass
+class Term:
+    tokens: List[str]
+    prefix: bool = False
+    negated: bool = False
+
+
+def parse_query(q: str, mode: str = "simple") -> List[Term]:
+    """Parse a ``q`` string into terms that must all match (negated ones must not)."""
+    if _UNSUPPORTED.search(q):
+        raise ValueError(f"Unsupported query syntax: {q}")
+    terms = []
+    for match in _QUERY_TERM.finditer(q):
+        negated, phrase, word = match.groups()
+        if word is not None:
+            negated = word.startswith("-")
+            word = word.lstrip("+-")
+            prefix = word.endswith("*")
+            tokens = tokenize(word.rstrip("*"))
+        else:
+            prefix = False
+            tokens = tokenize(phrase)
+        if tokens:
+            terms.append(Term(tokens, prefix, bool(negated)))
+    if mode == "complete" and terms and not q.rstrip().endswith('"'):
+        terms[-1].prefix = True
+    if not any(not t.negated for t in terms):
+        raise ValueError(f"No searchable term in query: {q}")
+    return terms
+
+
+class FieldIndex:
+    """Postings from tokens to the dictionary codes of one text column."""
+
+    def __init__(self, codes: np.ndarray, dictionary: Sequence[str]):
+        self.codes = codes
+        self.tokens = [tokenize(value) for value in dictionary]
+        postings: Dict[str, List[int]] = {}
+        for code, tokens in enumerate(self.tokens):
+            for token in set(tokens):
+                postings.setdefault(token, []).append(code)
+        self.postings = {token: np.array(c, dtype=np.int32) for token, c in postings.items()}
+        self.vocabulary = sorted(self.postings)
+        # Shorter values rank higher, as with BM25 length normalization.
+        self.norms = np.array([1.0 / math.sqrt(max(len(t), 1)) for t in self.tokens] + [0.0])
+
+    def lookup(self, token: str, prefix: bool = False) -> np.ndarray:
+        """Codes of the values containing ``token`` (or a token starting with it)."""
+        if not prefix:
+            return self.postings.get(token, np.empty(0, dtype=np.int32))
+        start = bisect_left(self.vocabulary, token)
+        matches = []
+        for candidate in self.vocabulary[start:]:
+            if not candidate.startswith(token):
+                break
+            matches.append(self.postings[candidate])
+        return np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype=np.int32)
+
+    def match(self, term: Term) -> np.ndarray:
+        """Codes of the values matching every token of ``term``, consecutively if it is a phrase."""
+        last = len(term.tokens) - 1
+        codes = None
+        for i, token in enumerate(term.tokens):
+            found = self.lookup(token, term.prefix and i == last)
+            codes = found if codes is None else np.intersect1d(codes, found)
+        if len(term.tokens) > 1:
+            codes = np.array([c for c in codes if self._contains_sequence(c, term)], dtype=np.int32)
+        return codes
+
+    def _contains_sequence(self, code: int, term: Term) -> bool:
+        tokens = self.tokens[code]
+        n = len(term.tokens)
+        for start in range(len(tokens) - n + 1):
+            window = tokens[start:start + n]
+            if window[:-1] == term.tokens[:-1] and (
+                window[-1].startswith(term.tokens[-1]) if term.prefix else window[-1] == term.tokens[-1]
+            ):
+                return True
+        return False
+
+    def rows(self, codes: np.ndarray) -> np.ndarray:
+        """Boolean row mask of the given codes (the extra slot absorbs missing values, code -1)."""
+        table = np.zeros(len(self.tokens) + 1, dtype=bool)
+        table[codes] = True
+        return table[self.codes]
+
+
+class TextIndex:
+    """Per-field inverted indexes over the searchable text columns of a snapshot."""
+
+    def __init__(self, fields: Dict[str, FieldIndex], n_rows: int):
+        self.fields = fields
+        self.n_rows = n_rows
+
+    def search(
+        self,
+        q: str,
+        fields: Optional[Sequence[str]] = None,
+        mode: str = "simple"
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluate a ``q`` query.
+
+        Arguments:
+        - q: Query string.
+        - fields: Fields to search (``q_fields``); all indexed fields if omitted.
+        - mode: "simple" or "complete" (last word matched as a prefix).
+
+        Returns:
+        - A boolean mask of the matching rows and a relevance score per row.
+        """
+        names = list(fields) if fields else list(self.fields)
+        for name in names:
+            if name not in self.fields:
+                raise ValueError(f"Field not searchable locally: {name}")
+        mask = np.ones(self.n_rows, dtype=bool)
+        score = np.zeros(self.n_rows)
+        for term in parse_query(q, mode):
+            term_mask = np.zeros(self.n_rows, dtype=bool)
+            term_score = np.zeros(self.n_rows)
+            for name in names:
+                index = self.fields[name]
+                codes = index.match(term)
+                if not len(codes):
+                    continue
+                rows = index.rows(codes)
+                term_mask |= rows
+                weights = np.zeros(len(index.norms))
+                weights[codes] = index.norms[codes]
+                term_score += weights[index.codes]
+            if term.negated:
+                mask &= ~term_mask
+            else:
+                mask &= term_mask
+                df = int(np.count_nonzero(term_mask))
+                score += term_score * math.log(1 + (self.n_rows - df + 0.5) / (df + 0.5))
+        return mask, np.where(mask, score, 0.0)
@@ -0,0 +1,465 @@
+"""Shared access to the data-fair API serving the Agribalyse dataset.
+
+All tools and resources go through this module instead of calling
+``requests.get`` themselves, so they share one pooled HTTP client and reuse
+keep-alive connections to data.ademe.fr rather than paying a TCP+TLS
+handshake on every call. ``get_json`` is the blocking entry point and
+``aget_json`` its asyncio counterpart used by the MCP tool handlers, so that
+a slow upstream call does not hold the event loop. Successful responses are
+kept in ``response_cache`` (see ``server.cache``); expired ones carrying an
+ETag or Last-Modified header are revalidated with a conditional request,
+and a 304 answer reuses the stored body. Identical requests issued while one
+is already in flight wait for it instead of being sent again (see
+``server.coalesce``). Failed requests are retried, a circuit breaker stops
+calling data.ademe.fr while it is down (stale cached responses are served
+meanwhile) and the number of concurrent requests adapts to its health (see
+``server.resilience``).
+
+The client is configured from environment variables:
+
+- AGRIBALYSE_BASE_URL: dataset endpoint (default: the ADEME agribalyse-31-synthese dataset).
+- AGRIBALYSE_HTTP_MAX_CONNECTIONS: maximum number of open connections in the pool (default: 20).
+- AGRIBALYSE_HTTP_MAX_KEEPALIVE: maximum number of idle keep-alive connections (default: 10).
+- AGRIBALYSE_HTTP_KEEPALIVE_EXPIRY: seconds an idle connection is kept open (default: 30).
+- AGRIBALYSE_HTTP2: set to 1 to negotiate HTTP/2 (requires ``httpx[http2]``).
+- AGRIBALYSE_HTTP_CONNECT_TIMEOUT: connect timeout in seconds (default: 5).
+- AGRIBALYSE_HTTP_READ_TIMEOUT: read timeout in seconds (default: 30).
+- AGRIBALYSE_RETRY_ATTEMPTS: attempts per request, retries included (default: 3).
+- AGRIBALYSE_RETRY_BASE_DELAY: backoff of the first retry in seconds, doubled at each retry (default: 0.2).
+- AGRIBALYSE_RETRY_MAX_DELAY: maximum backoff or Retry-After delay in seconds (default: 5).
+- AGRIBALYSE_BREAKER_THRESHOLD: consecutive failures opening the circuit breaker (default: 5).
+- AGRIBALYSE_BREAKER_RESET: seconds before a call is tried again once the circuit is open (default: 30).
+- AGRIBALYSE_CACHE: set to 0 to disable the response cache.
+- AGRIBALYSE_CACHE_MAX_ENTRIES: maximum number of cached responses (default: 1024).
+- AGRIBALYSE_CACHE_MAX_BYTES: maximum total size of cached responses (default: 64 MiB).
+- AGRIBALYSE_CACHE_PATH: SQLite file persisting the cache across restarts (default: memory only).
+- AGRIBALYSE_CACHE_DISK_MAX_BYTES: maximum total size of the persisted responses (default: 512 MiB).
+- AGRIBALYSE_CASSETTE: cassette file to record the upstream exchanges to, or replay them from (see ``server.cassette``).
+- AGRIBALYSE_CASSETTE_MODE: ``replay`` (default, no network access) or ``record``.
+- AGRIBALYSE_CASSETTE_LATENCY: set to 1 to replay responses with their recorded latency.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Optional, Union
+from urllib.parse import urlsplit
+
+import httpx
+
+from server.cache import ResponseCache, endpoint_of, make_key
+from server.cassette import AsyncCassetteTransport, Cassette, CassetteTransport
+from server.coalesce import SingleFlight
+from server.disk_cache import DiskCache
+from server.config import env_bool, env_float, env_int, env_str
+from server.metrics import registry, timed
+from server.resilience import AdaptiveLimiter, CircuitBreaker, RetryPolicy, is_overload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://data.ademe.fr/data-fair/api/v1/datasets/agribalyse-31-synthese"
+
+BASE_URL = env_str("AGRIBALYSE_BASE_URL", DEFAULT_BASE_URL)
+
+@dataclass(frozen=True)
+class UpstreamSettings:
+    """Connection settings of the shared HTTP client."""
+
+    base_url: str = BASE_URL
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    retry_attempts: int = 3
+    retry_base_delay: float = 0.2
+    retry_max_delay: float = 5.0
+    breaker_threshold: int = 5
+    breaker_reset: float = 30.0
+    cassette: Optional[str] = None
+    cassette_mode: str = "replay"
+    cassette_latency: bool = False
+
+    @classmethod
+    def from_env(cls) -> "UpstreamSettings":
+        """Build the settings from the AGRIBALYSE_* environment variables."""
+        return cls(
+            base_url=env_str("AGRIBALYSE_BASE_URL", BASE_URL),
+            max_connections=env_int("AGRIBALYSE_HTTP_MAX_CONNECTIONS", cls.max_connections),
+            max_keepalive_connections=env_int("AGRIBALYSE_HTTP_MAX_KEEPALIVE", cls.max_keepalive_connections),
+            keepalive_expiry=env_float("AGRIBALYSE_HTTP_KEEPALIVE_EXPIRY", cls.keepalive_expiry),
+            http2=env_bool("AGRIBALYSE_HTTP2", cls.http2),
+            connect_timeout=env_float("AGRIBALYSE_HTTP_CONNECT_TIMEOUT", cls.connect_timeout),
+            read_timeout=env_float("AGRIBALYSE_HTTP_READ_TIMEOUT", cls.read_timeout),
+            retry_attempts=env_int("AGRIBALYSE_RETRY_ATTEMPTS", cls.retry_attempts),
+            retry_base_delay=env_float("AGRIBALYSE_RETRY_BASE_DELAY", cls.retry_base_delay),
+            retry_max_delay=env_float("AGRIBALYSE_RETRY_MAX_DELAY", cls.retry_max_delay),
+            breaker_threshold=env_int("AGRIBALYSE_BREAKER_THRESHOLD", cls.breaker_threshold),
+            breaker_reset=env_float("AGRIBALYSE_BREAKER_RESET", cls.breaker_reset),
+            cassette=env_str("AGRIBALYSE_CASSETTE", cls.cassette),
+            cassette_mode=env_str("AGRIBALYSE_CASSETTE_MODE", cls.cassette_mode),
+            cassette_latency=env_bool("AGRIBALYSE_CASSETTE_LATENCY", cls.cassette_latency),
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def retry_policy(self) -> RetryPolicy:
+        return RetryPolicy(self.retry_attempts, self.retry_base_delay, self.retry_max_delay)
+
+
+_settings = UpstreamSettings.from_env()
+_transport: Optional[Union[httpx.BaseTransport, httpx.AsyncBaseTransport]] = None
+_client: Optional[httpx.Client] = None
+# httpx async connections are bound to the event loop that opened them, so
+# there is one async client per running loop.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+_cassette: Optional[Cassette] = None
+
+response_cache = ResponseCache(
+    max_entries=env_int("AGRIBALYSE_CACHE_MAX_ENTRIES", 1024),
+    max_bytes=env_int("AGRIBALYSE_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+    enabled=env_bool("AGRIBALYSE_CACHE", True),
+    store=DiskCache.from_env(namespace=_settings.base_url),
+)
+
+in_flight = SingleFlight()
+
+breaker = CircuitBreaker(_settings.breaker_threshold, _settings.breaker_reset)
+limiter = AdaptiveLimiter(_settings.max_connections)
+
+
+def settings() -> UpstreamSettings:
+    """Return the settings currently used by the shared client."""
+    return _settings
+
+
+def configure(
+    transport: Optional[Union[httpx.BaseTransport, httpx.AsyncBaseTransport]] = None,
+    **overrides: Any
+) -> UpstreamSettings:
+    """
+    Change the settings of the shared clients.
+
+    The current clients are dropped, the response cache is emptied and the
+    circuit breaker and concurrency limiter are reset; the next request opens
+    new clients with the updated settings.
+
+    Arguments:
+    - transport: Optional httpx transport to send requests through (e.g. ``httpx.MockTransport`` in tests).
+      It is used by the blocking client, the async client, or both, depending on what it implements.
+    - overrides: Any field of ``UpstreamSettings`` (base_url, max_connections, http2, cassette, ...).
+      A cassette is only used when no ``transport`` is given.
+
+    Returns:
+    - The new settings.
+    """
+    global _settings, _transport, breaker, limiter
+    close()
+    response_cache.invalidate()
+    with _lock:
+        _settings = replace(_settings, **overrides)
+        _transport = transport
+        breaker = CircuitBreaker(_settings.breaker_threshold, _settings.breaker_reset)
+        limiter = AdaptiveLimiter(_settings.max_connections)
+    return _settings
+
+
+def cassette() -> Optional[Cassette]:
+    """Return the cassette the requests are recorded to or replayed from, if one is configured."""
+    global _cassette
+    if _settings.cassette is None:
+        return None
+    with _lock:
+        current = _cassette
+        wanted = (_settings.cassette, _settings.cassette_mode, _settings.cassette_latency)
+        # Opening a cassette to record truncates it: keep the same one across clients.
+        if current is None or (current.path, current.mode, current.latency) != wanted:
+            current = _cassette = Cassette(*wanted)
+    return current
+
+
+def get_client() -> httpx.Client:
+    """Return the shared HTTP client, creating it on first use."""
+    global _client
+    if _client is None:
+        recorder = cassette() if _transport is None else None
+        with _lock:
+            if _client is None:
+                transport = _transport if isinstance(_transport, httpx.BaseTransport) else None
+                if recorder is not None:
+                    inner = None
+                    if recorder.mode == "record":
+                        inner = httpx.HTTPTransport(limits=_settings.limits(), http2=_settings.http2)
+                    transport = CassetteTransport(recorder, inner)
+                _client = httpx.Client(
+                    base_url=_settings.base_url,
+                    limits=_settings.limits(),
+                    timeout=_settings.timeout(),
+                    http2=_settings.http2,
+                    transport=transport,
+                )
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the async HTTP client of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        transport = _transport if isinstance(_transport, httpx.AsyncBaseTransport) else None
+        recorder = cassette() if _transport is None else None
+        if recorder is not None:
+            inner = None
+            if recorder.mode == "record":
+                inner = httpx.AsyncHTTPTransport(limits=_settings.limits(), http2=_settings.http2)
+            transport = AsyncCassetteTransport(recorder, inner)
+        client = httpx.AsyncClient(
+            base_url=_settings.base_url,
+            limits=_settings.limits(),
+            timeout=_settings.timeout(),
+            http2=_settings.http2,
+            transport=transport,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def close() -> None:
+    """Close the shared blocking client and forget the async ones."""
+    global _client
+    with _lock:
+        client, _client = _client, None
+        _async_clients.clear()
+    if client is not None:
+        client.close()
+
+
+async def aclose() -> None:
+    """Close the async client of the running event loop."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _body(path: str, params: Optional[Dict[str, Any]], response: httpx.Response, use_cache: bool) -> Union[bytes, dict]:
+    """Return the body of a successful response (cached if requested), or an error dictionary."""
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        return {"error": str(e), "status_code": response.status_code}
+    if use_cache:
+        response_cache.put(
+            path, params, response.content,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+    return response.content
+
+
+def _decode(outcome: Union[bytes, dict]) -> Union[dict, list]:
+    # Coalesced callers share the outcome: each one decodes its own copy.
+    if not isinstance(outcome, bytes):
+        return dict(outcome)
+    start = time.perf_counter()
+    with timed("decode"):
+        result = json.loads(outcome)
+    registry.observe("agribalyse_json_decode_seconds", time.perf_counter() - start)
+    return result
+
+
+def _endpoint(path: str) -> str:
+    """Metrics label of a request path, ``next`` links included."""
+    if "://" in path:
+        base_path = urlsplit(_settings.base_url).path.rstrip("/")
+        path = urlsplit(path).path.removeprefix(base_path)
+    return endpoint_of(path)
+
+
+def _record_attempt(path: str, response: Optional[httpx.Response], elapsed: float, attempt: int) -> None:
+    endpoint = _endpoint(path)
+    registry.observe("agribalyse_upstream_request_seconds", elapsed, endpoint=endpoint)
+    status = str(response.status_code) if response is not None else "error"
+    registry.inc("agribalyse_upstream_responses_total", endpoint=endpoint, status=status)
+    if response is not None:
+        registry.inc("agribalyse_upstream_response_bytes_total", len(response.content), endpoint=endpoint)
+    if attempt:
+        registry.inc("agribalyse_upstream_retries_total", endpoint=endpoint)
+    limiter.record(is_overload(response))
+    breaker.record(not is_overload(response))
+
+
+def _stale(path: str, params: Optional[Dict[str, Any]], use_cache: bool, reason: str) -> Optional[bytes]:
+    """Cached body (possibly expired) to answer with when upstream cannot, if any."""
+    body = response_cache.stale(path, params) if use_cache else None
+    if body is not None:
+        logger.warning("Serving a stale response for %s: %s", path, reason)
+    return body
+
+
+def _unavailable(path: str, params: Optional[Dict[str, Any]], use_cache: bool, reason: str) -> Union[bytes, dict]:
+    return _stale(path, params, use_cache, reason) or {
+        "error": f"The Agribalyse API is unavailable: {reason}", "status_code": 503
+    }
+
+
+def _send(client: httpx.Client, path: str, params: Optional[Dict[str, Any]], headers: Dict[str, str]) -> httpx.Response:
+    """Send a GET request, retrying failed attempts; raises the transport error of the last one."""
+    policy = _settings.retry_policy()
+    attempt = 0
+    while True:
+        response, error = None, None
+        limiter.acquire()
+        start = time.perf_counter()
+        try:
+            with timed("upstream"):
+                response = client.get(path, params=params, headers=headers)
+        except httpx.TransportError as e:
+            error = e
+        finally:
+            limiter.release()
+        _record_attempt(path, response, time.perf_counter() - start, attempt)
+        delay = policy.backoff(attempt, response)
+        if delay is None or not breaker.allow():
+            if error is not None:
+                raise error
+            return response
+        time.sleep(delay)
+        attempt += 1
+
+
+async def _asend(client: httpx.AsyncClient, path: str, params: Optional[Dict[str, Any]], headers: Dict[str, str]) -> httpx.Response:
+    """Async version of ``_send``."""
+    policy = _settings.retry_policy()
+    attempt = 0
+    while True:
+        response, error = None, None
+        await limiter.aacquire()
+        start = time.perf_counter()
+        try:
+            with timed("upstream"):
+                response = await client.get(path, params=params, headers=headers)
+        except httpx.TransportError as e:
+            error = e
+        finally:
+            limiter.release()
+        _record_attempt(path, response, time.perf_counter() - start, attempt)
+        delay = policy.backoff(attempt, response)
+        if delay is None or not breaker.allow():
+            if error is not None:
+                raise error
+            return response
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def _fetch(path: str, params: Optional[Dict[str, Any]], use_cache: bool) -> Union[bytes, dict]:
+    if not breaker.allow():
+        return _unavailable(path, params, use_cache, "circuit breaker open")
+    client = get_client()
+    headers = response_cache.validators(path, params) if use_cache else {}
+    try:
+        response = _send(client, path, params, headers)
+        if response.status_code == 304:
+            body = response_cache.revalidated(path, params, len(response.content))
+            if body is not None:
+                return body
+            response = _send(client, path, params, {})
+    except httpx.TransportError as e:
+        return _unavailable(path, params, use_cache, repr(e))
+    if is_overload(response):
+        return _stale(path, params, use_cache, f"HTTP {response.status_code}") or _body(path, params, response, use_cache)
+    return _body(path, params, response, use_cache)
+
+
+async def _afetch(path: str, params: Optional[Dict[str, Any]], use_cache: bool) -> Union[bytes, dict]:
+    # The stale answers may be read from the disk cache: in a worker thread, off the event loop.
+    if not breaker.allow():
+        return await asyncio.to_thread(_unavailable, path, params, use_cache, "circuit breaker open")
+    client = get_async_client()
+    headers = response_cache.validators(path, params) if use_cache else {}
+    try:
+        response = await _asend(client, path, params, headers)
+        if response.status_code == 304:
+            body = response_cache.revalidated(path, params, len(response.content))
+            if body is not None:
+                return body
+            response = await _asend(client, path, params, {})
+    except httpx.TransportError as e:
+        return await asyncio.to_thread(_unavailable, path, params, use_cache, repr(e))
+    if is_overload(response):
+        stale = await asyncio.to_thread(_stale, path, params, use_cache, f"HTTP {response.status_code}")
+        return stale or _body(path, params, response, use_cache)
+    return _body(path, params, response, use_cache)
+
+
+def get_json(path: str, params: Optional[Dict[str, Any]] = None, use_cache: bool = True) -> Union[dict, list]:
+    """
+    Send a GET request to the dataset API and decode the JSON response.
+
+    Arguments:
+    - path: Endpoint path relative to the dataset URL (e.g. "/lines").
+    - params: Query string parameters.
+    - use_cache: Set to False to bypass the response cache (neither read nor written).
+
+    Returns:
+    - The decoded JSON body, or a dictionary with "error" and "status_code" keys
+      if the API answered with an HTTP error.
+    """
+    if use_cache:
+        body = response_cache.get(path, params)
+        if body is not None:
+            return _decode(body)
+    key = (use_cache,) + make_key(path, params)
+    return _decode(in_flight.do(key, lambda: _fetch(path, params, use_cache)))
+
+
+async def aget_json(path: str, params: Optional[Dict[str, Any]] = None, use_cache: bool = True) -> Union[dict, list]:
+    """Async version of ``get_json``, sent through the event loop's ``httpx.AsyncClient``."""
+    if use_cache:
+        body = await response_cache.aget(path, params)
+        if body is not None:
+            return _decode(body)
+    key = (use_cache,) + make_key(path, params)
+    return _decode(await in_flight.ado(key, lambda: _afetch(path, params, use_cache)))
+
+
+def _collect() -> dict:
+    """Gauges read from the cache, the coalescing registry, the limiter and the circuit breaker."""
+    values = {}
+    for name, value in response_cache.stats().items():
+        values[f"agribalyse_cache_{name}"] = {(): value}
+    if response_cache.store is not None:
+        for name, value in response_cache.store.stats().items():
+            values[f"agribalyse_disk_cache_{name}"] = {(): value}
+    for name, value in in_flight.stats().items():
+        values[f"agribalyse_coalesce_{name}"] = {(): value}
+    if _cassette is not None:
+        for name, value in _cassette.stats().items():
+            values[f"agribalyse_cassette_{name}"] = {(): value}
+    for name, value in limiter.stats().items():
+        values[f"agribalyse_upstream_concurrency_{name}"] = {(): value}
+    breaker_stats = breaker.stats()
+    values["agribalyse_breaker_open"] = {(): int(breaker_stats["state"] != "closed")}
+    values["agribalyse_breaker_rejected"] = {(): breaker_stats["rejected"]}
+    return values
+
+
+registry.register(_collect)
+registry.describe("agribalyse_upstream_request_seconds", "Duration of the HTTP requests sent to data.ademe.fr, retries included.")
+registry.describe("agribalyse_upstream_responses_total", "Upstream responses by endpoint and status code (error: transport error).")
+registry.describe("agribalyse_upstream_response_bytes_total", "Bytes received from data.ademe.fr.")
+registry.describe("agribalyse_upstream_retries_total", "Upstream requests sent again after a failed attempt.")
+registry.describe("agribalyse_json_decode_seconds", "Time spent decoding upstream JSON bodies.")
@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+import pytest
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--standin",
+        action="store_true",
+        help="Send the API requests of the tests to a local data-fair stand-in instead of data.ademe.fr.",
+    )
+    parser.addoption(
+        "--record-cassette",
+        metavar="PATH",
+        help="Record the API requests of the tests and their responses to a cassette file.",
+    )
+    parser.addoption(
+        "--replay-cassette",
+        metavar="PATH",
+        help="Answer the API requests of the tests from a recorded cassette, without network access.",
+    )
+
+
+@pytest.fixture(scope="session")
+def sample_rows():
+    """A small sample of agribalyse-31-synthese rows, as returned by data-fair /lines."""
+    with open(FIXTURES / "agribalyse_sample.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def standin_api(request):
+    """
+    With --standin, point the shared client at a local stand-in serving the
+    sample rows; with --record-cassette / --replay-cassette, record or
+    replay its requests.
+    """
+    from contextlib import ExitStack
+
+    from server import upstream
+
+    overrides = {}
+    record, replay = request.config.getoption("--record-cassette"), request.config.getoption("--replay-cassette")
+    if record or replay:
+        overrides.update(cassette=record or replay, cassette_mode="record" if record else "replay")
+    with ExitStack() as stack:
+        if request.config.getoption("--standin"):
+            from bench.standin import DATASET_PATH, create_app, serve
+
+            overrides["base_url"] = stack.enter_context(serve(create_app())) + DATASET_PATH
+        if not overrides:
+            yield None
+            return
+        previous = upstream.settings()
+        upstream.configure(**overrides)
+        yield upstream.settings().base_url
+        upstream.configure(**previous.__dict__)
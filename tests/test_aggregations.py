@@ -0,0 +1,86 @@
+import statistics
+
+import numpy as np
+import pytest
+
+from server import snapshot
+from server.aggregations import summarize
+from server.server import get_metric_agg, get_simple_metrics_agg
+from server.snapshot import Snapshot, Unsupported
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+def column(rows, field):
+    return [row[field] for row in rows if field in row]
+
+
+# -------------------------------
+# summarize()
+# -------------------------------
+
+def test_summarize_several_fields_at_once():
+    values = np.array([[1.0, 10.0], [2.0, np.nan], [2.0, 30.0], [5.0, 40.0]])
+    first, second = summarize(values, ["min", "max", "avg", "sum", "value_count", "cardinality"])
+    assert first == {"min": 1.0, "max": 5.0, "avg": 2.5, "sum": 10.0, "value_count": 4, "cardinality": 3}
+    assert second["value_count"] == 3
+    assert second["avg"] == pytest.approx(80 / 3)
+
+
+def test_summarize_empty_selection():
+    result = summarize(np.empty((0, 1)), ["avg", "sum", "stats", "percentiles"], [50])[0]
+    assert result["avg"] is None
+    assert result["sum"] == 0
+    assert result["stats"]["count"] == 0
+    assert result["percentiles"] == [{"key": 50.0, "value": None}]
+
+
+def test_percentiles_interpolate_between_values():
+    result = summarize(np.array([1.0, 2.0, 3.0, 4.0]), ["percentiles"], [50, 100])[0]
+    assert result["percentiles"] == [{"key": 50.0, "value": 2.5}, {"key": 100.0, "value": 4.0}]
+
+
+# -------------------------------
+# tools in snapshot mode
+# -------------------------------
+
+def test_get_metric_agg_avg(local, sample_rows):
+    result = get_metric_agg(metric="avg", field="Score_unique_EF")
+    assert result["total"] == len(sample_rows)
+    assert result["metric"] == pytest.approx(statistics.mean(column(sample_rows, "Score_unique_EF")))
+
+
+def test_get_metric_agg_skips_missing_values(local, sample_rows):
+    result = get_metric_agg(metric="stats", field="DQR")
+    dqr = column(sample_rows, "DQR")
+    assert result["metric"]["count"] == len(dqr) == len(sample_rows) - 1
+    assert result["metric"]["max"] == max(dqr)
+
+
+def test_get_metric_agg_percentiles(local):
+    result = get_metric_agg(metric="percentiles", field="Score_unique_EF", percents="25,50,75")
+    assert isinstance(result["metric"], list)
+    assert [p["key"] for p in result["metric"]] == [25.0, 50.0, 75.0]
+    values = [p["value"] for p in result["metric"]]
+    assert values == sorted(values)
+
+
+def test_get_metric_agg_cardinality_on_text_field(local, sample_rows):
+    result = get_metric_agg(metric="cardinality", field="Groupe_d'aliment")
+    assert result["metric"] == len(set(column(sample_rows, "Groupe_d'aliment")))
+    with pytest.raises(Unsupported):
+        local.answer("/metric_agg", {"metric": "avg", "field": "Groupe_d'aliment"})
+
+
+def test_get_simple_metrics_agg(local, sample_rows):
+    result = get_simple_metrics_agg(metrics=["min", "max", "stats"], fields=["Score_unique_EF", "Changement_climatique"])
+    assert set(result["metrics"]) == {"Score_unique_EF", "Changement_climatique"}
+    climate = result["metrics"]["Changement_climatique"]
+    assert climate["min"] == min(column(sample_rows, "Changement_climatique"))
+    assert climate["stats"]["sum"] == pytest.approx(sum(column(sample_rows, "Changement_climatique")))
@@ -0,0 +1,61 @@
+import asyncio
+import inspect
+import json
+import time
+
+import httpx
+import pytest
+
+from server import upstream
+from server.server import mcp, read_lines
+
+LATENCY = 0.2
+
+
+@pytest.fixture
+def slow_api():
+    """Async transport answering every request after a fixed delay."""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(LATENCY)
+        return httpx.Response(200, json={"total": 1, "results": [{"path": request.url.path}]})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield
+    upstream.configure(**previous.__dict__)
+
+
+def test_all_tools_are_registered_async():
+    tools = mcp._tool_manager.list_tools()
+    assert tools
+    assert all(tool.is_async for tool in tools)
+
+
+def test_tools_are_declared_as_returning_text():
+    # Results are sent as JSON text: FastMCP must not validate them as dicts.
+    for tool in mcp._tool_manager.list_tools():
+        assert inspect.signature(tool.fn).return_annotation is str
+    assert inspect.signature(read_lines.aio).return_annotation is dict
+
+
+def test_aio_variant_is_exposed(slow_api):
+    result = asyncio.run(read_lines.aio(size=1))
+    assert result["results"][0]["path"].endswith("/lines")
+
+
+def test_concurrent_tool_calls_overlap(slow_api):
+    calls = 10
+
+    async def run():
+        await mcp.call_tool("read_lines", {"size": 1})  # warm up the client
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            mcp.call_tool("read_lines", {"page": page, "size": 1}) for page in range(1, calls + 1)
+        ))
+        return time.perf_counter() - start, results
+
+    elapsed, results = asyncio.run(run())
+    assert len(results) == calls
+    assert all("results" in json.loads(content[0].text) for content in results)
+    # Sequential calls would take calls * LATENCY.
+    assert elapsed < 3 * LATENCY
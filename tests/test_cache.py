@@ -0,0 +1,143 @@
+import httpx
+import pytest
+
+from server import upstream
+from server.cache import ResponseCache, make_key
+from server.server import get_values, read_lines, read_schema
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def api():
+    requests_seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests_seen.append(request)
+        return httpx.Response(200, json={"total": 0, "results": []})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield requests_seen
+    upstream.configure(**previous.__dict__)
+
+
+# -------------------------------
+# ResponseCache
+# -------------------------------
+
+def test_key_ignores_order_of_unordered_lists():
+    assert make_key("/lines", {"select": "a,b", "page": 1}) == make_key("/lines", {"page": "1", "select": "b,a"})
+    assert make_key("/lines", {"sort": "a,b"}) != make_key("/lines", {"sort": "b,a"})
+
+
+def test_entries_expire_with_endpoint_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(ttls={"/lines": 10, "/schema": 1000}, clock=clock)
+    cache.put("/lines", {"page": 1}, b"{}")
+    cache.put("/schema", None, b"[]")
+    clock.now = 11
+    assert cache.get("/lines", {"page": 1}) is None
+    assert cache.get("/schema") == b"[]"
+
+
+def test_lru_eviction_by_count_and_bytes():
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    cache.put("/lines", {"page": 1}, b"1111")
+    cache.put("/lines", {"page": 2}, b"2222")
+    cache.get("/lines", {"page": 1})
+    cache.put("/lines", {"page": 3}, b"3333")
+    assert cache.get("/lines", {"page": 2}) is None
+    assert cache.get("/lines", {"page": 1}) == b"1111"
+    cache.put("/lines", {"page": 4}, b"44444444")
+    assert cache.stats()["bytes"] <= 10
+    assert cache.get("/lines", {"page": 4}) == b"44444444"
+
+
+def test_invalidate_by_prefix():
+    cache = ResponseCache()
+    cache.put("/values/Code_AGB", None, b"[]")
+    cache.put("/schema", None, b"[]")
+    assert cache.invalidate("/values") == 1
+    assert len(cache) == 1
+
+
+# -------------------------------
+# tools
+# -------------------------------
+
+def test_repeated_tool_calls_hit_cache(api):
+    get_values(field="Groupe_d'aliment")
+    get_values(field="Groupe_d'aliment")
+    read_lines(select=["DQR", "Code_AGB"])
+    read_lines(select=["Code_AGB", "DQR"])
+    read_schema()
+    read_schema()
+    assert len(api) == 3
+
+
+def test_bypass_cache(api):
+    upstream.get_json("/schema", use_cache=False)
+    upstream.get_json("/schema", use_cache=False)
+    assert len(api) == 2
+
+
+# -------------------------------
+# revalidation
+# -------------------------------
+
+@pytest.fixture
+def etag_api(monkeypatch):
+    """Upstream answering 304 when the client already holds the current ETag."""
+    clock = FakeClock()
+    monkeypatch.setattr(upstream.response_cache, "_clock", clock)
+    requests_seen = []
+    body = {"title": "Agribalyse", "schema": [{"key": "Code_AGB"}] * 50}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests_seen.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(200, json=body, headers={"ETag": '"v1"', "Last-Modified": "Mon, 02 Jun 2025 08:00:00 GMT"})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield clock, requests_seen
+    upstream.configure(**previous.__dict__)
+
+
+def test_expired_entry_is_kept_when_revalidable():
+    clock = FakeClock()
+    cache = ResponseCache(ttls={"/schema": 10}, clock=clock)
+    cache.put("/schema", None, b"{}", etag='"abc"')
+    cache.put("/lines", None, b"{}")
+    clock.now = 1000
+    assert cache.get("/schema") is None
+    assert cache.get("/lines") is None
+    assert cache.validators("/schema") == {"If-None-Match": '"abc"'}
+    assert cache.validators("/lines") == {}
+    assert cache.revalidated("/schema") == b"{}"
+    assert cache.get("/schema") == b"{}"
+
+
+def test_not_modified_reuses_stored_body(etag_api):
+    clock, requests_seen = etag_api
+    first = read_schema()
+    clock.now += 25 * 3600
+    second = read_schema()
+    assert second == first
+    assert len(requests_seen) == 2
+    assert requests_seen[1].headers["If-None-Match"] == '"v1"'
+    assert requests_seen[1].headers["If-Modified-Since"] == "Mon, 02 Jun 2025 08:00:00 GMT"
+    stats = upstream.response_cache.stats()
+    assert stats["revalidations"] == 1
+    assert stats["bytes_saved"] > 500
+    # Fresh again after the 304.
+    read_schema()
+    assert len(requests_seen) == 2
@@ -0,0 +1,101 @@
+import asyncio
+import gzip
+import json
+import time
+
+import httpx
+import pytest
+
+from server import upstream
+from server.cassette import AsyncCassetteTransport, Cassette, CassetteTransport
+
+
+def dataset_api(request: httpx.Request) -> httpx.Response:
+    page = int(request.url.params.get("page", 1))
+    body = json.dumps({"total": 2, "results": [{"page": page, "name": "Pâtes"}]}).encode()
+    return httpx.Response(200, content=gzip.compress(body), headers={"Content-Encoding": "gzip", "ETag": f'"{page}"'})
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    """A cassette of three requests recorded through the blocking and async transports."""
+    path = str(tmp_path / "cassette.jsonl")
+    cassette = Cassette(path, mode="record")
+    with httpx.Client(transport=CassetteTransport(cassette, httpx.MockTransport(dataset_api))) as client:
+        assert client.get("https://example.org/ds/lines", params={"page": 1, "size": 2}).json()["results"][0]["page"] == 1
+        client.get("https://example.org/ds/lines", params={"page": 2, "size": 2})
+
+    async def record_async():
+        transport = AsyncCassetteTransport(cassette, httpx.MockTransport(dataset_api))
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.get("https://example.org/ds/lines", params={"page": 1, "size": 2})
+
+    assert asyncio.run(record_async()).headers["ETag"] == '"1"'
+    assert cassette.stats()["recorded"] == 3
+    return path
+
+
+@pytest.fixture
+def api(recorded):
+    previous = upstream.settings()
+    upstream.configure(base_url="https://example.org/ds", cassette=recorded, cassette_mode="replay")
+    yield upstream.cassette()
+    upstream.configure(**previous.__dict__)
+
+
+# ---------------------------
+# ---- cassette ----
+# ---------------------------
+
+def test_bodies_are_stored_decoded(recorded):
+    entry = next(Cassette(recorded).entries())
+    assert json.loads(entry["body"])["results"][0]["name"] == "Pâtes"
+    assert "content-encoding" not in {k.lower() for k, _ in entry["headers"]}
+
+
+def test_replay_matches_query_in_any_order_and_repeats_the_last_response(recorded):
+    cassette = Cassette(recorded)
+    transport = CassetteTransport(cassette)
+    with httpx.Client(transport=transport) as client:
+        first = client.get("https://other.host/ds/lines?size=2&page=1")
+        again = client.get("https://other.host/ds/lines?page=1&size=2")
+        last = client.get("https://other.host/ds/lines?page=1&size=2")
+        conditional = client.get("https://other.host/ds/lines?page=2&size=2", headers={"If-None-Match": '"2"'})
+        missing = client.get("https://other.host/ds/values/Code_AGB")
+    assert [r.json()["results"][0]["page"] for r in (first, again, last, conditional)] == [1, 1, 1, 2]
+    assert missing.status_code == 404
+    assert cassette.stats() == {"recorded": 0, "replayed": 4, "misses": 1}
+
+
+def test_replay_with_recorded_latency(recorded):
+    lines = [json.loads(line) for line in open(recorded, encoding="utf-8")]
+    lines[1]["elapsed"] = 0.05
+    with open(recorded, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(line) + "\n" for line in lines)
+    transport = CassetteTransport(Cassette(recorded, latency=True))
+    with httpx.Client(transport=transport) as client:
+        start = time.perf_counter()
+        client.get("https://example.org/ds/lines?page=2&size=2")
+        assert time.perf_counter() - start >= 0.05
+
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "c.jsonl"), mode="rewrite")
+
+
+# ---------------------------
+# ---- upstream settings ----
+# ---------------------------
+
+def test_upstream_replays_the_cassette(api):
+    assert upstream.get_json("/lines", {"page": 2, "size": 2})["results"][0]["page"] == 2
+    assert asyncio.run(upstream.aget_json("/lines", {"page": 1, "size": 2}, use_cache=False))["total"] == 2
+    error = upstream.get_json("/lines", {"page": 3, "size": 2})
+    assert error["status_code"] == 404
+    assert api.stats()["misses"] == 1
+
+
+def test_explicit_transport_takes_precedence_over_the_cassette(api):
+    upstream.configure(transport=httpx.MockTransport(lambda request: httpx.Response(200, json={"mock": True})))
+    assert upstream.get_json("/lines", {"page": 1, "size": 2}) == {"mock": True}
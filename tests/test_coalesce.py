@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from server import upstream
+from server.coalesce import SingleFlight
+from server.server import get_values, read_schema
+
+LATENCY = 0.1
+
+
+@pytest.fixture
+def slow_api():
+    """Transport (blocking and async) answering after a fixed delay, counting requests."""
+    requests_seen = []
+
+    class Transport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+        def handle_request(self, request):
+            requests_seen.append(request)
+            time.sleep(LATENCY)
+            return httpx.Response(200, json=[{"path": request.url.path}])
+
+        async def handle_async_request(self, request):
+            requests_seen.append(request)
+            await asyncio.sleep(LATENCY)
+            return httpx.Response(200, json=[{"path": request.url.path}])
+
+    previous = upstream.settings()
+    upstream.configure(transport=Transport())
+    yield requests_seen
+    upstream.configure(**previous.__dict__)
+
+
+# -------------------------------
+# SingleFlight
+# -------------------------------
+
+def test_followers_share_the_leader_result():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def work():
+        runs.append(1)
+        started.set()
+        release.wait()
+        return "done"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", work)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", work))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    while flight.stats()["coalesced"] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    assert results == ["done"] * 5
+    assert len(runs) == 1
+    assert flight.stats() == {"calls": 5, "coalesced": 4, "in_flight": 0}
+
+
+def test_followers_get_the_leader_error():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        return await asyncio.gather(*(flight.ado("k", fail) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(run())
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert flight.coalesced == 2
+
+
+def test_cancelled_follower_does_not_cancel_the_call():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return 42
+
+    async def run():
+        leader = asyncio.ensure_future(flight.ado("k", work))
+        follower = asyncio.ensure_future(flight.ado("k", work))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        return await leader
+
+    assert asyncio.run(run()) == 42
+
+
+# -------------------------------
+# upstream
+# -------------------------------
+
+def test_concurrent_tool_calls_send_one_request(slow_api):
+    upstream.in_flight.coalesced = 0
+
+    async def run():
+        return await asyncio.gather(*(read_schema.aio() for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert len(slow_api) == 1
+    assert upstream.in_flight.coalesced == 9
+    # Every caller gets its own copy of the decoded body.
+    results[0][0]["path"] = "changed"
+    assert results[1][0]["path"].endswith("/schema")
+
+
+def test_concurrent_blocking_calls_send_one_request(slow_api):
+    threads = [threading.Thread(target=get_values, kwargs={"field": "Groupe_d'aliment"}) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(slow_api) == 1
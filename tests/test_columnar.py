@@ -0,0 +1,121 @@
+import os
+
+import httpx
+import numpy as np
+import pytest
+
+from server import columnar, snapshot, upstream
+from server.snapshot import Snapshot
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    """AGRIBALYSE_SNAPSHOT_PATH pointing at an empty directory, without background refresh."""
+    path = str(tmp_path / "snapshots")
+    monkeypatch.setenv("AGRIBALYSE_SNAPSHOT_PATH", path)
+    monkeypatch.setenv("AGRIBALYSE_SNAPSHOT_REFRESH", "0")
+    yield path
+    snapshot.install(None)
+
+
+@pytest.fixture
+def api(sample_rows):
+    """data-fair stand-in publishing version "v1" of the sample rows, counting /lines requests."""
+    state = {"updatedAt": "v1", "lines": 0}
+    base_path = httpx.URL(upstream.settings().base_url).path
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path[len(base_path):]
+        if path in ("", "/"):
+            return httpx.Response(200, json={"updatedAt": state["updatedAt"], "count": len(sample_rows)})
+        if path == "/data-files":
+            return httpx.Response(200, json=[])
+        state["lines"] += 1
+        return httpx.Response(200, json={"total": len(sample_rows), "results": sample_rows})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield state
+    upstream.configure(**previous.__dict__)
+
+
+def write(path, rows, version):
+    snap = Snapshot.from_rows(rows, metadata={"version": version})
+    return columnar.write(path, snap.columns, snap.n_rows, snap.metadata)
+
+
+# ---------------------------
+# ---- format ----
+# ---------------------------
+
+def test_opened_snapshot_is_memory_mapped_and_answers_alike(shared, sample_rows):
+    write(shared, sample_rows, "v1")
+    opened = Snapshot.from_directory(shared)
+    built = Snapshot.from_rows(sample_rows)
+    assert isinstance(opened.columns["Score_unique_EF"].values, np.memmap)
+    assert isinstance(opened.columns["Groupe_d'aliment"].codes, np.memmap)
+    assert opened.metadata["version"] == "v1"
+    for path, params in (
+        ("/lines", {"size": 100, "sort": "-Changement_climatique", "qs": 'code_avion:false'}),
+        ("/lines", {"q": "pomme", "size": 5}),
+        ("/values_agg", {"field": "Groupe_d'aliment", "metric": "avg", "metric_field": "DQR"}),
+        ("/simple_metrics_agg", {"metrics": "min,max", "fields": "DQR,Code_CIQUAL"}),
+    ):
+        assert opened.answer(path, params) == built.answer(path, params)
+    assert opened.summaries.as_dict()["groups"] == built.summaries.as_dict()["groups"]
+
+
+def test_new_versions_replace_the_current_one(shared, sample_rows):
+    write(shared, sample_rows, "v1")
+    write(shared, sample_rows[:10], "v2")
+    write(shared, sample_rows[:5], "v3")
+    assert Snapshot.from_directory(shared).n_rows == 5
+    assert sorted(name for name in os.listdir(shared) if not name.startswith(".")) == ["CURRENT", "v2", "v3"]
+
+
+def test_missing_or_unreadable_directory(shared, sample_rows):
+    assert Snapshot.from_directory(shared) is None
+    write(shared, sample_rows, "v1")
+    os.remove(os.path.join(shared, "v1", "0.npy"))
+    assert Snapshot.from_directory(shared) is None
+
+
+# ---------------------------
+# ---- lifecycle ----
+# ---------------------------
+
+def test_download_is_written_and_reopened_without_download(shared, api, sample_rows, monkeypatch):
+    snapshot.start_loading().join()
+    assert api["lines"] == 1
+    assert Snapshot.from_directory(shared).n_rows == len(sample_rows)
+
+    snapshot.install(None)
+    monkeypatch.setattr(snapshot, "download_rows", lambda: pytest.fail("should not download"))
+    snapshot.start_loading().join()
+    assert isinstance(snapshot.current().columns["DQR"].values, np.memmap)
+
+
+def test_refresh_opens_a_version_written_by_another_process(shared, api, sample_rows, monkeypatch):
+    snapshot.load()
+    api["updatedAt"] = "v2"
+    version = snapshot.dataset_version()
+    write(shared, sample_rows[:10], version["version"])
+    monkeypatch.setattr(snapshot, "download_rows", lambda: pytest.fail("should not download"))
+    assert snapshot.refresh() is True
+    assert snapshot.current().n_rows == 10
+
+
+def test_opened_snapshot_is_installed_with_its_indexes(shared, api, sample_rows, monkeypatch):
+    write(shared, sample_rows, "v1")
+    installed = []
+    install = snapshot.install
+
+    def recording_install(snap):
+        if snap is not None:
+            installed.append(set(vars(snap)))  # cached_property values live in the instance dict
+        install(snap)
+
+    monkeypatch.setattr(snapshot, "install", recording_install)
+    snapshot.start_loading().join()
+    assert api["lines"] == 0
+    assert {"text_index", "summaries", "products", "code_index"} <= installed[0]
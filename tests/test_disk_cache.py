@@ -0,0 +1,169 @@
+import asyncio
+import json
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from server import snapshot, upstream
+from server.cache import ResponseCache, make_key
+from server.disk_cache import DiskCache
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "cache.sqlite")
+
+
+# -------------------------------
+# DiskCache
+# -------------------------------
+
+def test_put_get_and_ttl(db_path):
+    clock = FakeClock()
+    store = DiskCache(db_path, clock=clock)
+    key = make_key("/schema", {"mimeType": "application/json"})
+    store.put(key, b"[1]", ttl=60, etag='"e"')
+    stored = store.get(key)
+    assert stored.body == b"[1]" and stored.etag == '"e"' and stored.ttl == 60
+    clock.now += 100
+    assert store.get(key).ttl == -40
+    assert store.get(make_key("/schema")) is None
+
+
+def test_size_bounded_lru_eviction(db_path):
+    clock = FakeClock()
+    store = DiskCache(db_path, max_bytes=10, clock=clock)
+    for page in (1, 2):
+        clock.now += 1
+        store.put(make_key("/lines", {"page": page}), b"xxxx", ttl=60)
+    clock.now += 1
+    store.get(make_key("/lines", {"page": 1}))
+    store.put(make_key("/lines", {"page": 3}), b"xxxx", ttl=60)
+    assert store.get(make_key("/lines", {"page": 2})) is None
+    assert store.get(make_key("/lines", {"page": 1})) is not None
+    assert store.stats() == {"entries": 2, "bytes": 8}
+
+
+def test_totals_follow_writes(db_path):
+    store = DiskCache(db_path, max_bytes=10)
+    store.put(make_key("/schema"), b"xxxx", ttl=60)
+    store.put(make_key("/schema"), b"xxx", ttl=60)
+    store.put(make_key("/values/DQR"), b"xxxx", ttl=60)
+    store.put(make_key("/lines"), b"xxxx", ttl=60)
+    assert store.stats() == {"entries": 2, "bytes": 8}
+    store.invalidate("/values")
+    assert store.stats() == {"entries": 1, "bytes": 4}
+    assert DiskCache(db_path).stats() == {"entries": 1, "bytes": 4}
+
+
+def test_invalidate_prefix_is_literal(db_path):
+    store = DiskCache(db_path)
+    store.put(make_key("/values/Code_AGB"), b"[]", ttl=60)
+    store.put(make_key("/values/CodeXAGB"), b"[]", ttl=60)
+    assert store.invalidate("/values/Code_") == 1
+    assert store.invalidate() == 1
+
+
+def test_concurrent_writers(db_path):
+    store = DiskCache(db_path)
+    script = (
+        "import sys; sys.path.insert(0, '.');"
+        "from server.disk_cache import DiskCache; from server.cache import make_key;"
+        f"s = DiskCache({db_path!r});"
+        "[s.put(make_key('/lines', {'page': i, 'p': 'child'}), b'x' * 100, 60) for i in range(200)]"
+    )
+    child = subprocess.Popen([sys.executable, "-c", script])
+    threads = [
+        threading.Thread(target=lambda t=t: [
+            store.put(make_key("/lines", {"page": i, "t": t}), b"y" * 100, 60) for i in range(100)
+        ])
+        for t in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert child.wait() == 0
+    assert store.stats()["entries"] == 600
+
+
+# -------------------------------
+# second level of ResponseCache
+# -------------------------------
+
+def test_restarted_cache_reads_from_disk(db_path):
+    first = ResponseCache(store=DiskCache(db_path))
+    first.put("/schema", None, b"[1]", etag='"v1"')
+    first.store.flush()
+    restarted = ResponseCache(store=DiskCache(db_path))
+    assert restarted.get("/schema") == b"[1]"
+    assert restarted.stats()["disk_hits"] == 1
+    assert restarted.get("/schema") == b"[1]"
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_expired_disk_entry_is_revalidable(db_path):
+    clock = FakeClock()
+    first = ResponseCache(store=DiskCache(db_path, clock=clock))
+    first.put("/schema", None, b"[1]", etag='"v1"')
+    first.store.flush()
+    clock.now += 48 * 3600
+    restarted = ResponseCache(store=DiskCache(db_path, clock=clock))
+    assert restarted.get("/schema") is None
+    assert restarted.validators("/schema") == {"If-None-Match": '"v1"'}
+
+
+def test_locked_database_does_not_block_the_event_loop(db_path):
+    cache = ResponseCache(store=DiskCache(db_path))
+    cache.store.put(make_key("/lines"), b"[2]", ttl=60)
+    locker = sqlite3.connect(db_path, isolation_level=None)
+    locker.execute("BEGIN EXCLUSIVE")
+    ticks = []
+
+    async def run():
+        async def tick():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        cache.put("/schema", None, b"[1]")  # queued behind the lock
+        lookup = asyncio.ensure_future(cache.aget("/lines"))  # updates accessed_at, behind the lock
+        await asyncio.sleep(0.3)
+        locker.execute("COMMIT")
+        assert await lookup == b"[2]"
+        ticker.cancel()
+
+    asyncio.run(run())
+    cache.store.flush()
+    assert len(ticks) >= 10
+    assert cache.store.stats()["entries"] == 2
+
+
+# -------------------------------
+# snapshot
+# -------------------------------
+
+def test_snapshot_restored_without_download(db_path, sample_rows, monkeypatch):
+    store = DiskCache(db_path)
+    monkeypatch.setattr(upstream.response_cache, "store", store)
+    monkeypatch.setenv("AGRIBALYSE_SNAPSHOT_REFRESH", "0")
+    store.save_snapshot(snapshot.STORED_SNAPSHOT, json.dumps(sample_rows).encode())
+    monkeypatch.setattr(snapshot, "download_rows", lambda: pytest.fail("should not download"))
+    try:
+        snapshot.start_loading().join()
+        assert snapshot.current().n_rows == len(sample_rows)
+    finally:
+        snapshot.install(None)
@@ -0,0 +1,129 @@
+import asyncio
+import csv
+import io
+import json
+
+import httpx
+import pytest
+
+from server import export, snapshot, upstream
+from server.server import export_lines
+from server.snapshot import Snapshot
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+@pytest.fixture
+def cursor_api(sample_rows):
+    """data-fair stand-in paging with ``after`` cursors, 10 rows per page, slowed down a little."""
+    requests_seen = []
+    schema = [{"key": name} for name in sample_rows[0]]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/schema"):
+            return httpx.Response(200, json=schema)
+        requests_seen.append(request)
+        await asyncio.sleep(0.02)
+        after = int(request.url.params.get("after", 0))
+        results = sample_rows[after:after + 10]
+        body = {"total": len(sample_rows), "results": results}
+        if after + 10 < len(sample_rows):
+            body["next"] = str(request.url.copy_remove_param("page").copy_set_param("after", after + 10))
+        return httpx.Response(200, json=body)
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield requests_seen
+    upstream.configure(**previous.__dict__)
+
+
+class FakeContext:
+    def __init__(self):
+        self.reports = []
+
+    async def report_progress(self, progress, total=None, message=None):
+        self.reports.append((progress, total))
+
+
+def export_all(ctx=None, **arguments):
+    """Call export_lines until the cursor runs out, returning the chunks."""
+    async def run():
+        chunks = [await export_lines.aio(**arguments, ctx=ctx)]
+        while chunks[-1].get("cursor"):
+            chunks.append(await export_lines.aio(cursor=chunks[-1]["cursor"], ctx=ctx))
+        return chunks
+
+    return asyncio.run(run())
+
+
+def test_split_next_link():
+    path, params = export.split_next(upstream.settings().base_url + "/lines?size=10&after=30%2C12&select=DQR")
+    assert path == "/lines"
+    assert params == {"size": "10", "after": "30,12", "select": "DQR"}
+
+
+def test_export_csv_from_snapshot(local, sample_rows):
+    ctx = FakeContext()
+    chunks = export_all(ctx, sort="Code_AGB", select=["Code_AGB", "DQR"], chunk_size=7)
+    assert [chunk["rows"] for chunk in chunks] == [7] * 5 + [len(sample_rows) - 35]
+    assert chunks[-1]["exported"] == chunks[-1]["total"] == len(sample_rows)
+    assert not chunks[-1]["truncated"]
+    rows = list(csv.DictReader(io.StringIO("".join(chunk["data"] for chunk in chunks))))
+    assert [row["Code_AGB"] for row in rows] == sorted(row["Code_AGB"] for row in sample_rows)
+    assert ctx.reports[0] == (7, len(sample_rows))
+    assert ctx.reports[-1] == (len(sample_rows), len(sample_rows))
+
+
+def test_csv_header_from_schema_and_booleans(cursor_api, sample_rows):
+    # The first row leaves out its empty fields, e.g. DQR
+    sparse = next(i for i, row in enumerate(sample_rows) if "DQR" not in row)
+    sample_rows.insert(0, sample_rows.pop(sparse))
+    try:
+        chunks = export_all(max_rows=20)
+    finally:
+        sample_rows.insert(sparse, sample_rows.pop(0))
+    reader = csv.DictReader(io.StringIO("".join(chunk["data"] for chunk in chunks)))
+    rows = list(reader)
+    assert reader.fieldnames == [name for name in sample_rows[0] if not name.startswith("_")]
+    assert len(rows) == 20
+    assert rows[0]["DQR"] == ""
+    assert {row["code_avion"] for row in rows} <= {"true", "false"}
+    assert "true" in {row["code_avion"] for row in rows}
+
+
+def test_export_follows_cursor_links(cursor_api, sample_rows):
+    ctx = FakeContext()
+    chunks = export_all(ctx, format="jsonl", max_rows=25, chunk_size=10)
+    rows = [json.loads(line) for chunk in chunks for line in chunk["data"].splitlines()]
+    assert rows == sample_rows[:25]
+    assert chunks[-1]["cursor"] is None
+    assert chunks[-1]["truncated"]
+    assert len(cursor_api) == 3
+    assert "after" in cursor_api[-1].url.params
+    assert [done for done, _ in ctx.reports] == [10, 20, 25]
+
+
+def test_cancelled_export_stops_fetching(cursor_api):
+    async def run():
+        task = asyncio.ensure_future(export_lines.aio(format="jsonl"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert len(cursor_api) == 1
+
+
+@pytest.mark.parametrize("arguments", [
+    {"format": "xlsx"}, {"max_rows": 0}, {"max_rows": -5}, {"chunk_size": 0}, {"cursor": "not a cursor"},
+])
+def test_invalid_arguments(arguments):
+    assert "error" in export_lines(**arguments)
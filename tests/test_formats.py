@@ -0,0 +1,91 @@
+import asyncio
+import csv
+import io
+import json
+
+import pytest
+
+from server import snapshot
+from server.formats import COMPACT_COLUMNS, dumps, format_lines
+from server.server import mcp, read_lines
+from server.snapshot import Snapshot
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+RESULT = {
+    "total": 3,
+    "next": "https://example.org/lines?page=2",
+    "results": [
+        {"Code_AGB": "1", "DQR": 2.5, "_i": 1, "_rand": 42},
+        {"Code_AGB": "2", "DQR": None, "_i": 2, "_rand": 7},
+        {"Code_AGB": "3, bis", "DQR": 1.0, "_i": 3, "_rand": 9},
+    ],
+}
+
+
+def test_dumps_is_compact_and_keeps_accents():
+    assert dumps({"Préparation": "cru", "a": [1, 2]}) == '{"Préparation":"cru","a":[1,2]}'
+
+
+def test_json_unchanged_by_default():
+    assert format_lines(RESULT) is RESULT
+
+
+def test_columnar():
+    output = format_lines(RESULT, "columnar")
+    assert output["fields"] == ["Code_AGB", "DQR"]
+    assert output["rows"] == [["1", 2.5], ["2", None], ["3, bis", 1.0]]
+    assert output["total"] == 3 and output["next"] == RESULT["next"]
+
+
+@pytest.mark.parametrize("format,delimiter", [("csv", ","), ("tsv", "\t")])
+def test_delimited_text(format, delimiter):
+    output = format_lines(RESULT, format)
+    rows = list(csv.reader(io.StringIO(output["data"]), delimiter=delimiter))
+    assert rows == [["Code_AGB", "DQR"], ["1", "2.5"], ["2", ""], ["3, bis", "1.0"]]
+
+
+def test_delimited_text_booleans():
+    output = format_lines({"total": 2, "results": [{"code_avion": True}, {"code_avion": False}]}, "csv")
+    assert output["data"] == "code_avion\ntrue\nfalse\n"
+
+
+def test_max_bytes_cuts_whole_rows():
+    output = format_lines(RESULT, "json", max_bytes=len(dumps(RESULT["results"][0])) + 5)
+    assert len(output["results"]) == 1
+    assert output["truncated"]["rows"] == 2
+    assert output["truncated"]["bytes"] > 0
+    assert "_i" in output["results"][0]
+    assert "truncated" not in format_lines(RESULT, "csv", max_bytes=10_000)
+
+
+# -------------------------------
+# read_lines
+# -------------------------------
+
+def test_read_lines_compact(local):
+    result = read_lines(q="pomme", compact=True, size=50)
+    assert set(result["results"][0]) == set(COMPACT_COLUMNS)
+    selected = read_lines(select=["Code_AGB"], compact=True, format="columnar")
+    assert selected["fields"] == ["Code_AGB"]
+
+
+def test_read_lines_csv_is_smaller(local):
+    verbose = read_lines(size=40)
+    table = read_lines(size=40, format="csv")
+    assert len(table["data"]) < len(dumps(verbose)) * 0.7
+    assert read_lines(format="xml")["error"]
+
+
+def test_mcp_payload_is_compact_json(local):
+    content = asyncio.run(mcp.call_tool("read_lines", {"size": 2, "compact": True}))
+    text = content[0].text
+    assert "\n" not in text
+    assert json.loads(text)["total"] == local.n_rows
@@ -0,0 +1,85 @@
+import httpx
+import pytest
+
+from server import snapshot, upstream
+from server.fuzzy import NameIndex, trigrams
+from server.server import resolve_product
+from server.snapshot import Snapshot
+
+NAME = "Nom_du_Produit_en_Français"
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+@pytest.fixture
+def api(sample_rows):
+    """Blocking transport serving the sample as a single /lines page, counting the requests."""
+    requests_seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests_seen.append(request)
+        return httpx.Response(200, json={"total": len(sample_rows), "results": sample_rows})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    snapshot._reference = None
+    yield requests_seen
+    snapshot._reference = None
+    upstream.configure(**previous.__dict__)
+
+
+def best(snap, query):
+    row, score, field = snap.products.search(query, 1)[0]
+    return snap.rows([row], ["Code_AGB"])[0]["Code_AGB"], field
+
+
+# ---------------------------
+# ---- index ----
+# ---------------------------
+
+def test_trigrams_ignore_case_and_accents():
+    assert trigrams("Pâte") == trigrams("pate") == {"  p", " pa", "pat", "ate", "te "}
+
+
+def test_typos_prefixes_and_word_order():
+    index = NameIndex(["Pomme, pulpe, crue", "Compote de pomme", "Carotte, crue"])
+    assert index.search("pome crue", 1)[0][0] == 0
+    assert index.search("compot pomme", 1)[0][0] == 1
+    assert index.search("crue carrote", 1)[0][0] == 2
+    assert index.search("zzz", 3) == []
+
+
+# ---------------------------
+# ---- snapshot ----
+# ---------------------------
+
+def test_product_names_and_lci_names(local):
+    assert best(local, "compotte de pommes") == ("13102", NAME)
+    assert best(local, "strawberry raw") == ("13012", "LCI_Name")
+    assert best(local, "jus pomme") == ("2013", NAME)
+
+
+def test_tool_returns_ranked_candidates(local):
+    result = resolve_product("carote crue", limit=3)
+    candidates = result["candidates"]
+    assert candidates[0]["Code_AGB"] == "20009"
+    assert candidates[0]["LCI_Name"] == "Carrot, raw"
+    assert len(candidates) <= 3
+    assert [c["score"] for c in candidates] == sorted((c["score"] for c in candidates), reverse=True)
+
+
+def test_tool_errors(local):
+    assert "error" in resolve_product("  ")
+    assert "error" in resolve_product("pomme", limit=0)
+
+
+def test_without_snapshot_the_dataset_is_downloaded_once(api):
+    assert resolve_product("tomate")["candidates"][0]["Code_AGB"] == "20047"
+    assert resolve_product("banane")["candidates"][0]["Code_AGB"] == "13002"
+    assert len(api) == 1
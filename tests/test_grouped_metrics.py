@@ -0,0 +1,132 @@
+from collections import defaultdict
+
+import httpx
+import numpy as np
+import pytest
+
+from server import snapshot, upstream
+from server.aggregations import group_metric
+from server.server import get_grouped_metrics
+from server.snapshot import Snapshot, Unsupported
+
+GROUP = "Groupe_d'aliment"
+SUB_GROUP = "Sous-groupe_d'aliment"
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+@pytest.fixture
+def api(sample_rows):
+    """data-fair stand-in answering /values_agg with the local engine, recording the requests."""
+    engine = Snapshot.from_rows(sample_rows)
+    requests_seen = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests_seen.append(dict(request.url.params))
+        return httpx.Response(200, json=engine.answer("/values_agg", dict(request.url.params)))
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield requests_seen
+    upstream.configure(**previous.__dict__)
+
+
+def averages(rows, field, indicator):
+    values = defaultdict(list)
+    for row in rows:
+        if row.get(field) is not None and row.get(indicator) is not None:
+            values[row[field]].append(row[indicator])
+    return {group: sum(v) / len(v) for group, v in values.items()}
+
+
+# -------------------------------
+# group_metric()
+# -------------------------------
+
+def test_group_metric():
+    groups = np.array([0, 1, 0, 2, 1])
+    values = np.array([1.0, np.nan, 3.0, 5.0, np.nan])
+    assert group_metric(groups, 4, values, "sum").tolist() == [4.0, 0.0, 5.0, 0.0]
+    np.testing.assert_equal(group_metric(groups, 4, values, "avg"), [2.0, np.nan, 5.0, np.nan])
+    np.testing.assert_equal(group_metric(groups, 4, values, "min"), [1.0, np.nan, 5.0, np.nan])
+    np.testing.assert_equal(group_metric(groups, 4, values, "max"), [3.0, np.nan, 5.0, np.nan])
+
+
+# -------------------------------
+# /values_agg (local)
+# -------------------------------
+
+def test_values_agg_buckets(local, sample_rows):
+    result = local.answer("/values_agg", {"field": GROUP, "metric": "avg", "metric_field": "Score_unique_EF"})
+    assert result["total"] == len(sample_rows)
+    counts = [bucket["total"] for bucket in result["aggs"]]
+    assert counts == sorted(counts, reverse=True) and sum(counts) == len(sample_rows)
+    expected = averages(sample_rows, GROUP, "Score_unique_EF")
+    assert {b["value"]: b["metric"] for b in result["aggs"]} == pytest.approx(expected)
+
+
+def test_values_agg_two_levels_sorted_and_limited(local, sample_rows):
+    result = local.answer("/values_agg", {
+        "field": f"{GROUP};{SUB_GROUP}", "agg_size": "2;1", "sort": "-metric;key",
+        "metric": "max", "metric_field": "Changement_climatique",
+    })
+    maxima = [bucket["metric"] for bucket in result["aggs"]]
+    assert len(maxima) == 2 and maxima == sorted(maxima, reverse=True)
+    first = result["aggs"][0]
+    subgroups = sorted({r[SUB_GROUP] for r in sample_rows if r[GROUP] == first["value"]})
+    assert [b["value"] for b in first["aggs"]] == subgroups[:1]
+
+
+def test_values_agg_unsupported(local):
+    for params in (
+        {"field": "DQR"},
+        {"field": GROUP, "metric": "percentiles", "metric_field": "DQR"},
+        {"field": GROUP, "size": 3},
+        {"field": f"{GROUP};{SUB_GROUP};LCI_Name"},
+    ):
+        with pytest.raises(Unsupported):
+            local.answer("/values_agg", params)
+
+
+# -------------------------------
+# get_grouped_metrics()
+# -------------------------------
+
+def test_rank_sub_groups(local, sample_rows):
+    result = get_grouped_metrics(
+        group_by=[SUB_GROUP], fields=["Score_unique_EF"], metrics=["avg", "max"],
+        sort="-avg(Score_unique_EF)", size=3,
+    )
+    assert result["fields"] == [SUB_GROUP, "count", "avg(Score_unique_EF)", "max(Score_unique_EF)"]
+    expected = sorted(averages(sample_rows, SUB_GROUP, "Score_unique_EF").items(), key=lambda kv: -kv[1])[:3]
+    assert [(row[0], row[2]) for row in result["rows"]] == [(k, pytest.approx(v)) for k, v in expected]
+    assert result["groups"] == len({r[SUB_GROUP] for r in sample_rows})
+
+
+def test_two_grouping_fields_give_one_row_per_pair(local, sample_rows):
+    result = get_grouped_metrics(group_by=[GROUP, SUB_GROUP], size=1000, qs='code_saison:"1"')
+    pairs = {(r[GROUP], r[SUB_GROUP]) for r in sample_rows if r["code_saison"] == "1"}
+    assert {tuple(row[:2]) for row in result["rows"]} == pairs
+    assert sum(row[2] for row in result["rows"]) == result["total"]
+
+
+def test_upstream_sends_one_values_agg_request_per_metric(api, sample_rows):
+    result = get_grouped_metrics(group_by=[GROUP], fields=["DQR", "Score_unique_EF"], metrics=["min"], sort=GROUP)
+    assert [(r["metric"], r["metric_field"]) for r in api] == [("min", "DQR"), ("min", "Score_unique_EF")]
+    assert all(r["field"] == GROUP and r["size"] == "0" for r in api)
+    assert [row[0] for row in result["rows"]] == sorted({r[GROUP] for r in sample_rows})
+
+
+def test_invalid_arguments():
+    assert "error" in get_grouped_metrics(group_by=["DQR"])
+    assert "error" in get_grouped_metrics(group_by=[GROUP, SUB_GROUP, "LCI_Name"])
+    assert "error" in get_grouped_metrics(group_by=[GROUP], fields=["Code_AGB"])
+    assert "error" in get_grouped_metrics(group_by=[GROUP], fields=["DQR"], metrics=["median"])
+    assert "error" in get_grouped_metrics(group_by=[GROUP], sort="-avg(DQR)")
+    assert "error" in get_grouped_metrics(group_by=[GROUP], size=0)
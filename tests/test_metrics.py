@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+from server import upstream
+from server.metrics import Histogram, Registry, profile, registry, timed
+from server.server import mcp
+
+
+@pytest.fixture
+def api():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/missing"):
+            return httpx.Response(404, json={})
+        return httpx.Response(200, json={"total": 0, "results": []})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    registry.reset()
+    yield
+    upstream.configure(**previous.__dict__)
+
+
+# -------------------------------
+# registry
+# -------------------------------
+
+def test_histogram_quantiles():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.05, 0.5, 5.0):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.as_dict()["count"] == 4
+
+
+def test_prometheus_exposition():
+    metrics = Registry()
+    metrics.describe("requests_total", "Requests.")
+    metrics.inc("requests_total", endpoint="/lines", status="200")
+    metrics.observe("latency_seconds", 0.003, endpoint='/va"l')
+    metrics.register(lambda: {"cache_hits": {(): 7}})
+    text = metrics.prometheus()
+    assert "# HELP requests_total Requests.\n# TYPE requests_total counter" in text
+    assert 'requests_total{endpoint="/lines",status="200"} 1' in text
+    assert 'latency_seconds_bucket{endpoint="/va\\"l",le="0.005"} 1' in text
+    assert 'latency_seconds_bucket{endpoint="/va\\"l",le="+Inf"} 1' in text
+    assert 'latency_seconds_count{endpoint="/va\\"l"} 1' in text
+    assert "cache_hits 7" in text
+
+
+def test_timed_only_records_inside_profile():
+    with timed("upstream"):
+        pass
+    with profile() as breakdown:
+        with timed("upstream"):
+            pass
+        with timed("upstream"):
+            pass
+    assert set(breakdown) == {"upstream", "total"}
+
+
+# -------------------------------
+# instrumentation
+# -------------------------------
+
+def test_tool_calls_are_recorded(api):
+    hits = upstream.response_cache.hits
+
+    async def run():
+        await mcp.call_tool("read_lines", {"size": 1})
+        await mcp.call_tool("read_lines", {"size": 1})
+        await mcp.call_tool("get_values", {"field": "Inconnu"})
+
+    asyncio.run(run())
+    stats = registry.as_dict()
+    assert stats["agribalyse_tool_calls_total"] == {"status=ok,tool=read_lines": 2, "status=error,tool=get_values": 1}
+    assert stats["agribalyse_tool_seconds"]["tool=read_lines"]["count"] == 2
+    assert stats["agribalyse_upstream_responses_total"] == {"endpoint=/lines,status=200": 1}
+    assert stats["agribalyse_cache_hits"] == {"": hits + 1}
+    assert stats["agribalyse_tool_calls_in_progress"] == {"tool=read_lines": 0, "tool=get_values": 0}
+
+
+def test_stats_resources(api):
+    async def run():
+        await mcp.call_tool("read_lines", {"size": 1})
+        stats = await mcp.read_resource("agribalyse://stats")
+        text = await mcp.read_resource("agribalyse://metrics")
+        return stats, text
+
+    stats, text = asyncio.run(run())
+    assert "agribalyse_tool_seconds" in json.loads(stats[0].content)
+    assert 'agribalyse_upstream_request_seconds_count{endpoint="/lines"} 1' in text[0].content
+    assert text[0].mime_type == "text/plain"
+
+
+def test_metrics_http_endpoint(api):
+    response = TestClient(mcp.sse_app()).get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE agribalyse_cache_hits gauge" in response.text
+
+
+def test_profile_attaches_timings(api, monkeypatch):
+    monkeypatch.setenv("AGRIBALYSE_PROFILE", "1")
+    content = asyncio.run(mcp.call_tool("read_lines", {"size": 1}))
+    timings = json.loads(content[0].text)["_timings"]
+    assert {"local", "upstream", "decode", "total"} <= set(timings)
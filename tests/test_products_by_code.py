@@ -0,0 +1,83 @@
+import httpx
+import pytest
+
+from server import server, snapshot, upstream
+from server.server import code_queries, get_products_by_code
+from server.snapshot import Snapshot
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+@pytest.fixture
+def api(sample_rows):
+    """data-fair stand-in answering /lines with the local engine, recording the requests."""
+    engine = Snapshot.from_rows(sample_rows)
+    requests_seen = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests_seen.append(dict(request.url.params))
+        return httpx.Response(200, json=engine.answer("/lines", dict(request.url.params)))
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield requests_seen
+    upstream.configure(**previous.__dict__)
+
+
+# ---------------------------
+# ---- code index ----
+# ---------------------------
+
+def test_lookup_keeps_the_order_of_the_codes(local, sample_rows):
+    codes = [sample_rows[5]["Code_AGB"], "nope", sample_rows[1]["Code_AGB"]]
+    rows, unknown = local.lookup("Code_AGB", codes)
+    assert local.rows(rows, ["Code_AGB"]) == [{"Code_AGB": codes[0]}, {"Code_AGB": codes[2]}]
+    assert unknown == ["nope"]
+
+
+def test_numeric_codes_are_looked_up_as_strings(local, sample_rows):
+    rows, unknown = local.lookup("Code_CIQUAL", [str(sample_rows[3]["Code_CIQUAL"])])
+    assert local.rows(rows, ["Code_AGB"]) == [{"Code_AGB": sample_rows[3]["Code_AGB"]}]
+    assert unknown == []
+
+
+# ---------------------------
+# ---- tool ----
+# ---------------------------
+
+def test_tool_answers_from_the_snapshot(local, sample_rows):
+    codes = [r["Code_AGB"] for r in sample_rows[:4]] + ["99999"]
+    result = get_products_by_code(codes, select=["DQR"])
+    assert [row["Code_AGB"] for row in result["results"]] == codes[:4]
+    assert set(result["results"][0]) == {"Code_AGB", "DQR"}
+    assert result["not_found"] == ["99999"]
+    assert "error" in get_products_by_code(codes, select=["Nope"])
+
+
+def test_code_queries_fit_the_length_limit(monkeypatch):
+    monkeypatch.setattr(server, "MAX_CODES_QUERY_LENGTH", 40)
+    queries = code_queries("Code_AGB", ["1001", "1002", "1003", "1004", 'a"b'])
+    assert [chunk for _, chunk in queries] == [["1001", "1002", "1003"], ["1004", 'a"b']]
+    assert queries[1][0] == 'Code_AGB:("1004" OR "a\\"b")'
+    assert all(len(qs) <= 40 for qs, _ in queries)
+
+
+def test_upstream_chunks_the_codes(api, sample_rows, monkeypatch):
+    monkeypatch.setattr(server, "MAX_CODES_QUERY_LENGTH", 60)
+    codes = [str(r["Code_CIQUAL"]) for r in sample_rows[:6]] + ["1"]
+    result = get_products_by_code(codes, code_field="Code_CIQUAL", select=["Code_AGB"])
+    assert len(api) == 2 and all(len(r["qs"]) <= 60 for r in api)
+    assert [row["Code_AGB"] for row in result["results"]] == [r["Code_AGB"] for r in sample_rows[:6]]
+    assert result["not_found"] == ["1"] and result["errors"] == {}
+
+
+def test_invalid_arguments():
+    assert "error" in get_products_by_code([])
+    assert "error" in get_products_by_code(["1"] * 2 + [str(i) for i in range(1001)])
+    assert "error" in get_products_by_code(["1"], code_field="LCI_Name")
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from server import snapshot, upstream
+from server.server import get_products_table, mcp
+from server.snapshot import Snapshot
+
+LATENCY = 0.2
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+@pytest.fixture
+def slow_api(sample_rows):
+    """Async transport answering every /lines request with the first sample row, after a delay."""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(LATENCY)
+        if request.url.params.get("q") == "introuvable":
+            return httpx.Response(200, json={"total": 0, "results": []})
+        return httpx.Response(200, json={"total": 1, "results": sample_rows[:1]})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield
+    upstream.configure(**previous.__dict__)
+
+
+def test_table_by_name_and_code(local, sample_rows):
+    table = get_products_table(
+        products=["compote de pomme", "13040", "introuvable"],
+        indicators=["Score_unique_EF", "Changement_climatique"]
+    )
+    assert table["fields"] == [
+        "product", "Code_AGB", "Nom_du_Produit_en_Français", "Score_unique_EF", "Changement_climatique"
+    ]
+    by_code = {row["Code_AGB"]: row for row in sample_rows}
+    compote, pulp = table["rows"]
+    assert compote[:3] == ["compote de pomme", "13102", "Compote de pomme"]
+    assert compote[3:] == [by_code["13102"]["Score_unique_EF"], by_code["13102"]["Changement_climatique"]]
+    assert pulp[:3] == ["13040", "13040", "Pomme, pulpe, crue"]
+    assert table["not_found"] == ["introuvable"]
+
+
+def test_invalid_arguments():
+    assert "error" in get_products_table(products=["pomme"], indicators=["Code_AGB"])
+    assert "error" in get_products_table(products=[], indicators=["DQR"])
+
+
+def test_sub_queries_run_concurrently(slow_api):
+    products = ["pomme", "poire", "banane", "fraise", "introuvable"]
+
+    async def run():
+        start = time.perf_counter()
+        result = await mcp.call_tool("get_products_table", {"products": products, "indicators": ["DQR"]})
+        return time.perf_counter() - start, result
+
+    elapsed, _ = asyncio.run(run())
+    table = asyncio.run(get_products_table.aio(products=products, indicators=["DQR"]))
+    assert len(table["rows"]) == 4
+    assert table["not_found"] == ["introuvable"]
+    # Sequential lookups would take len(products) * LATENCY.
+    assert elapsed < 3 * LATENCY
@@ -0,0 +1,93 @@
+import pytest
+
+from server import snapshot
+from server.query_string import MUST, MUST_NOT, SHOULD, Bool, Exists, Match, QuerySyntaxError, Range, compile_query, evaluate
+from server.server import get_simple_metrics_agg, read_lines
+from server.snapshot import Snapshot, Unsupported
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+def count(snap, qs):
+    return int(evaluate(compile_query(qs), snap).sum())
+
+
+# -------------------------------
+# parsing
+# -------------------------------
+
+def test_parse_field_values():
+    assert compile_query('Nom_du_Produit_en_Français:"pomme"') == Match("Nom_du_Produit_en_Français", "pomme", "phrase")
+    assert compile_query("Sous-groupe_d'aliment:fruit*") == Match("Sous-groupe_d'aliment", "fruit*", "wildcard")
+    assert compile_query("Score_unique_EF:[0 TO 0.5}") == Range("Score_unique_EF", "0", "0.5", True, False)
+    assert compile_query("DQR:<3") == Range("DQR", None, "3", True, False)
+    assert compile_query("_exists_:DQR") == Exists("DQR")
+
+
+def test_parse_boolean_operators_like_lucene():
+    a, b, c = (Match(f, "x") for f in "abc")
+    assert compile_query("a:x AND b:x") == Bool(((MUST, a), (MUST, b)))
+    assert compile_query("a:x b:x") == Bool(((SHOULD, a), (SHOULD, b)))
+    assert compile_query("a:x OR b:x AND c:x") == Bool(((SHOULD, a), (MUST, b), (MUST, c)))
+    assert compile_query("a:x -b:x") == Bool(((SHOULD, a), (MUST_NOT, b)))
+    assert compile_query("a:(x OR y)") == Bool(((SHOULD, a), (SHOULD, Match("a", "y"))))
+
+
+@pytest.mark.parametrize("qs", ["pomme", "DQR:3~", "DQR:3^2", "a:/re/", "(a:x", 'a:"x'])
+def test_unsupported_syntax(qs):
+    with pytest.raises(QuerySyntaxError):
+        compile_query(qs)
+
+
+def test_compiled_queries_are_cached():
+    compile_query.cache_clear()
+    compile_query("DQR:[1 TO 2]")
+    compile_query("DQR:[1 TO 2]")
+    assert compile_query.cache_info().hits == 1
+
+
+# -------------------------------
+# evaluation
+# -------------------------------
+
+def test_keyword_fields_match_whole_values(local, sample_rows):
+    assert count(local, 'Nom_du_Produit_en_Français:"pomme"') == 0
+    assert count(local, 'Nom_du_Produit_en_Français:"Compote de pomme"') == 1
+    assert count(local, 'Nom_du_Produit_en_Français:Pomme*') == 3
+    assert count(local, "Nom_du_Produit_en_Français.text:pomme") == sum(
+        "pomme" in row["Nom_du_Produit_en_Français"].lower() for row in sample_rows
+    )
+
+
+def test_numeric_ranges(local, sample_rows):
+    expected = sum(0 <= row["Score_unique_EF"] <= 0.5 for row in sample_rows)
+    assert count(local, "Score_unique_EF:[0 TO 0.5]") == expected
+    assert count(local, "Score_unique_EF:>0.5") == len(sample_rows) - expected
+    assert count(local, "Score_unique_EF:[* TO *]") == len(sample_rows)
+
+
+def test_boolean_combinations(local, sample_rows):
+    drinks = sum(row["Groupe_d'aliment"] == "boissons" for row in sample_rows)
+    assert count(local, "Groupe_d'aliment:boissons AND NOT Sous-groupe_d'aliment:eaux") == drinks - 1
+    assert count(local, "Sous-groupe_d'aliment:(fruits OR légumes)") == sum(
+        row["Sous-groupe_d'aliment"] in ("fruits", "légumes") for row in sample_rows
+    )
+    assert count(local, "NOT _exists_:DQR") == 1
+
+
+def test_tools_use_local_qs(local, sample_rows):
+    result = read_lines(qs='Nom_du_Produit_en_Français:Pomme* AND code_saison:"1"', size=50)
+    assert result["total"] == 3
+    metrics = get_simple_metrics_agg(metrics=["value_count"], fields=["DQR"], qs="Score_unique_EF:[1 TO *]")
+    assert metrics["total"] == sum(row["Score_unique_EF"] >= 1 for row in sample_rows)
+
+
+def test_unknown_field_falls_back(local):
+    with pytest.raises(Unsupported):
+        local.answer("/lines", {"qs": "Inconnu:1"})
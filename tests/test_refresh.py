@@ -0,0 +1,101 @@
+import httpx
+import pytest
+
+from server import snapshot, upstream
+from server.server import agribalyse_snapshot, get_products_table
+from server.snapshot import Snapshot
+
+
+@pytest.fixture
+def api(sample_rows):
+    """data-fair stand-in whose published version and rows can be changed, counting /lines requests."""
+    state = {"updatedAt": "2025-01-01T00:00:00Z", "rows": sample_rows, "lines": 0, "down": False}
+    base_path = httpx.URL(upstream.settings().base_url).path
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if state["down"]:
+            return httpx.Response(503)
+        path = request.url.path[len(base_path):]
+        if path in ("", "/"):
+            return httpx.Response(200, json={"updatedAt": state["updatedAt"], "count": len(state["rows"])})
+        if path == "/data-files":
+            return httpx.Response(200, json=[{"name": "agribalyse.csv", "size": 1, "updatedAt": state["updatedAt"]}])
+        state["lines"] += 1
+        return httpx.Response(200, json={"total": len(state["rows"]), "results": state["rows"]})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler), retry_attempts=1)
+    yield state
+    snapshot.install(None)
+    upstream.configure(**previous.__dict__)
+
+
+# ---------------------------
+# ---- refresh ----
+# ---------------------------
+
+def test_unchanged_version_is_not_downloaded_again(api):
+    first = snapshot.load()
+    assert api["lines"] == 1
+    assert snapshot.refresh() is False
+    assert snapshot.current() is first and api["lines"] == 1
+
+
+def test_changed_version_swaps_the_snapshot(api, sample_rows):
+    first = snapshot.load()
+    api["updatedAt"] = "2025-02-01T00:00:00Z"
+    api["rows"] = sample_rows[:10]
+    assert snapshot.refresh() is True
+    second = snapshot.current()
+    assert second is not first and second.n_rows == 10
+    assert second.metadata["version"] != first.metadata["version"]
+    # A call that started on the previous snapshot still sees all of it.
+    assert first.n_rows == len(sample_rows)
+
+
+def test_failed_check_keeps_the_current_snapshot(api):
+    first = snapshot.load()
+    api["down"] = True
+    with pytest.raises(RuntimeError):
+        snapshot.refresh()
+    assert snapshot.current() is first
+
+
+def test_pinned_snapshot_answers_during_a_swap(api, sample_rows):
+    pinned = Snapshot.from_rows(sample_rows[:5])
+    snapshot.install(Snapshot.from_rows(sample_rows))
+    assert snapshot.answer("/lines", {"size": 0}, pinned)["total"] == 5
+    assert snapshot.answer("/lines", {"size": 0})["total"] == len(sample_rows)
+
+
+def test_tools_keep_the_snapshot_they_started_with(api, sample_rows, monkeypatch):
+    snapshot.install(Snapshot.from_rows(sample_rows[:1]))
+    original = snapshot.answer
+    seen = []
+
+    def answer(path, params=None, pinned=None):
+        seen.append(pinned)
+        snapshot.install(Snapshot.from_rows(sample_rows))  # refreshed in between
+        return original(path, params, pinned)
+
+    monkeypatch.setattr(snapshot, "answer", answer)
+    code = sample_rows[0]["Code_AGB"]
+    table = get_products_table([code, sample_rows[1]["Code_AGB"]], ["DQR"])
+    assert len(set(map(id, seen))) == 1
+    assert [row[0] for row in table["rows"]] == [code]
+
+
+# ---------------------------
+# ---- status ----
+# ---------------------------
+
+def test_status_reports_version_and_age(api, sample_rows):
+    assert agribalyse_snapshot()["installed"] is False
+    snap = snapshot.load()
+    status = agribalyse_snapshot()
+    assert status["installed"] is True
+    assert status["version"] == snap.metadata["version"]
+    assert status["dataset"]["updatedAt"] == api["updatedAt"]
+    assert status["rows"] == len(sample_rows)
+    assert 0 <= status["age_seconds"] < 60
+    assert status["checked_at"] is not None
@@ -0,0 +1,166 @@
+import asyncio
+import email.utils
+import time
+
+import httpx
+import pytest
+
+from server import upstream
+from server.resilience import AdaptiveLimiter, CircuitBreaker, RetryPolicy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def flaky_api():
+    """Transport answering with the queued statuses (or raising), then 200."""
+    script = []
+    requests_seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests_seen.append(request)
+        step = script.pop(0) if script else 200
+        if isinstance(step, Exception):
+            raise step
+        if isinstance(step, httpx.Response):
+            return step
+        return httpx.Response(step, json={"results": [], "status": step})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler), retry_base_delay=0.0, breaker_threshold=3)
+    yield script, requests_seen
+    upstream.configure(**previous.__dict__)
+
+
+# -------------------------------
+# retry policy
+# -------------------------------
+
+def test_backoff_only_for_overload():
+    policy = RetryPolicy(attempts=3, base_delay=1.0, max_delay=3.0)
+    assert policy.backoff(0, httpx.Response(200)) is None
+    assert policy.backoff(0, httpx.Response(404)) is None
+    assert 0 <= policy.backoff(0, httpx.Response(503)) <= 1.0
+    assert 0 <= policy.backoff(1, None) <= 2.0
+    assert policy.backoff(2, httpx.Response(503)) is None
+
+
+def test_backoff_respects_retry_after():
+    policy = RetryPolicy(max_delay=10.0)
+    assert policy.backoff(0, httpx.Response(429, headers={"Retry-After": "4"})) == 4.0
+    assert policy.backoff(0, httpx.Response(429, headers={"Retry-After": "3600"})) == 10.0
+    date = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert policy.backoff(0, httpx.Response(503, headers={"Retry-After": date})) == 10.0
+
+
+# -------------------------------
+# circuit breaker
+# -------------------------------
+
+def test_breaker_opens_and_recovers():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=2, reset_timeout=10, clock=clock)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open" and not breaker.allow()
+    clock.now = 11
+    assert breaker.allow()  # trial call
+    assert not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    clock.now = 22
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+
+
+# -------------------------------
+# adaptive limiter
+# -------------------------------
+
+def test_limit_halves_on_overload_and_grows_back():
+    limiter = AdaptiveLimiter(maximum=8)
+    limiter.record(True)
+    limiter.record(True)
+    assert limiter.stats()["limit"] == 2
+    for _ in range(10):
+        limiter.record(False)
+    assert limiter.stats()["limit"] > 2
+
+
+def test_waiters_get_slots_in_order():
+    limiter = AdaptiveLimiter(maximum=2)
+    order = []
+
+    async def job(name):
+        await limiter.aacquire()
+        order.append(name)
+        await asyncio.sleep(0.01)
+        limiter.release()
+
+    async def run():
+        limiter.acquire()
+        limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        # The slot granted to the cancelled waiter comes back.
+        limiter.release()
+        limiter.release()
+        await asyncio.gather(*(job(i) for i in range(5)))
+
+    asyncio.run(run())
+    assert order == [0, 1, 2, 3, 4]
+    assert limiter.stats() == {"limit": 2, "in_flight": 0, "waiting": 0}
+
+
+# -------------------------------
+# upstream
+# -------------------------------
+
+def test_transient_errors_are_retried(flaky_api):
+    script, requests_seen = flaky_api
+    script.extend([503, httpx.ConnectError("refused")])
+    result = upstream.get_json("/lines")
+    assert result["status"] == 200
+    assert len(requests_seen) == 3
+
+
+def test_async_retry_after(flaky_api):
+    script, requests_seen = flaky_api
+    script.append(httpx.Response(429, headers={"Retry-After": "0"}))
+    result = asyncio.run(upstream.aget_json("/lines"))
+    assert result["status"] == 200
+    assert len(requests_seen) == 2
+
+
+def test_persistent_failure_returns_error(flaky_api):
+    script, _ = flaky_api
+    script.extend([502, 502, 502])
+    result = upstream.get_json("/lines")
+    assert result["status_code"] == 502
+
+
+def test_open_circuit_fails_fast_and_serves_stale(flaky_api, monkeypatch):
+    script, requests_seen = flaky_api
+    clock = FakeClock()
+    monkeypatch.setattr(upstream.response_cache, "_clock", clock)
+    upstream.get_json("/lines", {"page": 1})
+    clock.now += 3600
+    script.extend([httpx.ReadTimeout("slow")] * 3)
+    stale = upstream.get_json("/lines", {"page": 1})
+    assert stale["status"] == 200
+    assert upstream.breaker.state == "open"
+    sent = len(requests_seen)
+    assert upstream.get_json("/lines", {"page": 1})["status"] == 200
+    assert upstream.get_json("/lines", {"page": 2})["status_code"] == 503
+    assert len(requests_seen) == sent
+    assert upstream.response_cache.stats()["stale_hits"] == 2
@@ -0,0 +1,86 @@
+import json
+import time
+
+import httpx
+import pytest
+
+from bench import standin
+from server import serve, snapshot
+
+
+def call(body):
+    return {"jsonrpc": "2.0", "id": 1, **body}
+
+
+@pytest.fixture(scope="module")
+def worker():
+    """A worker application served over HTTP, its lifespan running (once per process)."""
+    with standin.serve(serve.create_app(), lifespan="on") as root:
+        yield root
+
+
+@pytest.fixture
+def local(sample_rows):
+    from server.snapshot import Snapshot
+
+    snapshot.install(Snapshot.from_rows(sample_rows))
+    yield
+    snapshot.install(None)
+
+
+# ---------------------------
+# ---- routes ----
+# ---------------------------
+
+def test_health_and_readiness(worker, monkeypatch):
+    health, ready = httpx.get(f"{worker}/healthz"), httpx.get(f"{worker}/readyz")
+    assert health.status_code == 200 and ready.status_code == 200
+    assert ready.json()["status"] == "ready"
+
+    monkeypatch.setenv("AGRIBALYSE_SNAPSHOT", "1")
+    loading = httpx.get(f"{worker}/readyz")
+    assert loading.status_code == 503 and loading.json()["status"] == "loading"
+
+
+def test_draining_worker_is_not_ready(worker):
+    serve._draining.set()
+    try:
+        ready = httpx.get(f"{worker}/readyz")
+    finally:
+        serve._draining.clear()
+    assert ready.status_code == 503 and ready.json()["status"] == "draining"
+
+
+def test_stateless_tool_call_without_session(worker, local):
+    headers = {"Accept": "application/json, text/event-stream"}
+    body = call({"method": "tools/call", "params": {"name": "resolve_product", "arguments": {"name": "carote"}}})
+    response = httpx.post(f"{worker}/mcp", json=body, headers=headers)
+    assert response.status_code == 200
+    assert "mcp-session-id" not in response.headers
+    data = next(line[len("data: "):] for line in response.text.splitlines() if line.startswith("data: "))
+    result = json.loads(json.loads(data)["result"]["content"][0]["text"])
+    assert result["candidates"][0]["Code_AGB"] == "20009"
+
+
+# ---------------------------
+# ---- process settings ----
+# ---------------------------
+
+def test_config_from_env(monkeypatch):
+    monkeypatch.setenv("AGRIBALYSE_PORT", "9100")
+    monkeypatch.setenv("AGRIBALYSE_WORKERS", "3")
+    monkeypatch.setenv("AGRIBALYSE_DRAIN_TIMEOUT", "12")
+    config = serve.config_from_env()
+    assert (config.port, config.workers, config.timeout_graceful_shutdown) == (9100, 3, 12)
+    assert config.app == "server.serve:create_app" and config.factory
+
+
+def test_exit_signal_drains_first():
+    server = serve.DrainingServer(serve.config_from_env(), drain_delay=0.1)
+    try:
+        server.handle_exit(15, None)
+        assert serve.draining() and not server.should_exit
+        time.sleep(0.3)
+        assert server.should_exit
+    finally:
+        serve._draining.clear()
@@ -0,0 +1,116 @@
+import httpx
+import numpy as np
+import pytest
+
+from server import snapshot, upstream
+from server.server import read_lines
+from server.snapshot import NumericColumn, Snapshot, TextColumn, Unsupported
+
+
+@pytest.fixture
+def local(sample_rows):
+    """Install a snapshot of the sample rows for the duration of a test."""
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+@pytest.fixture
+def api(sample_rows):
+    """data-fair stand-in serving the sample rows two by two, with next links."""
+    requests_seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests_seen.append(request)
+        page = int(request.url.params.get("page", 1))
+        size = min(int(request.url.params.get("size", 12)), 2)
+        results = sample_rows[(page - 1) * size:page * size]
+        body = {"total": len(sample_rows), "results": results}
+        if page * size < len(sample_rows):
+            body["next"] = str(request.url.copy_set_param("page", page + 1))
+        return httpx.Response(200, json=body)
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield requests_seen
+    upstream.configure(**previous.__dict__)
+
+
+# -------------------------------
+# columnar store
+# -------------------------------
+
+def test_columns_are_typed(local):
+    assert isinstance(local.columns["Score_unique_EF"], NumericColumn)
+    assert local.columns["Score_unique_EF"].values.dtype == np.float64
+    assert isinstance(local.columns["Groupe_d'aliment"], TextColumn)
+    assert len(local.columns["Groupe_d'aliment"].dictionary) < local.n_rows
+    assert local.columns["Code_CIQUAL"].kind == "integer"
+    assert local.columns["code_avion"].kind == "boolean"
+
+
+def test_rows_round_trip(local, sample_rows):
+    result = local.answer("/lines", {"page": 1, "size": len(sample_rows)})
+    assert result["total"] == len(sample_rows)
+    assert result["results"] == sample_rows
+
+
+# -------------------------------
+# /lines
+# -------------------------------
+
+def test_lines_pagination(local, sample_rows):
+    result = local.answer("/lines", {"page": 2, "size": 5})
+    assert [row["_i"] for row in result["results"]] == [6, 7, 8, 9, 10]
+    assert "page=3" in result["next"]
+    last = local.answer("/lines", {"page": 8, "size": 5})
+    assert "next" not in last
+
+
+def test_lines_sort_and_select(local, sample_rows):
+    result = local.answer("/lines", {"size": 100, "sort": "-Score_unique_EF", "select": "Code_AGB,Score_unique_EF"})
+    scores = [row["Score_unique_EF"] for row in result["results"]]
+    assert scores == sorted(scores, reverse=True)
+    assert set(result["results"][0]) == {"Code_AGB", "Score_unique_EF"}
+
+
+def test_lines_sort_missing_values_last(local):
+    result = local.answer("/lines", {"size": 100, "sort": "DQR", "select": "DQR"})
+    assert "DQR" not in result["results"][-1]
+    result = local.answer("/lines", {"size": 100, "sort": "-DQR", "select": "DQR"})
+    assert "DQR" not in result["results"][-1]
+
+
+def test_lines_sort_on_several_fields(local, sample_rows):
+    result = local.answer("/lines", {"size": 100, "sort": "Groupe_d'aliment,-Changement_climatique"})
+    keys = [(row["Groupe_d'aliment"], -row["Changement_climatique"]) for row in result["results"]]
+    assert keys == sorted(keys)
+
+
+def test_unsupported_requests_fall_back(local):
+    with pytest.raises(Unsupported):
+        local.answer("/lines", {"qs": "Score_unique_EF:0.5~"})
+    with pytest.raises(Unsupported):
+        local.answer("/lines", {"sort": "non_existing_column"})
+    assert snapshot.answer("/words_agg", {"field": "LCI_Name"}) is None
+
+
+def test_read_lines_is_served_locally(local, api):
+    result = read_lines(size=3, sort="Code_AGB")
+    assert len(result["results"]) == 3
+    assert api == []
+
+
+# -------------------------------
+# loading
+# -------------------------------
+
+def test_load_follows_next_links(api, sample_rows):
+    try:
+        snap = snapshot.load()
+        assert snap.n_rows == len(sample_rows)
+        assert snapshot.current() is snap
+        assert sum(r.url.path.endswith("/lines") for r in api) == len(sample_rows) // 2
+    finally:
+        snapshot.install(None)
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+from bench.run import percentile, summarize
+from bench.standin import DATASET_PATH, create_app, sample_rows as scaled_rows
+
+
+@pytest.fixture
+def client(sample_rows):
+    with TestClient(create_app(sample_rows), base_url="http://standin") as client:
+        yield client
+
+
+def get(client, path, **params):
+    return client.get(DATASET_PATH + path, params=params)
+
+
+# ---------------------------
+# ---- endpoints ----
+# ---------------------------
+
+def test_lines_next_link_points_at_the_standin(client, sample_rows):
+    first = get(client, "/lines", size=15, sort="_i").json()
+    assert first["total"] == len(sample_rows)
+    assert first["next"].startswith(f"http://standin{DATASET_PATH}/lines?")
+    second = client.get(first["next"]).json()
+    assert [r["_i"] for r in second["results"]] == [r["_i"] for r in sorted(sample_rows, key=lambda r: r["_i"])][15:30]
+
+
+def test_values_and_metrics(client, sample_rows):
+    groups = get(client, "/values/Groupe_d'aliment", size=100).json()
+    assert groups == sorted({r["Groupe_d'aliment"] for r in sample_rows})
+
+    dqr = [r["DQR"] for r in sample_rows if r.get("DQR") is not None]
+    avg = get(client, "/metric_agg", field="DQR", metric="avg").json()
+    assert avg["metric"] == pytest.approx(sum(dqr) / len(dqr))
+
+    simple = get(client, "/simple_metrics_agg").json()
+    assert set(simple["metrics"]["Score_unique_EF"]) == {"avg", "min", "max"}
+    assert "Code_CIQUAL" in simple["metrics"] and "code_avion" not in simple["metrics"]
+
+
+def test_words_agg_counts_rows_per_word(client, sample_rows):
+    result = get(client, "/words_agg", field="Nom_du_Produit_en_Français", q="pomme").json()
+    words = {r["word"]: r["total"] for r in result["results"]}
+    assert words["pomme"] == result["total"] > 0
+    assert "," not in words
+
+
+def test_unsupported_requests_are_rejected(client):
+    assert get(client, "/lines", select="Unknown").status_code == 400
+    assert get(client, "/metric_agg", field="DQR", metric="median").status_code == 400
+    assert get(client, "/words_agg", field="DQR").status_code == 400
+
+
+def test_metadata(client):
+    schema = get(client, "/schema").json()
+    assert all("key" in col and "label" in col for col in schema)
+    assert "_i" not in {col["key"] for col in get(client, "/safe-schema").json()}
+    assert "/lines" in get(client, "/api-docs.json").json()["paths"]
+    assert get(client, "/data-files").json() == []
+
+
+def test_latency_is_added(sample_rows):
+    with TestClient(create_app(sample_rows, latency=0.05)) as client:
+        start = time.perf_counter()
+        get(client, "/lines", size=1)
+        assert time.perf_counter() - start >= 0.05
+
+
+def test_scaled_rows_stay_distinct():
+    rows = scaled_rows(3)
+    assert len({r["Code_AGB"] for r in rows}) == len(rows)
+    assert [r["_i"] for r in rows] == list(range(1, len(rows) + 1))
+
+
+# ---------------------------
+# ---- benchmark report ----
+# ---------------------------
+
+def test_summarize_latencies():
+    stats = summarize([i / 1000 for i in range(1, 101)], elapsed=2.0, errors=1)
+    assert stats == {"calls": 100, "errors": 1, "throughput": 50.0, "p50_ms": 50.0, "p99_ms": 99.0}
+    assert percentile([0.1], 0.99) == 0.1
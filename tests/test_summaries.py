@@ -0,0 +1,102 @@
+import httpx
+import numpy as np
+import pytest
+
+from server import snapshot, upstream
+from server.server import get_group_summary
+from server.snapshot import Snapshot
+
+GROUP = "Groupe_d'aliment"
+SUB_GROUP = "Sous-groupe_d'aliment"
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+@pytest.fixture
+def api(sample_rows):
+    """Blocking transport serving the sample as a single /lines page, counting the requests."""
+    requests_seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests_seen.append(request)
+        return httpx.Response(200, json={"total": len(sample_rows), "results": sample_rows})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    snapshot._reference = None
+    yield requests_seen
+    snapshot._reference = None
+    upstream.configure(**previous.__dict__)
+
+
+def expected(rows, field, group, indicator):
+    values = np.array([r[indicator] for r in rows if r.get(field) == group and r.get(indicator) is not None])
+    return {
+        "count": len(values),
+        "mean": pytest.approx(values.mean()),
+        "min": values.min(),
+        "q1": pytest.approx(np.percentile(values, 25)),
+        "median": pytest.approx(np.median(values)),
+        "q3": pytest.approx(np.percentile(values, 75)),
+        "max": values.max(),
+    }
+
+
+# ---------------------------
+# ---- summaries ----
+# ---------------------------
+
+def test_statistics_per_group(local, sample_rows):
+    group = sample_rows[0][GROUP]
+    summary = local.summaries.get(GROUP, group)
+    assert summary["products"] == sum(r[GROUP] == group for r in sample_rows)
+    assert summary["indicators"]["Score_unique_EF"] == expected(sample_rows, GROUP, group, "Score_unique_EF")
+    assert set(local.summaries.names(GROUP)) == {r[GROUP] for r in sample_rows}
+
+
+def test_sub_groups_know_their_group(local, sample_rows):
+    row = sample_rows[0]
+    summary = local.summaries.get(SUB_GROUP, row[SUB_GROUP])
+    assert summary["group"] == row[GROUP]
+    assert summary["indicators"]["DQR"] == expected(sample_rows, SUB_GROUP, row[SUB_GROUP], "DQR")
+
+
+def test_lookup_ignores_case_and_accents(local, sample_rows):
+    group = sample_rows[0][GROUP]
+    assert local.summaries.resolve(GROUP, group.upper().replace("É", "E")) == group
+    assert local.summaries.get(GROUP, "nothing like it") is None
+
+
+# ---------------------------
+# ---- tool ----
+# ---------------------------
+
+def test_tool_answers_from_the_snapshot(local, sample_rows):
+    group = sample_rows[0][SUB_GROUP]
+    result = get_group_summary(group=group.upper(), field=SUB_GROUP, indicators=["Changement_climatique"])
+    assert result["name"] == group
+    assert list(result["indicators"]) == ["Changement_climatique"]
+
+    every = get_group_summary(indicators=["Score_unique_EF"])
+    assert set(every["groups"]) == {r[GROUP] for r in sample_rows}
+
+
+def test_tool_errors(local):
+    assert "error" in get_group_summary(field="LCI_Name")
+    assert "error" in get_group_summary(indicators=["Code_AGB"])
+    unknown = get_group_summary(group="Minerais")
+    assert "error" in unknown and unknown["available"]
+
+
+def test_without_snapshot_the_dataset_is_downloaded_once(api, sample_rows):
+    group = sample_rows[0][GROUP]
+    first = get_group_summary(group=group)
+    second = get_group_summary(group=group, indicators=["DQR"])
+    assert first["products"] == second["products"] == sum(r[GROUP] == group for r in sample_rows)
+    assert len(api) == 1
@@ -0,0 +1,110 @@
+import pytest
+
+from server import snapshot
+from server.server import get_metric_agg, get_values, read_lines
+from server.snapshot import Snapshot, Unsupported
+from server.text_index import fold, parse_query, tokenize
+
+
+@pytest.fixture
+def local(sample_rows):
+    snap = Snapshot.from_rows(sample_rows)
+    snapshot.install(snap)
+    yield snap
+    snapshot.install(None)
+
+
+def names(result):
+    return {row["Nom_du_Produit_en_Français"] for row in result["results"]}
+
+
+# -------------------------------
+# normalization
+# -------------------------------
+
+def test_fold_accents_and_ligatures():
+    assert fold("Bœuf, Épuisement, crème") == "boeuf, epuisement, creme"
+
+
+def test_tokenize_removes_elisions_stopwords_and_plurals():
+    assert tokenize("Lentille verte, bouillie/cuite à l'eau") == ["lentille", "verte", "bouillie", "cuite", "eau"]
+    assert tokenize("Tarte aux pommes") == ["tarte", "pomme"]
+
+
+def test_parse_query_modes():
+    terms = parse_query('pomme -"de terre" cru*')
+    assert [(t.tokens, t.prefix, t.negated) for t in terms] == [
+        (["pomme"], False, False), (["terre"], False, True), (["cru"], True, False)
+    ]
+    assert parse_query("pom", "complete")[0].prefix
+    with pytest.raises(ValueError):
+        parse_query("(pomme | poire)")
+
+
+# -------------------------------
+# search
+# -------------------------------
+
+def test_search_matches_accent_insensitive(local):
+    mask, _ = local.text_index.search("boeuf")
+    assert mask.sum() == 2
+    mask, _ = local.text_index.search("OEUF", ["Nom_du_Produit_en_Français"])
+    assert mask.sum() == 1
+
+
+def test_search_all_terms_must_match(local):
+    result = read_lines(q="pomme crue", size=50)
+    assert names(result) == {"Pomme, pulpe et peau, crue", "Pomme, pulpe, crue"}
+
+
+def test_search_restricted_to_q_fields(local):
+    everywhere = read_lines(q="apple", size=50)
+    product_names = read_lines(q="apple", q_fields=["Nom_du_Produit_en_Français"], size=50)
+    assert everywhere["total"] == 5
+    assert product_names["total"] == 0
+
+
+def test_search_negation_and_prefix(local):
+    result = read_lines(q="pomme -terre", size=50)
+    assert all("terre" not in name for name in names(result))
+    assert read_lines(q="choco*", size=50)["total"] == 1
+
+
+def test_complete_mode_matches_last_word_as_prefix(local):
+    assert local.answer("/lines", {"q": "pom", "q_mode": "simple"})["total"] == 0
+    assert local.answer("/lines", {"q": "pom", "q_mode": "complete"})["total"] > 0
+
+
+def test_results_sorted_by_relevance(local):
+    result = read_lines(q="pomme", size=50)
+    scores = [row["_score"] for row in result["results"]]
+    assert scores == sorted(scores, reverse=True)
+    ranked = [row["Nom_du_Produit_en_Français"] for row in result["results"]]
+    # Shorter values rank higher.
+    assert ranked.index("Compote de pomme") < ranked.index("Pomme, pulpe et peau, crue")
+
+
+def test_unsupported_query_falls_back(local):
+    with pytest.raises(Unsupported):
+        local.answer("/lines", {"q": "pomme | poire"})
+    with pytest.raises(Unsupported):
+        local.answer("/lines", {"q": "pomme", "q_fields": "Score_unique_EF"})
+
+
+# -------------------------------
+# other tools
+# -------------------------------
+
+def test_metric_agg_with_query(local, sample_rows):
+    result = get_metric_agg(metric="value_count", field="Score_unique_EF", q="pomme", q_fields=["Nom_du_Produit_en_Français"])
+    expected = [row for row in sample_rows if "pomme" in row["Nom_du_Produit_en_Français"].lower()]
+    assert result["total"] == result["metric"] == len(expected)
+
+
+def test_get_values_local(local, sample_rows):
+    groups = sorted({row["Groupe_d'aliment"] for row in sample_rows})
+    assert get_values(field="Groupe_d'aliment") == groups[:10]
+    assert get_values(field="Groupe_d'aliment", sort="desc", size=3) == groups[::-1][:3]
+    assert get_values(field="Sous-groupe_d'aliment", q="lait") == sorted({
+        row["Sous-groupe_d'aliment"] for row in sample_rows if row["Groupe_d'aliment"] == "lait et produits laitiers"
+    })
@@ -0,0 +1,65 @@
+import httpx
+import pytest
+
+from server import upstream
+from server.server import read_lines, get_values
+
+
+@pytest.fixture
+def api():
+    """Route the shared client to an in-memory transport recording every request."""
+    requests_seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests_seen.append(request)
+        if request.url.path.endswith("/missing"):
+            return httpx.Response(404, json={})
+        return httpx.Response(200, json={"total": 0, "results": []})
+
+    previous = upstream.settings()
+    upstream.configure(transport=httpx.MockTransport(handler))
+    yield requests_seen
+    upstream.configure(**previous.__dict__)
+
+
+# -------------------------------
+# shared client
+# -------------------------------
+
+def test_client_is_shared_between_calls(api):
+    first = upstream.get_client()
+    read_lines(size=1)
+    get_values(field="Groupe_d'aliment")
+    assert upstream.get_client() is first
+    assert len(api) == 2
+
+
+def test_tools_target_dataset_endpoints(api):
+    read_lines(select=["Code_AGB", "DQR"], size=2)
+    assert api[0].url.path.endswith("/agribalyse-31-synthese/lines")
+    assert api[0].url.params["select"] == "Code_AGB,DQR"
+
+
+def test_http_error_is_returned_as_dict(api):
+    result = upstream.get_json("/missing")
+    assert result["status_code"] == 404
+    assert "error" in result
+
+
+def test_configure_recreates_client(api):
+    first = upstream.get_client()
+    upstream.configure(max_connections=3, read_timeout=2.0)
+    client = upstream.get_client()
+    assert client is not first
+    assert upstream.settings().max_connections == 3
+    assert client.timeout.read == 2.0
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("AGRIBALYSE_HTTP_MAX_CONNECTIONS", "4")
+    monkeypatch.setenv("AGRIBALYSE_HTTP2", "true")
+    monkeypatch.setenv("AGRIBALYSE_HTTP_CONNECT_TIMEOUT", "1.5")
+    settings = upstream.UpstreamSettings.from_env()
+    assert settings.max_connections == 4
+    assert settings.http2 is True
+    assert settings.connect_timeout == 1.5